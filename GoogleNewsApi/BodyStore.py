@@ -0,0 +1,99 @@
+import sqlite3
+import sys
+import threading
+import zlib
+from time import time
+
+BODY_STORE_PATH = "ArticleBodies.sqlite3" # File holding the compressed article text of enriched documents
+BODY_COMPRESSION_LEVEL = 6 # zlib compression level for article text
+
+class BodyStore:
+    """On-disk store of zlib compressed article text keyed by document ID
+
+    The article text is searchable through the unstored body field of the
+    index, this keeps the text itself out of the index segments. Failed
+    fetches are counted too, so Enrich.py can give up on an article.
+    Uses WAL mode so WebAPI.py can read while Enrich.py writes."""
+
+    def __init__(self, path = None):
+        if path is None:
+            path = BODY_STORE_PATH
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS bodies (
+            id TEXT PRIMARY KEY,
+            body BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            stored_at REAL NOT NULL)""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS failures (
+            id TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL,
+            last_attempt REAL NOT NULL)""")
+        self.connection.commit()
+
+    def get(self, document_id):
+        """Get the article text of a document, or None if it isn't stored"""
+
+        with self.lock:
+            row = self.connection.execute("SELECT body FROM bodies WHERE id = ?", (document_id,)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def put_many(self, bodies):
+        """Store the article text of several documents in one transaction
+
+        Arguments:
+            bodies (list) - (document ID, article text) tuples"""
+
+        now = time()
+        rows = []
+        for document_id, text in bodies:
+            encoded = text.encode('utf-8')
+            rows.append((document_id, zlib.compress(encoded, BODY_COMPRESSION_LEVEL), len(encoded), now))
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO bodies (id, body, size, stored_at) VALUES (?, ?, ?, ?)", rows)
+            self.connection.executemany("DELETE FROM failures WHERE id = ?", [(row[0],) for row in rows])
+            self.connection.commit()
+
+    def record_failures(self, document_ids):
+        """Count a failed fetch for each document
+
+        Returns:
+            A dict of document IDs to the amount of times fetching them failed"""
+
+        now = time()
+        with self.lock:
+            self.connection.executemany("""INSERT INTO failures (id, attempts, last_attempt) VALUES (?, 1, ?)
+                ON CONFLICT(id) DO UPDATE SET attempts = attempts + 1, last_attempt = excluded.last_attempt""", [(document_id, now) for document_id in document_ids])
+            self.connection.commit()
+            return {document_id: self.connection.execute("SELECT attempts FROM failures WHERE id = ?", (document_id,)).fetchone()[0] for document_id in document_ids}
+
+    def failed_since(self, timestamp):
+        """Get the IDs of documents whose last fetch failed after timestamp"""
+
+        with self.lock:
+            return {row[0] for row in self.connection.execute("SELECT id FROM failures WHERE last_attempt >= ?", (timestamp,))}
+
+    def stats(self):
+        with self.lock:
+            bodies, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM bodies").fetchone()
+            failures = self.connection.execute("SELECT COUNT(*) FROM failures").fetchone()[0]
+            disk_size = self.connection.execute("PRAGMA page_count").fetchone()[0] * self.connection.execute("PRAGMA page_size").fetchone()[0]
+        return {'bodies': bodies, 'text_bytes': size, 'disk_bytes': disk_size, 'failures': failures}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def __main(argv):
+    path = BODY_STORE_PATH
+    if len(argv) > 1:
+        path = argv[1]
+    store = BodyStore(path)
+    print("{bodies} article bodies, {text_bytes} bytes of text in {disk_bytes} bytes on disk, {failures} failed articles".format(**store.stats()))
+    store.close()
+
+if __name__ == "__main__":
+    __main(sys.argv)
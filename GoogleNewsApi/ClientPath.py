@@ -0,0 +1,9 @@
+import os, os.path
+import sys
+
+# The scraper and API share the client modules in the repository root, which
+# isn't installed. Entry points import this before the modules that need them.
+CLIENT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
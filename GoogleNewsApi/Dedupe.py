@@ -0,0 +1,42 @@
+import hashlib
+import threading
+from article_cache import normalize_url # Document IDs hash the same normalized URL the article cache is keyed by
+
+def url_id(url):
+    """Get the unique document ID for an article URL"""
+
+    return hashlib.sha1(normalize_url(url).encode('utf-8')).hexdigest()
+
+class SeenURLs:
+    """In-memory set of article IDs already in the index
+
+    Seeded from the ID field's terms of every given index at startup, so
+    known articles can be skipped before they reach the index writer."""
+
+    def __init__(self, indexes = []):
+        self.ids = set()
+        self.lock = threading.Lock()
+        for ix in indexes:
+            if "ID" not in ix.schema:
+                continue
+            with ix.reader() as reader:
+                for term in reader.lexicon("ID"):
+                    self.ids.add(term.decode('utf-8'))
+
+    def add(self, document_id):
+        """Remember an ID, returning False if it was already known"""
+
+        with self.lock:
+            if document_id in self.ids:
+                return False
+            self.ids.add(document_id)
+            return True
+
+    def discard(self, document_ids):
+        """Forget IDs whose documents never made it into the index"""
+
+        with self.lock:
+            self.ids.difference_update(document_ids)
+
+    def __len__(self):
+        return len(self.ids)
@@ -0,0 +1,140 @@
+import sys
+from datetime import datetime
+from time import time, sleep
+from whoosh import index
+from whoosh.query import AndNot, Every, Term
+from whoosh.writing import AsyncWriter
+import ClientPath
+from Scrape import ARTICLE_INDEX_NAME, open_index
+from Shards import list_shards, shard_path, shard_name, freeze_shards
+from BodyStore import BodyStore
+from NearDup import column_lookup
+from article_pipeline import extract_articles
+
+ENRICH_BATCH = 100 # Documents fetched and committed at once
+ENRICH_DOWNLOADS = 16 # Maximum amount of articles downloaded at once
+ENRICH_DOWNLOADS_PER_HOST = 4 # Maximum amount of articles downloaded at once from one website
+ENRICH_MAX_ATTEMPTS = 3 # Failed fetches before an article is marked enriched without text
+ENRICH_RETRY_DELAY = 60 * 60 # Seconds before an article that failed to fetch is tried again
+ENRICH_INTERVAL = 5 * 60 # Seconds to wait for new documents once everything is enriched
+VERBOSE = True # Verbose mode
+
+UNENRICHED_QUERY = AndNot(Every(), Term('enriched', True))
+
+def find_unenriched(ix, limit, skip):
+    """Get the stored fields of up to limit documents in a shard that haven't been enriched yet
+
+    Documents whose ID is in skip are passed over, as are documents
+    without an ID, which were indexed before IDs were added. The signature
+    column isn't stored, so it's added to the stored fields of documents
+    that have one to keep it when they are written back."""
+
+    documents = []
+    with ix.searcher() as searcher:
+        signatures = column_lookup(searcher.reader(), 'signature')
+        for docnum in searcher.docs_for_query(UNENRICHED_QUERY):
+            document = searcher.stored_fields(docnum)
+            if document.get('ID') is None or document['ID'] in skip:
+                continue
+            signature = signatures(docnum)
+            if signature:
+                document['signature'] = signature
+            documents.append(document)
+            if len(documents) >= limit:
+                break
+    return documents
+
+def enrich_batch(ix, documents, store, verbose = False):
+    """Fetch the article text of documents and add it to the index and the body store
+
+    The text is written to the body store before the index commit, so a
+    document is never marked enriched without its text being stored.
+
+    Returns:
+        A tuple with the amount of documents enriched, the IDs of documents
+        that failed and will be tried again, and the amount of documents
+        given up on"""
+
+    texts = extract_articles([document['URL'] for document in documents], verbose=verbose, max_downloads=ENRICH_DOWNLOADS, max_per_host=ENRICH_DOWNLOADS_PER_HOST, cache=False)
+    bodies = []
+    failed_ids = []
+    for document, text in zip(documents, texts):
+        if text is None or text.strip() == "":
+            failed_ids.append(document['ID'])
+        else:
+            bodies.append((document['ID'], text))
+    store.put_many(bodies)
+    attempts = {}
+    if len(failed_ids) > 0:
+        attempts = store.record_failures(failed_ids)
+
+    retry_ids = []
+    given_up = 0
+    writer = AsyncWriter(ix)
+    try:
+        for document, text in zip(documents, texts):
+            if document['ID'] not in attempts:
+                writer.update_document(body=text, enriched=True, **document)
+            elif attempts[document['ID']] >= ENRICH_MAX_ATTEMPTS:
+                writer.update_document(enriched=True, **document)
+                given_up += 1
+            else:
+                retry_ids.append(document['ID'])
+        writer.commit()
+    except Exception:
+        writer.cancel()
+        raise
+    return len(bodies), retry_ids, given_up
+
+def enrich_round(shards, store, verbose = False):
+    """Enrich every unenriched document in every shard, newest shards first
+
+    Returns:
+        A tuple with the amount of documents enriched, failed and given up on"""
+
+    enriched = 0
+    failed = 0
+    given_up = 0
+    for name in list_shards(ARTICLE_INDEX_NAME):
+        skip = store.failed_since(time() - ENRICH_RETRY_DELAY)
+        # Look before opening the shard for writing, which would thaw a frozen shard
+        probe = index.open_dir(shard_path(ARTICLE_INDEX_NAME, name), readonly=True)
+        if "ID" not in probe.schema or "enriched" not in probe.schema:
+            if verbose:
+                print("Shard {} was indexed before enrichment was added, run Rebuild.py to enrich it".format(name))
+            continue
+        if len(find_unenriched(probe, 1, skip)) == 0:
+            continue
+        ix = shards.get(name)
+        while True:
+            documents = find_unenriched(ix, ENRICH_BATCH, skip)
+            if len(documents) == 0:
+                break
+            batch_enriched, retry_ids, batch_given_up = enrich_batch(ix, documents, store, verbose=verbose)
+            # The commit can finish in the background, don't pick the same documents up again meanwhile
+            skip.update(document['ID'] for document in documents)
+            enriched += batch_enriched
+            failed += len(retry_ids)
+            given_up += batch_given_up
+            if verbose:
+                print("Shard {0}: enriched {1} articles, {2} failed, gave up on {3}".format(name, batch_enriched, len(retry_ids), batch_given_up))
+    return enriched, failed, given_up
+
+def __main(argv):
+    once = len(argv) > 1 and argv[1] == "once"
+    shards = open_index()
+    store = BodyStore()
+    try:
+        while True:
+            enriched, failed, given_up = enrich_round(shards, store, verbose=VERBOSE)
+            freeze_shards(ARTICLE_INDEX_NAME, shard_name(datetime.today()), verbose=VERBOSE)
+            print("Enriched {0} articles, {1} failed, gave up on {2}".format(enriched, failed, given_up))
+            if once:
+                break
+            if enriched == 0:
+                sleep(ENRICH_INTERVAL)
+    finally:
+        store.close()
+
+if __name__ == "__main__":
+    __main(sys.argv)
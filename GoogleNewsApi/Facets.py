@@ -0,0 +1,186 @@
+import threading
+from datetime import datetime
+import numpy as np
+from whoosh.query import And, Every, DateRange, ConstantScoreQuery
+from whoosh.util.times import datetime_to_long
+
+FACET_INTERVALS = ('day', 'week', 'month') # Date bucket sizes of the date histogram
+DEFAULT_INTERVAL = 'day' # Date bucket size when the request doesn't specify one
+DEFAULT_SOURCE_LIMIT = 100 # Amount of sources returned when the request doesn't specify one
+
+_EPOCH = datetime_to_long(datetime(1970, 1, 1)) # Whoosh stores datetimes as microseconds since year 1
+_DAY = 24 * 60 * 60 * 1000000
+
+class SegmentColumns:
+    """The source and date of every document in one segment as NumPy arrays
+
+    Indexed by document number within the segment, deleted documents
+    included. Sources are stored as codes into source_names, dates as the
+    raw microsecond values, -1 for documents without a date. Segments from
+    before source and date were sortable have no columns, they are read
+    from the stored fields instead. Rebuild.py adds the columns."""
+
+    def __init__(self, reader):
+        doc_count = reader.doc_count_all()
+
+        source_codes = {}
+        if reader.has_column('source'):
+            self.sources = np.fromiter((source_codes.setdefault(source, len(source_codes)) for source in reader.column_reader('source')), dtype=np.int32, count=doc_count)
+        else:
+            self.sources = np.full(doc_count, source_codes.setdefault("", 0), dtype=np.int32)
+            for docnum, document in reader.iter_docs():
+                self.sources[docnum] = source_codes.setdefault(document.get('source', ""), len(source_codes))
+        self.source_names = list(source_codes)
+
+        if reader.has_column('date'):
+            # Documents without a date hold the largest unsigned value, which wraps to -1
+            self.dates = np.fromiter(reader.column_reader('date', translate=False), dtype=np.uint64, count=doc_count).astype(np.int64)
+        else:
+            self.dates = np.full(doc_count, -1, dtype=np.int64)
+            for docnum, document in reader.iter_docs():
+                if document.get('date') is not None:
+                    self.dates[docnum] = datetime_to_long(document['date'])
+
+class ShardColumns:
+    """The columns of every segment of one shard generation joined into shard-wide arrays
+
+    Also holds the document numbers that aren't deleted (live) and the
+    date of each document as days since 1970-01-01 (days)."""
+
+    def __init__(self, reader, segment_columns):
+        source_codes = {}
+        sources = [np.zeros(0, dtype=np.int32)]
+        dates = [np.zeros(0, dtype=np.int64)]
+        live = [np.zeros(0, dtype=np.int64)]
+        for (leaf, offset), columns in zip(reader.leaf_readers(), segment_columns):
+            codes = np.array([source_codes.setdefault(source, len(source_codes)) for source in columns.source_names], dtype=np.int32)
+            sources.append(codes[columns.sources])
+            dates.append(columns.dates)
+            leaf_live = np.ones(len(columns.dates), dtype=bool)
+            leaf_live[np.fromiter(leaf.segment().deleted_docs(), dtype=np.int64)] = False
+            live.append(np.flatnonzero(leaf_live) + offset)
+        self.source_names = list(source_codes)
+        self.sources = np.concatenate(sources)
+        self.dates = np.concatenate(dates)
+        self.live = np.concatenate(live)
+        self.days = np.where(self.dates >= 0, (self.dates - _EPOCH) // _DAY, -1)
+
+class ColumnCache:
+    """Keeps the columns of every segment and of the latest generation of every shard
+
+    Segments never change once written, so a commit that adds a small
+    segment only loads the columns of that segment, the shard-wide arrays
+    are then joined again from the cached ones. Segments merged away are
+    dropped."""
+
+    def __init__(self):
+        self.segments = {}
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def get(self, name, searcher):
+        reader = searcher.reader()
+        generation = reader.generation()
+        with self.lock:
+            entry = self.shards.get(name)
+        if entry is not None and entry[0] == generation:
+            return entry[1]
+
+        segment_ids = []
+        segment_columns = []
+        for leaf, _ in reader.leaf_readers():
+            segment_id = (name, leaf.segment().segment_id())
+            with self.lock:
+                columns = self.segments.get(segment_id)
+            if columns is None:
+                columns = SegmentColumns(leaf)
+            segment_ids.append(segment_id)
+            segment_columns.append(columns)
+        columns = ShardColumns(reader, segment_columns)
+
+        with self.lock:
+            self.shards[name] = (generation, columns, segment_ids)
+            self.segments.update(zip(segment_ids, segment_columns))
+            in_use = set(segment_id for shard in self.shards.values() for segment_id in shard[2])
+            for segment_id in list(self.segments):
+                if segment_id not in in_use:
+                    del self.segments[segment_id]
+        return columns
+
+def matching_docs(searcher, columns, plan):
+    """Get the document numbers matching a planned query as a NumPy array
+
+    Queries that only select a date range are answered from the date
+    column without running them on the index"""
+
+    parts = [plan.query]
+    if plan.filter is not None:
+        parts.append(plan.filter)
+    parts = [part.child if isinstance(part, ConstantScoreQuery) else part for part in parts]
+    parts = [part for part in parts if not isinstance(part, Every)]
+
+    if all(isinstance(part, DateRange) and part.fieldname == 'date' for part in parts):
+        docs = columns.live
+        for part in parts:
+            dates = columns.dates[docs]
+            mask = dates >= 0
+            if part.start is not None:
+                mask &= (dates > part.start) if part.startexcl else (dates >= part.start)
+            if part.end is not None:
+                mask &= (dates < part.end) if part.endexcl else (dates <= part.end)
+            docs = docs[mask]
+        return docs
+
+    query = parts[0] if len(parts) == 1 else And(parts)
+    return np.fromiter(searcher.docs_for_query(query), dtype=np.int64)
+
+def date_buckets(days, interval):
+    """Get the start of the day, week (starting Monday) or month bucket of every day as datetime64"""
+
+    if interval == 'week':
+        # 1970-01-01 was a Thursday
+        days = days - (days + 3) % 7
+    buckets = days.astype('datetime64[D]')
+    if interval == 'month':
+        buckets = buckets.astype('datetime64[M]')
+    return buckets
+
+def count_facets(named_searchers, plan, interval, column_cache, source_limit = DEFAULT_SOURCE_LIMIT):
+    """Count the articles matching a planned query per source and per date bucket
+
+    Only the cached columns of each shard are read, no stored fields are
+    loaded.
+
+    Arguments:
+        named_searchers (list) - (shard name, searcher) tuples, see ShardedSearcherPool.shard_searchers
+        plan (QueryPlan) - The planned query, its limit and offset are ignored
+        interval (string) - One of FACET_INTERVALS
+        column_cache (ColumnCache) - Where to take the columns of each shard from
+        source_limit (int) - How many of the most common sources to return
+
+    Returns:
+        A tuple with the amount of matching articles, a list of
+        (source, count) tuples with the most common first, and a list of
+        (bucket start, count) tuples in date order"""
+
+    total = 0
+    source_counts = {}
+    date_counts = {}
+    for name, searcher in named_searchers:
+        columns = column_cache.get(name, searcher)
+        docs = matching_docs(searcher, columns, plan)
+        total += len(docs)
+
+        counts = np.bincount(columns.sources[docs], minlength=len(columns.source_names))
+        for code in np.flatnonzero(counts).tolist():
+            source = columns.source_names[code]
+            if source != "":
+                source_counts[source] = source_counts.get(source, 0) + int(counts[code])
+
+        days = columns.days[docs]
+        buckets, bucket_counts = np.unique(date_buckets(days[days >= 0], interval), return_counts=True)
+        for bucket, count in zip(np.datetime_as_string(buckets).tolist(), bucket_counts.tolist()):
+            date_counts[bucket] = date_counts.get(bucket, 0) + count
+
+    sources = sorted(source_counts.items(), key=lambda item: (-item[1], item[0]))[:source_limit]
+    return total, sources, sorted(date_counts.items())
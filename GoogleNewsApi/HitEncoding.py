@@ -0,0 +1,85 @@
+import importlib
+import json
+from functools import lru_cache
+from werkzeug.http import http_date
+
+JSON_ENCODER = "auto" # JSON library hits are encoded with: orjson, ujson or json, auto = the first of them that is installed
+HIT_LAYOUTS = ('rows', 'columns') # rows = a list with one object per article, columns = an object with one list per field
+DEFAULT_LAYOUT = 'rows' # Layout when the request doesn't specify one
+
+# Fields of a hit record, in the sorted key order Flask's encoder writes them in
+HIT_FIELDS = ('URL', 'articletext', 'cluster', 'date', 'description', 'source', 'title')
+
+@lru_cache(maxsize=4096)
+def format_date(date):
+    """Format a date the way Flask's encoder does, articles share few enough dates to format each one once"""
+
+    return http_date(date)
+
+def hit_record(stored_fields, articletext = None):
+    """Turn the stored fields of a hit into a tuple with one value per HIT_FIELDS entry
+
+    Fields the document doesn't have are None, the date is already
+    formatted, so every value can be encoded as is. The ID is left out like
+    in every response.
+
+    Arguments:
+        stored_fields (dict) - The hit's stored fields, see Searcher.stored_fields
+        articletext (string) - The article text, None if it wasn't requested"""
+
+    date = stored_fields.get('date')
+    if date is not None:
+        date = format_date(date)
+    return (stored_fields.get('URL'), articletext, stored_fields.get('cluster'), date, stored_fields.get('description'), stored_fields.get('source'), stored_fields.get('title'))
+
+def _load_dumps(name):
+    if name == 'json':
+        # Keys are already sorted and dates formatted, so this matches flask.json.dumps byte for byte
+        return json.dumps
+    module = importlib.import_module(name)
+    if name == 'orjson':
+        return lambda obj: module.dumps(obj).decode('utf-8')
+    if name == 'ujson':
+        return lambda obj: module.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+    raise ValueError("Unknown JSON encoder " + name)
+
+class HitEncoder:
+    """Encodes hit records to JSON in either layout
+
+    With name set to auto the fastest installed JSON library is used,
+    orjson or ujson output differs from the standard library's only in
+    whitespace and in not escaping non-ASCII characters. If the requested
+    library isn't installed the standard library is used instead, name
+    holds the one actually in use."""
+
+    def __init__(self, name = None):
+        if name is None:
+            name = JSON_ENCODER
+        candidates = [name, 'json']
+        if name == 'auto':
+            candidates = ['orjson', 'ujson', 'json']
+        for candidate in candidates:
+            try:
+                self.dumps = _load_dumps(candidate)
+            except ImportError:
+                continue
+            self.name = candidate
+            break
+
+    def row(self, record):
+        """Get the object of one article in the rows layout, leaving out the fields it doesn't have"""
+
+        return {name: value for name, value in zip(HIT_FIELDS, record) if value is not None}
+
+    def encode_row(self, record):
+        return self.dumps(self.row(record))
+
+    def encode(self, records, layout = DEFAULT_LAYOUT):
+        """Encode the hit records of a page as a JSON article list (rows) or an object of field lists (columns)
+
+        In the columns layout a field is only left out if no article has it,
+        articles without it get null"""
+
+        if layout == 'columns':
+            return self.dumps({name: values for name, values in zip(HIT_FIELDS, zip(*records)) if any(value is not None for value in values)})
+        return self.dumps([self.row(record) for record in records])
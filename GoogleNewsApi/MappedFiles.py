@@ -0,0 +1,83 @@
+import io
+import mmap
+from whoosh.codec.whoosh3 import W3Segment
+from whoosh.filedb.filestore import FileStorage
+from whoosh.filedb.structfile import BufferFile
+
+COMPOUND_EXT = W3Segment.COMPOUND_EXT # Extension of the files holding a compound segment
+
+class MemoryFile(io.RawIOBase):
+    """Read-only file over a buffer that only copies the bytes being read"""
+
+    def __init__(self, buf):
+        self._view = memoryview(buf)
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size = -1):
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, self._position + size)
+        data = self._view[self._position:end].tobytes()
+        self._position = max(self._position, end)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, position, whence = io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            position += self._position
+        elif whence == io.SEEK_END:
+            position += len(self._view)
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+class MappedFile(BufferFile):
+    """Whoosh file over a buffer whose subsets are views of the buffer instead of copies"""
+
+    def __init__(self, buf, name = None, onclose = None):
+        self._buf = buf
+        self._name = name
+        self.file = MemoryFile(buf)
+        self.onclose = onclose
+        self.is_real = False
+        self.is_closed = False
+
+    def subset(self, position, length, name = None):
+        return MappedFile(self._buf[position:position + length], name=name or self._name)
+
+class MappedStorage(FileStorage):
+    """Whoosh storage that reads the files inside compound segments straight from the segment's memory map
+
+    Whoosh 2.7 copies every file it opens from a compound segment, so each
+    pooled searcher held a private copy of the postings, terms and columns
+    of every segment. Read through views of the map, the only copy is the
+    one in the OS page cache, which every searcher and every Serve.py
+    worker share. Files outside compound segments are read the usual way."""
+
+    def __init__(self, path, readonly = False):
+        # Without mmap support CompoundStorage reads through subset() of the compound file
+        super().__init__(path, supports_mmap=False, readonly=readonly)
+
+    def open_file(self, name, **kwargs):
+        if not name.endswith(COMPOUND_EXT):
+            return super().open_file(name, **kwargs)
+        with open(self._fpath(name), 'rb') as segment_file:
+            segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return MappedFile(memoryview(segment_map), name=name)
+
+def open_mapped_index(path):
+    """Open the index in path read-only through a MappedStorage"""
+
+    return MappedStorage(path, readonly=True).open_index()
@@ -0,0 +1,62 @@
+import threading
+from timings import StageTimer
+
+METRICS_ENABLED = True # Whether stage durations are recorded for the /metrics endpoint
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Upper bounds in seconds
+
+class Histogram:
+    """Prometheus style latency histogram with one series per label value"""
+
+    def __init__(self, name, help_text, label, buckets = HISTOGRAM_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_value, seconds, count = 1):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][position] += count
+            series[1] += seconds
+            series[2] += count
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.help_text), "# TYPE {} histogram".format(self.name)]
+        with self.lock:
+            for label_value in sorted(self.series):
+                bucket_counts, total, count = self.series[label_value]
+                for bound, bucket_count in zip(self.buckets, bucket_counts):
+                    lines.append('{0}_bucket{{{1}="{2}",le="{3}"}} {4}'.format(self.name, self.label, label_value, bound, bucket_count))
+                lines.append('{0}_bucket{{{1}="{2}",le="+Inf"}} {3}'.format(self.name, self.label, label_value, count))
+                lines.append('{0}_sum{{{1}="{2}"}} {3}'.format(self.name, self.label, label_value, total))
+                lines.append('{0}_count{{{1}="{2}"}} {3}'.format(self.name, self.label, label_value, count))
+        return "\n".join(lines)
+
+stage_histogram = Histogram("articleapi_stage_seconds", "Time spent in each stage of serving a request", "stage")
+request_histogram = Histogram("articleapi_request_seconds", "Total time spent serving a request", "endpoint")
+
+def stage_timer(keep = False):
+    """Get a StageTimer for one request
+
+    Durations go into the stage histogram when METRICS_ENABLED is set and
+    are kept for a per-request timings object when keep is set"""
+
+    observe = None
+    if METRICS_ENABLED:
+        observe = stage_histogram.observe
+    return StageTimer(enabled=keep, observe=observe)
+
+def observe_request(endpoint, seconds):
+    if METRICS_ENABLED:
+        request_histogram.observe(endpoint, seconds)
+
+def render_metrics(extra_lines = []):
+    """Get every metric in the Prometheus text exposition format"""
+
+    return "\n".join([stage_histogram.render(), request_histogram.render()] + list(extra_lines)) + "\n"
@@ -0,0 +1,157 @@
+import re
+import threading
+import zlib
+from bisect import bisect_right
+import numpy as np
+
+NEARDUP_SHINGLE_SIZE = 3 # Words per shingle
+NEARDUP_BANDS = 16 # LSH bands, more bands find candidates with lower similarity
+NEARDUP_ROWS = 4 # MinHash values per band, NEARDUP_BANDS * NEARDUP_ROWS permutations in total
+NEARDUP_THRESHOLD = 0.7 # Estimated Jaccard similarity above which two articles are the same story
+NEARDUP_SEED = 20200101 # Seed of the MinHash permutations, changing it changes every signature
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_SHINGLE_MULTIPLIERS = np.array([0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F, 0x165667B1], dtype=np.uint64)
+_WORD_PATTERN = re.compile(r"\w+")
+
+_permutation_generator = np.random.RandomState(NEARDUP_SEED)
+_PERMUTATION_A = _permutation_generator.randint(1, (1 << 31) - 1, size=NEARDUP_BANDS * NEARDUP_ROWS).astype(np.uint64)
+_PERMUTATION_B = _permutation_generator.randint(0, (1 << 31) - 1, size=NEARDUP_BANDS * NEARDUP_ROWS).astype(np.uint64)
+
+def shingle_hashes(text):
+    """Hash every run of NEARDUP_SHINGLE_SIZE words in text to a 31 bit integer
+
+    Words are hashed once, shingle hashes are then mixed from the word
+    hashes for every position at once"""
+
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    word_hashes = np.fromiter((zlib.crc32(word.encode('utf-8')) for word in words), dtype=np.uint64, count=len(words))
+    size = min(NEARDUP_SHINGLE_SIZE, len(words))
+    shingles = np.zeros(len(words) - size + 1, dtype=np.uint64)
+    for offset in range(size):
+        shingles ^= word_hashes[offset:len(words) - size + 1 + offset] * _SHINGLE_MULTIPLIERS[offset]
+    return np.unique(shingles % _MERSENNE_PRIME)
+
+def minhash(text):
+    """Get the MinHash signature of text, an array with one value per permutation
+
+    Every permutation is applied to every shingle in one (a * x + b) mod p
+    step, so the cost is one NumPy broadcast per article"""
+
+    shingles = shingle_hashes(text)
+    if len(shingles) == 0:
+        return np.full(NEARDUP_BANDS * NEARDUP_ROWS, _MERSENNE_PRIME, dtype=np.uint32)
+    # Every value is below the 31 bit prime, so the signature fits in half the memory
+    return ((_PERMUTATION_A[:, None] * shingles[None, :] + _PERMUTATION_B[:, None]) % _MERSENNE_PRIME).min(axis=1).astype(np.uint32)
+
+def similarity(signature, other_signature):
+    """Estimate the Jaccard similarity of two articles from their signatures"""
+
+    return float(np.count_nonzero(signature == other_signature)) / len(signature)
+
+def article_text(title, description):
+    """Get the text articles are clustered on"""
+
+    return title + " " + description
+
+def column_lookup(reader, fieldname):
+    """Get a function that looks up the column value of a document number of reader
+
+    Whoosh's MultiReader.column_reader leaves out segments without the
+    column, which shifts the document numbers of every later segment, so
+    the column of each segment is read on its own. Documents in segments
+    without the column get None."""
+
+    leaves = reader.leaf_readers()
+    offsets = [offset for _, offset in leaves]
+    columns = [leaf.column_reader(fieldname) if fieldname in leaf.schema and leaf.has_column(fieldname) else None for leaf, _ in leaves]
+
+    def lookup(docnum):
+        segment = bisect_right(offsets, docnum) - 1
+        if columns[segment] is None:
+            return None
+        return columns[segment][docnum - offsets[segment]]
+    return lookup
+
+class NearDuplicateIndex:
+    """Assigns articles to clusters of near-duplicates with MinHash LSH
+
+    Only the first article of every cluster, its representative, is kept
+    in the LSH buckets. A new article is compared with the representatives
+    that share at least one band with it and joins the most similar one
+    above NEARDUP_THRESHOLD, otherwise it starts a cluster of its own. The
+    cluster ID is the document ID of the representative.
+
+    Seeded from the representatives in every given index at startup. The
+    signature of every representative is kept in the signature column, so
+    seeding only reads the cluster and signature columns. Segments written
+    before the column existed are hashed again from their stored fields,
+    there documents from before clustering was added count as
+    representatives and documents from before IDs were added are left
+    out. Rebuild.py adds the column to every segment."""
+
+    def __init__(self, indexes = [], threshold = NEARDUP_THRESHOLD):
+        self.threshold = threshold
+        self.buckets = {}
+        self.signatures = {}
+        self.lock = threading.Lock()
+        for ix in indexes:
+            with ix.reader() as reader:
+                for leaf, _ in reader.leaf_readers():
+                    self._seed(leaf)
+
+    def _seed(self, reader):
+        if 'signature' in reader.schema and reader.has_column('signature') and reader.has_column('cluster'):
+            for docnum, (cluster, signature) in enumerate(zip(reader.column_reader('cluster'), reader.column_reader('signature'))):
+                if signature and not reader.is_deleted(docnum):
+                    self._add_signature(cluster, np.frombuffer(signature, dtype=np.uint32))
+            return
+        for _, document in reader.iter_docs():
+            if document.get('ID') is not None and document.get('cluster', document['ID']) == document['ID']:
+                self._add_signature(document['ID'], minhash(article_text(document['title'], document['description'])))
+
+    def _bands(self, signature):
+        return [(band, signature[band * NEARDUP_ROWS:(band + 1) * NEARDUP_ROWS].tobytes()) for band in range(NEARDUP_BANDS)]
+
+    def add(self, document_id, text):
+        """Cluster an article
+
+        Returns:
+            The cluster ID of the article"""
+
+        signature = minhash(text)
+        bands = self._bands(signature)
+        with self.lock:
+            candidates = set()
+            for band_key in bands:
+                candidates.update(self.buckets.get(band_key, ()))
+            best_cluster = None
+            best_similarity = self.threshold
+            for candidate in candidates:
+                candidate_similarity = similarity(signature, self.signatures[candidate])
+                if candidate_similarity >= best_similarity:
+                    best_cluster = candidate
+                    best_similarity = candidate_similarity
+            if best_cluster is not None:
+                return best_cluster
+
+            self._add_signature(document_id, signature, bands)
+            return document_id
+
+    def signature_bytes(self, document_id):
+        """Get the signature of a cluster's representative as stored in the signature column"""
+
+        with self.lock:
+            return self.signatures[document_id].tobytes()
+
+    def _add_signature(self, document_id, signature, bands = None):
+        if bands is None:
+            bands = self._bands(signature)
+        self.signatures[document_id] = signature
+        for band_key in bands:
+            self.buckets.setdefault(band_key, []).append(document_id)
+
+    def __len__(self):
+        return len(self.signatures)
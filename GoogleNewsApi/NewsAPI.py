@@ -1,9 +1,51 @@
 import json
+from concurrent.futures import ThreadPoolExecutor
 from time import time
 from datetime import datetime, timedelta
 from GoogleNews import GoogleNews
-
-def GetGoogleArticles(topic = None, sources = [], language='en', time_range = None, time_period = None, encoding = 'utf-8', pages = 3, verbose = False):
+from PageCache import get_shared_page_cache, page_key, window_closed
+
+PAGE_WORKERS = 3 # Maximum amount of result pages of one search fetched at once
+USE_PAGE_CACHE = True # Whether to keep result pages in the shared on-disk page cache
+
+class _PageClient(GoogleNews):
+    """GoogleNews client that fetches one result page
+
+    search() always fetches results right away (the first page, or the
+    RSS feed in newer GoogleNews versions), so set_key() runs it with the
+    fetching methods shadowed to only set up the search key. Every page
+    gets its own client, a client keeps the results of every page it
+    fetched."""
+
+    def set_key(self, search_string):
+        self.get_page = self.get_news = lambda *args, **kwargs: None
+        try:
+            self.search(search_string)
+        finally:
+            del self.get_page
+            del self.get_news
+
+def _fetch_page(search_string, language, encoding, time_range, time_period, page, rate_limit):
+    googlenews = _PageClient(lang=language, encode=encoding)
+    if time_period is not None:
+        googlenews.set_period(time_period)
+    elif time_range is not None:
+        googlenews.set_time_range(time_range[0], time_range[1])
+    else:
+        googlenews.set_period('7d')
+    googlenews.set_key(search_string)
+
+    if rate_limit is not None:
+        rate_limit.acquire()
+    googlenews.get_page(page=page)
+    results = []
+    for result in googlenews.results():
+        if isinstance(result['datetime'], datetime):
+            result['datetime'] = result['datetime'].strftime('%m/%d/%Y')
+        results.append(result)
+    return results
+
+def GetGoogleArticles(topic = None, sources = [], language='en', time_range = None, time_period = None, encoding = 'utf-8', pages = 3, verbose = False, rate_limit = None, cache = None):
     """Get a JSON object containing Google News article data
 
 
@@ -26,6 +68,10 @@ def GetGoogleArticles(topic = None, sources = [], language='en', time_range = No
                 3 by default, each page has roughly 10-20 articles
         verbose (bool) - Whether to show verbose output
                 False by default
+        rate_limit (TokenBucket) - Taken from before every page request
+                No limit by default
+        cache (PageCache) - Cache to use, the shared page cache by default if USE_PAGE_CACHE is set
+                Pass False to skip the cache
 
     Returns:
         A string formatted JSON object with a status code, result quantity,
@@ -47,7 +93,8 @@ def GetGoogleArticles(topic = None, sources = [], language='en', time_range = No
     else:
         search_string = topic
 
-    googlenews = GoogleNews(lang=language, encode=encoding)
+    if cache is None and USE_PAGE_CACHE:
+        cache = get_shared_page_cache()
 
     if len(sources) > 0:
         for source in sources:
@@ -56,11 +103,9 @@ def GetGoogleArticles(topic = None, sources = [], language='en', time_range = No
             search_string += (" " + str(source))
 
     if time_period is not None:
-        googlenews.set_period(time_period)
         if verbose:
             print("Using a time period of {}".format(time_period))
     elif time_range is not None:
-        googlenews.set_time_range(time_range[0], time_range[1])
         # start_date = datetime.strptime(time_range[0], '%m/%d/%Y') - timedelta(days=1)
         # end_date = datetime.strptime(time_range[1], '%m/%d/%Y') + timedelta(days=1)
         # search_string += (" after:{} before:{}".format(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
@@ -68,23 +113,35 @@ def GetGoogleArticles(topic = None, sources = [], language='en', time_range = No
             # print("Using a time range of {0} to {1}".format(start_date.strftime('%m/%d/%Y'), end_date.strftime('%m/%d/%Y')))
             print("Using a time range of {0} to {1}".format(time_range[0], time_range[1]))
     else:
-        googlenews.set_period('7d')
         if verbose:
             print("Using default time period of 7d")
 
     if verbose:
         print("Current search string: {0}".format(str(search_string)))
 
-    googlenews.search(search_string)
-
+    page_results = {}
+    page_keys = {}
     for i in range(1, pages + 1):
+        page_keys[i] = page_key(search_string, language, encoding, time_range, time_period, i)
+        if cache:
+            page_results[i] = cache.get(page_keys[i])
+            if verbose and page_results[i] is not None:
+                print("Using cached page {}".format(i))
+
+    missing_pages = [i for i in range(1, pages + 1) if page_results.get(i) is None]
+    if len(missing_pages) > 0:
         if verbose:
-            print("Getting page {}".format(i))
-        if i > 1:
-            googlenews.get_page(page=i)
-        for result in googlenews.results():
-            if isinstance(result['datetime'], datetime):
-                result['datetime'] = result['datetime'].strftime('%m/%d/%Y')
+            print("Getting pages {}".format(missing_pages))
+        with ThreadPoolExecutor(max_workers=min(PAGE_WORKERS, len(missing_pages))) as page_pool:
+            fetched = page_pool.map(lambda i: _fetch_page(search_string, language, encoding, time_range, time_period, i, rate_limit), missing_pages)
+            for i, results in zip(missing_pages, fetched):
+                page_results[i] = results
+                if cache:
+                    # Empty pages can also mean Google refused the request, so they always expire
+                    cache.put(page_keys[i], results, window_closed(time_range, time_period) and len(results) > 0)
+
+    for i in range(1, pages + 1):
+        for result in page_results[i]:
             return_json['articles'].append(result)
             return_json['results'] += 1
             if verbose:
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import sys
+import threading
+from datetime import datetime, timedelta
+from time import time
+
+PAGE_CACHE_PATH = "PageCache.sqlite3" # File to keep Google News result pages in
+PAGE_CACHE_TTL = 30 * 60 # Seconds a page is kept when its time window is still open or it came back empty
+PAGE_CACHE_CLOSED_AFTER = 1 # Days after the end of a time range before its pages are kept forever
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def page_key(search_string, language, encoding, time_range, time_period, page):
+    """Build the cache key of one result page from the full query"""
+
+    if time_range is not None:
+        time_range = list(time_range)
+    return json.dumps([search_string, language, encoding, time_range, time_period, page])
+
+def window_closed(time_range, time_period):
+    """Check whether new articles can no longer show up in a search window
+
+    Only absolute time ranges that ended more than PAGE_CACHE_CLOSED_AFTER
+    days ago are closed, relative time periods move with the current date"""
+
+    if time_period is not None or time_range is None:
+        return False
+    end_date = datetime.strptime(time_range[1], '%m/%d/%Y')
+    return end_date + timedelta(days=PAGE_CACHE_CLOSED_AFTER) < datetime.today()
+
+class PageCache:
+    """On-disk cache of Google News result pages keyed by the full query
+
+    Pages of closed time windows never expire, everything else expires
+    after ttl seconds."""
+
+    def __init__(self, path = None, ttl = None):
+        if path is None:
+            path = PAGE_CACHE_PATH
+        if ttl is None:
+            ttl = PAGE_CACHE_TTL
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            key TEXT PRIMARY KEY,
+            results TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            expires_at REAL)""")
+        self.connection.commit()
+
+    def get(self, key):
+        """Get the cached results of a page, or None if it isn't cached or has expired"""
+
+        with self.lock:
+            row = self.connection.execute("SELECT results FROM pages WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time())).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, results, permanent):
+        """Cache the results of a page, forever if permanent is set"""
+
+        now = time()
+        expires_at = None
+        if not permanent:
+            expires_at = now + self.ttl
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO pages (key, results, fetched_at, expires_at) VALUES (?, ?, ?, ?)", (key, json.dumps(results), now, expires_at))
+            self.connection.execute("DELETE FROM pages WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            pages, permanent = self.connection.execute("SELECT COUNT(*), COUNT(*) - COUNT(expires_at) FROM pages").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'pages': pages, 'permanent': permanent}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+def get_shared_page_cache():
+    """Get the page cache shared by every search in this process"""
+
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = PageCache()
+        return _shared_cache
+
+def __main(argv):
+    path = PAGE_CACHE_PATH
+    if len(argv) > 1:
+        path = argv[1]
+    cache = PageCache(path)
+    print("{pages} cached pages, {permanent} of them permanent".format(**cache.stats()))
+    cache.close()
+
+if __name__ == "__main__":
+    __main(sys.argv)
@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import json
+from collections import namedtuple
+from datetime import datetime
+from whoosh.query import And, Or, Every, DateRange, ConstantScoreQuery
+from whoosh.qparser import QueryParser, MultifieldParser
+
+DEFAULT_AMOUNT = 50 # Amount of articles returned when the request doesn't specify one
+TOPIC_FIELDS = ["title", "description", "body"] # Fields searched for the topic argument, body is only filled in by Enrich.py
+DATE_FORMAT = "%m-%d-%Y" # Format of the start_date/end_date arguments
+PAGE_SIZE = 50 # Amount of articles per page when paginating with page_size/cursor
+SEARCH_ARGUMENTS = ('topic', 'source', 'start_date', 'end_date', 'amount', 'combine', 'collapse') # Request arguments that change the results
+
+QueryPlan = namedtuple('QueryPlan', ['query', 'filter', 'limit', 'offset', 'page_size', 'start_date', 'end_date', 'with_text', 'collapse'])
+
+def parse_bool(value):
+    return str(value).strip().lower() in ('true', '1', 'yes', 'on')
+
+def normalize_args(args):
+    """Get the search arguments of a request as a tuple
+
+    Arguments that don't affect the results are ignored, so requests that
+    only differ in argument order or unrelated arguments compare equal"""
+
+    normalized = []
+    for name in SEARCH_ARGUMENTS:
+        if name not in args:
+            normalized.append(None)
+        elif name in ('combine', 'collapse'):
+            normalized.append(parse_bool(args[name]))
+        elif name == 'amount':
+            normalized.append(int(args[name]))
+        else:
+            normalized.append(str(args[name]).strip())
+    return tuple(normalized)
+
+def _fingerprint(args):
+    return hashlib.sha1(repr(normalize_args(args)).encode('utf-8')).hexdigest()[:16]
+
+def encode_cursor(args, offset):
+    """Build an opaque cursor pointing at the hit after offset for the query in args"""
+
+    cursor = json.dumps({'q': _fingerprint(args), 'o': offset}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(args, cursor):
+    """Get the offset stored in a cursor, raising ValueError if it is malformed or belongs to another query"""
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        decoded = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        fingerprint = decoded['q']
+        offset = int(decoded['o'])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Malformed cursor")
+    if fingerprint != _fingerprint(args) or offset < 0:
+        raise ValueError("Cursor does not belong to this query")
+    return offset
+
+def plan_query(args, schema):
+    """Build a single Whoosh query for a /newsapi request
+
+    The topic is parsed once across every field in TOPIC_FIELDS and is the
+    only part of the query that gets scored. With combine enabled the source
+    and date range are applied as unscored filters, so the index does the
+    intersection. Without it any of the arguments can match.
+
+    Requests with a page_size or cursor argument are paginated, the plan
+    then covers page_size hits starting at the cursor's offset. When every
+    hit has to fall in the requested date range, the range is part of the
+    plan so only the date shards overlapping it need to be searched.
+
+    Arguments:
+        args (dict) - The request arguments
+        schema (Schema) - Schema of the index being searched
+
+    Returns:
+        A QueryPlan with the query, an optional filter query, the total
+        result limit, the offset of the first hit, the page size (None if
+        not paginated), the date range hits are limited to (None if
+        unlimited), whether to add the article text of each hit and whether
+        to keep only the best hit of each near-duplicate cluster, or None if
+        the request has no search arguments.
+        Raises ValueError for malformed arguments"""
+
+    limit = DEFAULT_AMOUNT
+    if 'amount' in args:
+        limit = int(args['amount'])
+    offset = 0
+    page_size = None
+    if 'page_size' in args or 'cursor' in args:
+        page_size = PAGE_SIZE
+        if 'page_size' in args:
+            page_size = int(args['page_size'])
+        if page_size < 1:
+            raise ValueError("page_size must be positive")
+        if 'cursor' in args:
+            offset = decode_cursor(args, str(args['cursor']))
+    combine = False
+    if 'combine' in args:
+        combine = parse_bool(args['combine'])
+    with_text = parse_bool(args.get('articletext', False))
+    collapse = parse_bool(args.get('collapse', False))
+
+    topic_query = None
+    filters = []
+    start_date = None
+    end_date = None
+
+    if 'topic' in args:
+        topic_fields = TOPIC_FIELDS
+        if schema is not None:
+            topic_fields = [name for name in TOPIC_FIELDS if name in schema]
+        topic_parser = MultifieldParser(topic_fields, schema=schema)
+        topic_query = topic_parser.parse(str(args['topic']))
+    if 'source' in args:
+        source_parser = QueryParser("source", schema=schema)
+        filters.append(source_parser.parse(str(args['source'])))
+    if 'start_date' in args and 'end_date' in args:
+        start_date = datetime.strptime(str(args['start_date']), DATE_FORMAT)
+        end_date = datetime.strptime(str(args['end_date']), DATE_FORMAT)
+        filters.append(DateRange("date", start_date, end_date))
+
+    if topic_query is None and len(filters) == 0:
+        return None
+
+    if combine:
+        if topic_query is None:
+            topic_query = Every()
+        filter_query = None
+        if len(filters) == 1:
+            filter_query = filters[0]
+        elif len(filters) > 1:
+            filter_query = And(filters)
+        return QueryPlan(topic_query, filter_query, limit, offset, page_size, start_date, end_date, with_text, collapse)
+
+    subqueries = [ConstantScoreQuery(filter_part) for filter_part in filters]
+    if topic_query is not None:
+        subqueries.insert(0, topic_query)
+    if len(subqueries) == 1:
+        return QueryPlan(subqueries[0], None, limit, offset, page_size, start_date, end_date, with_text, collapse)
+    # Any argument can match on its own, so the date range can't be used to skip shards
+    return QueryPlan(Or(subqueries), None, limit, offset, page_size, None, None, with_text, collapse)
@@ -0,0 +1,29 @@
+import threading
+from time import monotonic, sleep
+
+class TokenBucket:
+    """Thread-safe token bucket shared by everything that talks to Google News
+
+    Tokens refill continuously at rate per second up to capacity, so short
+    bursts go out immediately while the long-term rate stays bounded."""
+
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens = 1):
+        """Block until the requested amount of tokens is available, then take them"""
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait_time = (tokens - self.tokens) / self.rate
+            sleep(wait_time)
@@ -0,0 +1,189 @@
+import json
+import os, os.path
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+from time import time
+from whoosh import index
+import ClientPath
+from Scrape import ARTICLE_INDEX_NAME, article_schema
+from Shards import FROZEN_MARKER, shard_name, shard_path
+from Dedupe import url_id
+from NearDup import NearDuplicateIndex, article_text
+from RecordLog import RECORD_LOG_DIR, iter_records, iter_segment, iter_legacy_records
+from BodyStore import BODY_STORE_PATH, BodyStore
+
+REBUILD_PROCS = os.cpu_count() or 1 # Amount of indexing processes
+REBUILD_LIMITMB = 256 # Memory limit for each indexing process in MB
+REBUILD_BATCH = 200000 # Amount of documents per commit in each shard
+REBUILD_REPORT_EVERY = 10000 # How often to print throughput, in documents
+
+def record_to_document(record):
+    """Turn a record log entry into keyword arguments for add_document, or None if it is incomplete"""
+
+    if record.get('title', "") == "" or record.get('description', "") == "" or record.get('source', "") == "" or record.get('date', "") == "" or record.get('URL', "") == "":
+        return None
+    document = {'ID': url_id(record['URL']), 'title': record['title'], 'description': record['description'], 'source': record['source'], 'URL': record['URL'], 'date': datetime.strptime(record['date'], '%m/%d/%Y')}
+    if 'cluster' in record:
+        document['cluster'] = record['cluster']
+    if record.get('signature'):
+        document['signature'] = bytes.fromhex(record['signature'])
+    return document
+
+def spool_records(records, spool_dir):
+    """Split records into one NDJSON file per shard, dropping incomplete and duplicate ones
+
+    Articles are clustered with NearDup.py in record order, the spooled
+    records carry their cluster ID and, for articles that started a
+    cluster, their signature
+
+    Returns:
+        A tuple with a dict of shard names to spool file paths, the amount
+        of documents spooled and the amount of records skipped"""
+
+    spool_files = {}
+    spool_paths = {}
+    documents = 0
+    skipped = 0
+    seen_ids = set()
+    near_duplicates = NearDuplicateIndex()
+    try:
+        for record in records:
+            document = record_to_document(record)
+            if document is None or document['ID'] in seen_ids:
+                skipped += 1
+                continue
+            seen_ids.add(document['ID'])
+            record = dict(record, cluster=near_duplicates.add(document['ID'], article_text(document['title'], document['description'])))
+            if record['cluster'] == document['ID']:
+                record['signature'] = near_duplicates.signature_bytes(document['ID']).hex()
+            name = shard_name(document['date'])
+            if name not in spool_files:
+                spool_paths[name] = os.path.join(spool_dir, name + ".ndjson")
+                spool_files[name] = open(spool_paths[name], 'w', encoding='utf-8')
+            spool_files[name].write(json.dumps(record) + "\n")
+            documents += 1
+    finally:
+        for spool_file in spool_files.values():
+            spool_file.close()
+    return spool_paths, documents, skipped
+
+def build_shard(path, spool_path, procs, limitmb, batch, progress, body_store = None):
+    """Index one shard's spooled records with a multi-process writer and optimize it
+
+    Article text already fetched by Enrich.py is taken from body_store, so
+    enriched documents stay enriched
+
+    Returns:
+        The amount of documents indexed"""
+
+    os.mkdir(path)
+    ix = index.create_in(path, article_schema)
+    documents = 0
+    writer = ix.writer(procs=procs, limitmb=limitmb, multisegment=True)
+    for record in iter_segment(spool_path):
+        document = record_to_document(record)
+        if body_store is not None:
+            text = body_store.get(document['ID'])
+            if text is not None:
+                document['body'] = text
+                document['enriched'] = True
+        writer.add_document(**document)
+        documents += 1
+        progress()
+        if documents % batch == 0:
+            writer.commit(merge=False)
+            writer = ix.writer(procs=procs, limitmb=limitmb, multisegment=True)
+    writer.commit(merge=False)
+    ix.optimize()
+    ix.close()
+    return documents
+
+def rebuild_index(records, index_name = ARTICLE_INDEX_NAME, procs = None, limitmb = None, batch = None, verbose = True, body_store = None):
+    """Build a fresh sharded index from recorded scrape data and swap it in place of the current one
+
+    Records are first split into one spool file per month shard, then each
+    shard is built with a multi-process writer, committing every batch
+    documents without merging, and optimized into a single segment at the
+    end. Shards older than the current month are marked frozen. Only then
+    is the new index moved into place, the previous index is kept as
+    index_name + ".old".
+
+    Arguments:
+        records (iterable) - Recorded articles, e.g. from RecordLog.iter_records
+        index_name (string) - Directory of the index to replace
+        procs (int) - Amount of indexing processes, REBUILD_PROCS by default
+        limitmb (int) - Memory limit per indexing process, REBUILD_LIMITMB by default
+        batch (int) - Documents per commit, REBUILD_BATCH by default
+        verbose (bool) - Whether to print progress
+        body_store (BodyStore) - Where to take enriched article text from,
+                the default body store if it exists
+
+    Returns:
+        A tuple with the amount of documents indexed and the seconds taken"""
+
+    if procs is None:
+        procs = REBUILD_PROCS
+    if limitmb is None:
+        limitmb = REBUILD_LIMITMB
+    if batch is None:
+        batch = REBUILD_BATCH
+    if body_store is None and os.path.exists(BODY_STORE_PATH):
+        body_store = BodyStore()
+
+    build_dir = index_name + ".rebuild"
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.mkdir(build_dir)
+
+    start_time = time()
+    documents = 0
+    current_shard = shard_name(datetime.today())
+
+    def progress():
+        nonlocal documents
+        documents += 1
+        if verbose and documents % REBUILD_REPORT_EVERY == 0:
+            print("Indexed {0} documents, {1:.0f} docs/sec".format(documents, documents / (time() - start_time)))
+
+    with tempfile.TemporaryDirectory(dir=build_dir) as spool_dir:
+        spool_paths, spooled, skipped = spool_records(records, spool_dir)
+        if verbose:
+            print("Split {0} documents into {1} shards, skipped {2} incomplete or duplicate records".format(spooled, len(spool_paths), skipped))
+        for name in sorted(spool_paths):
+            if verbose:
+                print("Building shard {}".format(name))
+            path = shard_path(build_dir, name)
+            build_shard(path, spool_paths[name], procs, limitmb, batch, progress, body_store)
+            if name < current_shard:
+                with open(os.path.join(path, FROZEN_MARKER), 'w') as marker_file:
+                    marker_file.write(datetime.now().isoformat())
+    time_taken = time() - start_time
+
+    old_dir = index_name + ".old"
+    if os.path.exists(index_name):
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+        os.rename(index_name, old_dir)
+    os.rename(build_dir, index_name)
+
+    if verbose:
+        print("Rebuilt {0} with {1} documents in {2:.1f} seconds ({3:.0f} docs/sec)".format(index_name, documents, time_taken, documents / max(time_taken, 0.001)))
+    return documents, time_taken
+
+def __main(argv):
+    source = RECORD_LOG_DIR
+    if len(argv) > 1:
+        source = argv[1]
+
+    if os.path.isfile(source):
+        print("Rebuilding {0} from legacy record file {1}".format(ARTICLE_INDEX_NAME, source))
+        records = iter_legacy_records(source)
+    else:
+        print("Rebuilding {0} from record log {1}".format(ARTICLE_INDEX_NAME, source))
+        records = iter_records(source)
+    rebuild_index(records)
+
+if __name__ == "__main__":
+    __main(sys.argv)
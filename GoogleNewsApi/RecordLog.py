@@ -0,0 +1,137 @@
+import gzip
+import json
+import os
+import sys
+import threading
+from datetime import datetime
+
+RECORD_LOG_DIR = "ScrapeRecords" # Directory holding the record log segments
+RECORD_LOG_SEGMENT_BYTES = 64 * 1024 * 1024 # Size after which a new segment is started
+RECORD_LOG_COMPRESS = True # Whether segments are gzip compressed
+
+SEGMENT_PREFIX = "records-"
+
+class RecordLog:
+    """Append-only NDJSON log of scraped articles, split into segments
+
+    Records are buffered in memory and written out one batch at a time by
+    flush(), which fsyncs the segment before returning. A new segment is
+    started when the current one reaches max_segment_bytes, when the day
+    changes and every time the log is opened, so a torn write from a crash
+    only ever affects the tail of an old segment. Compressed segments get
+    one gzip member per batch, which gzip readers treat as one stream."""
+
+    def __init__(self, directory = None, max_segment_bytes = None, compress = None):
+        if directory is None:
+            directory = RECORD_LOG_DIR
+        if max_segment_bytes is None:
+            max_segment_bytes = RECORD_LOG_SEGMENT_BYTES
+        if compress is None:
+            compress = RECORD_LOG_COMPRESS
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.compress = compress
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.segment_file = None
+        self.segment_day = None
+        self.segment_number = 0
+        for path in list_segments(directory):
+            self.segment_number = max(self.segment_number, segment_number(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, record):
+        """Buffer a record until the next flush"""
+
+        with self.lock:
+            self.buffer.append(json.dumps(record, separators=(',', ':')))
+
+    def flush(self):
+        """Write every buffered record to the current segment and fsync it"""
+
+        with self.lock:
+            if len(self.buffer) == 0:
+                return
+            data = ("\n".join(self.buffer) + "\n").encode('utf-8')
+            if self.compress:
+                data = gzip.compress(data)
+            segment_file = self._get_segment()
+            segment_file.write(data)
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+            self.buffer = []
+
+    def _get_segment(self):
+        today = datetime.utcnow().strftime('%Y%m%d')
+        if self.segment_file is not None and (self.segment_day != today or self.segment_file.tell() >= self.max_segment_bytes):
+            self.segment_file.close()
+            self.segment_file = None
+        if self.segment_file is None:
+            self.segment_number += 1
+            extension = ".ndjson.gz" if self.compress else ".ndjson"
+            segment_name = "{0}{1}-{2:06d}{3}".format(SEGMENT_PREFIX, today, self.segment_number, extension)
+            self.segment_file = open(os.path.join(self.directory, segment_name), 'ab')
+            self.segment_day = today
+        return self.segment_file
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+
+def list_segments(directory = None):
+    """Get the paths of every segment in a record log directory, oldest first"""
+
+    if directory is None:
+        directory = RECORD_LOG_DIR
+    if not os.path.isdir(directory):
+        return []
+    names = [name for name in os.listdir(directory) if name.startswith(SEGMENT_PREFIX) and (name.endswith(".ndjson") or name.endswith(".ndjson.gz"))]
+    paths = [os.path.join(directory, name) for name in names]
+    paths.sort(key=segment_number)
+    return paths
+
+def segment_number(path):
+    return int(os.path.basename(path).split("-")[2].split(".")[0])
+
+def iter_segment(path):
+    """Lazily yield the records in one segment
+
+    A partially written last line or gzip member, left behind by a crash
+    while writing, ends the segment instead of raising an error"""
+
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, 'rt', encoding='utf-8') as segment_file:
+        try:
+            for line in segment_file:
+                if not line.endswith("\n"):
+                    break
+                yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile):
+            return
+
+def iter_records(directory = None):
+    """Lazily yield every record in a record log, oldest first"""
+
+    for path in list_segments(directory):
+        yield from iter_segment(path)
+
+def iter_legacy_records(path):
+    """Lazily yield the records of an old comma separated ScrapeDatabase.json file"""
+
+    with open(path, 'r', encoding='utf-8') as legacy_file:
+        for line in legacy_file:
+            line = line.strip().rstrip(",")
+            if line != "":
+                yield json.loads(line)
+
+def __main(argv):
+    records = 0
+    for record in iter_records(argv[1] if len(argv) > 1 else None):
+        records += 1
+    print("Record log holds {} records".format(records))
+
+if __name__ == "__main__":
+    __main(sys.argv)
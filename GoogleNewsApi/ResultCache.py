@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+from time import time
+from QueryPlanner import normalize_args, parse_bool
+
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024 # Size limit for cached responses, least recently used results are evicted first
+RESULT_CACHE_TTL = None # Optional seconds before a cached result expires, None = only expire on new index generations
+
+def make_key(args, generation):
+    """Build a cache key from the request arguments and the index generation they were searched at"""
+
+    return (generation,) + normalize_args(args) + (args.get('cursor'), args.get('page_size'), parse_bool(args.get('articletext', False)))
+
+class ResultCache:
+    """In-process LRU cache of serialized /newsapi results
+
+    Keys include the index generation, so a commit from the scraper makes
+    every older entry unreachable. Those entries are dropped the next time
+    a result from a newer generation is stored."""
+
+    def __init__(self, max_bytes = None, ttl = None):
+        if max_bytes is None:
+            max_bytes = RESULT_CACHE_MAX_BYTES
+        if ttl is None:
+            ttl = RESULT_CACHE_TTL
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Get the cached value for a key, or None"""
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time() - entry[2] >= self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """Store a value for a key, size is the amount of bytes it is counted as"""
+
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            generation = key[0]
+            if self.generation is None or generation > self.generation:
+                self.evictions += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                self.generation = generation
+            elif generation < self.generation:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (value, size, time())
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.size -= entry[1]
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.size, 'generation': self.generation}
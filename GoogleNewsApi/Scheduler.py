@@ -0,0 +1,121 @@
+import heapq
+import json
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import timedelta
+from time import time, sleep
+
+WorkUnit = namedtuple('WorkUnit', ['topic', 'start_date', 'end_date'])
+
+def make_work_units(topics, start_date, end_date, period):
+    """Split a date range into one work unit per topic and scrape window
+
+    Arguments:
+        topics (list) - Topics to scrape
+        start_date (datetime) - First day to scrape
+        end_date (datetime) - Day to stop at, windows starting on or after it are left out
+        period (int) - How many days each window covers
+
+    Returns:
+        A list of WorkUnits, oldest windows first"""
+
+    units = []
+    window_start = start_date
+    while window_start.date() < end_date.date():
+        window_end = window_start + timedelta(days=(period - 1))
+        for topic in topics:
+            units.append(WorkUnit(topic, window_start, window_end))
+        window_start = window_start + timedelta(days=period)
+    return units
+
+def unit_key(unit):
+    return "{0}|{1}|{2}".format(unit.topic, unit.start_date.strftime('%m/%d/%Y'), unit.end_date.strftime('%m/%d/%Y'))
+
+class Checkpoint:
+    """Set of completed work units persisted to a JSON file
+
+    The file is rewritten through a temporary file and os.replace after
+    every completed unit, so a crash never leaves it half written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path, 'r') as checkpoint_file:
+                self.completed = set(json.load(checkpoint_file))
+
+    def is_done(self, unit):
+        return unit_key(unit) in self.completed
+
+    def mark_done(self, unit):
+        with self.lock:
+            self.completed.add(unit_key(unit))
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w') as checkpoint_file:
+                json.dump(sorted(self.completed), checkpoint_file)
+            os.replace(temp_path, self.path)
+
+def run_backfill(units, scrape_function, checkpoint, workers = 4, retries = 3, backoff = 60, verbose = False):
+    """Scrape work units in parallel, skipping checkpointed ones and retrying failures
+
+    Arguments:
+        units (list) - WorkUnits to scrape
+        scrape_function (function) - Called with a WorkUnit, raises an exception on failure
+        checkpoint (Checkpoint) - Where completed units are recorded
+        workers (int) - How many units are scraped at once
+        retries (int) - How many times a failed unit is retried
+        backoff (float) - Seconds before the first retry, doubled for every following one
+        verbose (bool) - Whether to show verbose output
+
+    Returns:
+        A list of WorkUnits that still failed after every retry"""
+
+    queue = deque((unit, 0) for unit in units if not checkpoint.is_done(unit))
+    if verbose:
+        print("{0} of {1} windows left to scrape".format(len(queue), len(units)))
+
+    retry_heap = []
+    retry_counter = 0
+    failed = []
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while queue or retry_heap or running:
+            now = time()
+            while retry_heap and retry_heap[0][0] <= now:
+                _, _, unit, attempt = heapq.heappop(retry_heap)
+                queue.append((unit, attempt))
+            while queue and len(running) < workers:
+                unit, attempt = queue.popleft()
+                running[pool.submit(scrape_function, unit)] = (unit, attempt)
+
+            timeout = None
+            if retry_heap:
+                timeout = max(0, retry_heap[0][0] - time())
+            if not running:
+                sleep(timeout)
+                continue
+
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                unit, attempt = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    if attempt < retries:
+                        delay = backoff * (2 ** attempt)
+                        print("Scraping {0} failed with exception {1}, retrying in {2} seconds".format(unit_key(unit), e, delay))
+                        retry_counter += 1
+                        heapq.heappush(retry_heap, (time() + delay, retry_counter, unit, attempt + 1))
+                    else:
+                        print("Scraping {0} failed with exception {1}, giving up".format(unit_key(unit), e))
+                        failed.append(unit)
+                    continue
+                checkpoint.mark_done(unit)
+                if verbose:
+                    print("Finished scraping {}".format(unit_key(unit)))
+
+    return failed
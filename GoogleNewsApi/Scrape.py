@@ -1,76 +1,207 @@
-import json
-import os, os.path
+import sys
+import threading
 from datetime import datetime, timedelta
-from time import sleep
+from time import time, sleep
+import ClientPath
 from NewsAPI import GetGoogleArticles
-from whoosh import index
-from whoosh.fields import SchemaClass, TEXT, ID, DATETIME
+from whoosh.fields import SchemaClass, TEXT, ID, DATETIME, BOOLEAN, COLUMN
+from whoosh.columns import VarBytesColumn
+from whoosh.fields import ID as IDField # The schema's own ID field hides the field type inside the class
 from whoosh.analysis import StemmingAnalyzer
 from whoosh.writing import AsyncWriter
+from RateLimit import TokenBucket
+from Scheduler import Checkpoint, make_work_units, run_backfill
+from Dedupe import SeenURLs, url_id
+from NearDup import NearDuplicateIndex, article_text
+from RecordLog import RecordLog
+from Shards import ShardRouter, freeze_shards, merge_shards, shard_name
 
-JSON_RECORD = True
+JSON_RECORD = True # Whether to keep scraped articles in the record log as well
 
-ARTICLE_INDEX_NAME = "articleIndex"
-SCRAPE_TOPIC = "Coronavirus" # Follows Google search format
+ARTICLE_INDEX_NAME = "articleIndex" # Directory holding one index shard per month
+SCRAPE_TOPICS = ["Coronavirus"] # Follows Google search format, each topic is scraped separately
 SCRAPE_START_DATE = '01/01/2020' # When to start scraping from
 SCRAPE_PERIOD = 1 # How many days to scrape at once
-SCRAPE_DELAY = 30 # Delay between scrapes in seconds
+SCRAPE_RATE = 6 # Maximum Google News page requests per minute, shared by all workers
+SCRAPE_BURST = 3 # How many page requests can go out at once after being idle
+SCRAPE_WORKERS = 4 # How many windows/topics are scraped at once
+SCRAPE_RETRIES = 3 # How many times a failed window is retried
+SCRAPE_BACKOFF = 60 # Seconds before retrying a failed window, doubled for every following retry
+SCRAPE_CHECKPOINT = "ScrapeCheckpoint.json" # Completed windows are recorded here so a restart resumes where it stopped
 SCRAPE_PAGES = 3 # Amount of pages to use per scrape
 SCRAPE_LANGUAGE = 'en' # Scraping language
 SCRAPE_SOURCES = [] # Strings containing sources to scrape, empty list = any sources
+FOLLOW_INTERVAL = 5 * 60 # Seconds between polls of the latest window once caught up, in follow mode
+FOLLOW_DAYS = 2 # Days each poll covers, ending today, so articles dated yesterday are still picked up after midnight
+MERGE_INTERVAL = 30 # Seconds between checks whether the shards being written to need merging, in follow mode
 VERBOSE = True # Verbose mode
 
 class article_schema(SchemaClass):
+    ID = ID(stored=True, unique=True) # Hash of the normalized URL
     title = TEXT(stored=True)
     description = TEXT(stored=True)
-    source = TEXT(stored=True)
+    source = TEXT(stored=True, sortable=True) # Sortable keeps a column of whole source names for /newsapi/facets
     URL = TEXT(stored=True)
-    date = DATETIME(stored=True)
-
-json_file = None
-
-# INITIALIZING INDEX
-ix = None
-if not os.path.exists(ARTICLE_INDEX_NAME):
-    os.mkdir(ARTICLE_INDEX_NAME)
-    ix = index.create_in(ARTICLE_INDEX_NAME, article_schema)
-else:
-    ix = index.open_dir(ARTICLE_INDEX_NAME)
-
-# SCRAPING AND WRITING
-SCRAPE_START_DATE = datetime.strptime(SCRAPE_START_DATE, '%m/%d/%Y')
-start_date = SCRAPE_START_DATE
-
-while start_date.date() < datetime.today().date():
-    end_date = start_date + timedelta(days=(SCRAPE_PERIOD-1))
-    scrape_dates = (start_date.strftime('%m/%d/%Y'), end_date.strftime('%m/%d/%Y'))
-    print("Scraping dates: " + str(scrape_dates))
-    article_json = GetGoogleArticles(topic=SCRAPE_TOPIC, sources=SCRAPE_SOURCES, verbose=VERBOSE, time_range=scrape_dates, language=SCRAPE_LANGUAGE, pages=SCRAPE_PAGES)
-
-
-    if article_json['status'] == 200:
-        articles_saved = 0
-        if VERBOSE:
-            print("Got {0} articles in {1} seconds, recording in index".format(article_json['results'], article_json['time_taken']))
-        writer = AsyncWriter(ix)
-        for article in article_json['articles']:
-            if article['title'] != "" and article['desc'] != "" and article['media'] != "" and article['datetime'] != "" and article['link'] != "":
-                article_datetime = datetime.strptime(article['datetime'], '%m/%d/%Y')
-                writer.add_document(title=article['title'], description=article['desc'], source=article['media'], URL=article['link'], date=article_datetime)
-                articles_saved += 1
-                if JSON_RECORD:
-                    write_dict = {"title":article['title'], "description":article['desc'], "source":article['media'], "URL":article['link'], "date":article['datetime']}
-                    json_file = open("ScrapeDatabase.json", "a")
-                    json_file.write(json.dumps(write_dict) + ",\n")
-                    json_file.close()
-        writer.commit()
-        print("Kept {} articles".format(articles_saved))
-    else:
-        print("Failed to get articles with code {0}\nError: {1}".format(article_json['code'], article_json['message']))
-    
-    print("Sleeping for {} seconds".format(SCRAPE_DELAY))
-    sleep(SCRAPE_DELAY)
-
-    start_date = start_date + timedelta(days=(SCRAPE_PERIOD))
+    date = DATETIME(stored=True, sortable=True)
+    body = TEXT() # Article text added by Enrich.py, searchable only, the text itself is kept in the BodyStore
+    enriched = BOOLEAN() # Set once Enrich.py has fetched the article text or given up on it
+    cluster = IDField(stored=True, sortable=True) # ID of the first article of the same story, set by NearDup.py
+    signature = COLUMN(VarBytesColumn()) # MinHash signature of articles that started a cluster, empty for the rest
+
+# Google News requests from every worker share one rate limit,
+# index writes are done one window at a time
+scrape_rate_limit = TokenBucket(SCRAPE_RATE / 60, SCRAPE_BURST)
+index_lock = threading.Lock()
+record_log = None
+
+def open_index():
+    return ShardRouter(ARTICLE_INDEX_NAME, article_schema())
+
+def record_articles(shards, article_json, seen_urls, near_duplicates = None, merge = True):
+    """Add the complete articles from a GetGoogleArticles result to the index
+
+    Each article goes to the shard for the month of its date. Articles
+    whose normalized URL is already known are dropped, the rest are written
+    with update semantics on the unique ID field. With near_duplicates set
+    every article is tagged with the cluster of near-duplicate articles it
+    belongs to. With JSON_RECORD set they are flushed to the record log
+    before the index commit, so the log always holds everything that was
+    indexed. Without merge the commit only adds a segment, leaving merges
+    to merge_shards.
+
+    Returns:
+        A tuple with the amount of articles kept and duplicates dropped"""
+
+    articles_saved = 0
+    duplicates = 0
+    new_ids = []
+    writers = {}
+    with index_lock:
+        try:
+            for article in article_json['articles']:
+                if article['title'] != "" and article['desc'] != "" and article['media'] != "" and article['datetime'] != "" and article['link'] != "":
+                    document_id = url_id(article['link'])
+                    if not seen_urls.add(document_id):
+                        duplicates += 1
+                        continue
+                    new_ids.append(document_id)
+                    article_datetime = datetime.strptime(article['datetime'], '%m/%d/%Y')
+                    article_shard = shard_name(article_datetime)
+                    if article_shard not in writers:
+                        writers[article_shard] = AsyncWriter(shards.get(article_shard))
+                    document = {'ID': document_id, 'title': article['title'], 'description': article['desc'], 'source': article['media'], 'URL': article['link'], 'date': article_datetime}
+                    if near_duplicates is not None:
+                        document['cluster'] = near_duplicates.add(document_id, article_text(article['title'], article['desc']))
+                        if document['cluster'] == document_id:
+                            document['signature'] = near_duplicates.signature_bytes(document_id)
+                    writers[article_shard].update_document(**document)
+                    articles_saved += 1
+                    if record_log is not None:
+                        write_dict = {"title":article['title'], "description":article['desc'], "source":article['media'], "URL":article['link'], "date":article['datetime']}
+                        record_log.append(write_dict)
+            if record_log is not None:
+                record_log.flush()
+            for writer in writers.values():
+                writer.commit(merge=merge)
+        except Exception:
+            for writer in writers.values():
+                writer.cancel()
+            seen_urls.discard(new_ids)
+            raise
+    return articles_saved, duplicates
+
+def scrape_window(shards, seen_urls, near_duplicates, unit):
+    """Scrape one topic for one date window and record the results, raising an exception on failure
+
+    A window without any articles counts as a failure too, GoogleNews
+    returns empty pages when Google refuses a request, so it is retried
+    rather than checkpointed"""
+
+    scrape_dates = (unit.start_date.strftime('%m/%d/%Y'), unit.end_date.strftime('%m/%d/%Y'))
+    print("Scraping {0} for dates: {1}".format(unit.topic, str(scrape_dates)))
+    article_json = GetGoogleArticles(topic=unit.topic, sources=SCRAPE_SOURCES, verbose=VERBOSE, time_range=scrape_dates, language=SCRAPE_LANGUAGE, pages=SCRAPE_PAGES, rate_limit=scrape_rate_limit)
+
+    if article_json['status'] != 200:
+        raise RuntimeError("Failed to get articles with code {0}\nError: {1}".format(article_json['code'], article_json['message']))
+    if article_json['results'] == 0:
+        raise RuntimeError("Got no articles, Google may have refused the requests")
+
     if VERBOSE:
-        print("Beginning scraping for {}".format(start_date.strftime('%m/%d/%Y')))
+        print("Got {0} articles in {1} seconds, recording in index".format(article_json['results'], article_json['time_taken']))
+    articles_saved, duplicates = record_articles(shards, article_json, seen_urls, near_duplicates)
+    print("Kept {0} articles for {1} {2}, dropped {3} duplicates".format(articles_saved, unit.topic, str(scrape_dates), duplicates))
+
+def merge_loop(shards):
+    while True:
+        sleep(MERGE_INTERVAL)
+        try:
+            merge_shards(shards, verbose=VERBOSE)
+        except Exception as e:
+            print("Failed to merge shards with exception {}".format(e))
+
+def follow(shards, seen_urls, near_duplicates):
+    """Keep scraping the latest FOLLOW_DAYS of every topic, never returns
+
+    Every FOLLOW_INTERVAL seconds the window ending today is scraped for
+    each topic, bypassing the page cache. The new articles of all topics
+    go into one commit without merging, which only adds a small segment
+    and is visible to WebAPI.py within its refresh interval. A background
+    thread merges the shards being written to, keeping their segment
+    count bounded."""
+
+    threading.Thread(target=merge_loop, args=(shards,), daemon=True).start()
+    while True:
+        poll_start = time()
+        end_date = datetime.today()
+        start_date = end_date - timedelta(days=(FOLLOW_DAYS - 1))
+        scrape_dates = (start_date.strftime('%m/%d/%Y'), end_date.strftime('%m/%d/%Y'))
+        articles = []
+        for topic in SCRAPE_TOPICS:
+            try:
+                article_json = GetGoogleArticles(topic=topic, sources=SCRAPE_SOURCES, verbose=VERBOSE, time_range=scrape_dates, language=SCRAPE_LANGUAGE, pages=SCRAPE_PAGES, rate_limit=scrape_rate_limit, cache=False)
+            except Exception as e:
+                print("Failed to get articles for {0} with exception {1}".format(topic, e))
+                continue
+            if article_json['status'] != 200:
+                print("Failed to get articles for {0} with code {1}\nError: {2}".format(topic, article_json['code'], article_json['message']))
+                continue
+            articles.extend(article_json['articles'])
+        try:
+            articles_saved, duplicates = record_articles(shards, {'articles': articles}, seen_urls, near_duplicates, merge=False)
+            print("Kept {0} new articles for {1}, dropped {2} known ones".format(articles_saved, str(scrape_dates), duplicates))
+        except Exception as e:
+            print("Failed to record articles with exception {}".format(e))
+        # Shards of the window being followed stay open for writes
+        try:
+            freeze_shards(ARTICLE_INDEX_NAME, shard_name(start_date), verbose=VERBOSE)
+        except Exception as e:
+            print("Failed to freeze shards with exception {}, trying again next poll".format(e))
+        sleep(max(0, FOLLOW_INTERVAL - (time() - poll_start)))
+
+def __main(argv):
+    global record_log
+    if JSON_RECORD:
+        record_log = RecordLog()
+    shards = open_index()
+    seen_urls = SeenURLs(shards.open_all())
+    near_duplicates = NearDuplicateIndex(shards.open_all())
+    if VERBOSE:
+        print("Loaded {0} known article URLs in {1} clusters".format(len(seen_urls), len(near_duplicates)))
+    start_date = datetime.strptime(SCRAPE_START_DATE, '%m/%d/%Y')
+    units = make_work_units(SCRAPE_TOPICS, start_date, datetime.today(), SCRAPE_PERIOD)
+    checkpoint = Checkpoint(SCRAPE_CHECKPOINT)
+
+    failed = run_backfill(units, lambda unit: scrape_window(shards, seen_urls, near_duplicates, unit), checkpoint, workers=SCRAPE_WORKERS, retries=SCRAPE_RETRIES, backoff=SCRAPE_BACKOFF, verbose=VERBOSE)
+    if len(failed) > 0:
+        print("{} windows could not be scraped, rerun to try them again".format(len(failed)))
+    try:
+        if len(argv) > 1 and argv[1] == "follow":
+            print("Caught up, following the latest {} days".format(FOLLOW_DAYS))
+            follow(shards, seen_urls, near_duplicates)
+        freeze_shards(ARTICLE_INDEX_NAME, shard_name(datetime.today()), verbose=VERBOSE)
+    finally:
+        if record_log is not None:
+            record_log.close()
+
+if __name__ == "__main__":
+    __main(sys.argv)
@@ -0,0 +1,136 @@
+import threading
+from contextlib import contextmanager, ExitStack
+from queue import LifoQueue, Empty
+from time import time
+from Shards import list_shards, shard_path, shard_overlaps
+from MappedFiles import open_mapped_index
+
+POOL_SIZE = 8 # Maximum amount of idle searchers kept open
+REFRESH_INTERVAL = 1.0 # Minimum seconds between checks for newly committed segments
+
+class SearcherPool:
+    """Keeps one open index and a pool of reusable searchers over it
+
+    Searchers are handed out with the searcher() context manager and put
+    back afterwards. When the scraper commits a new generation, searchers
+    are refreshed as they are handed out, which reuses the readers of
+    segments that did not change instead of reopening the whole index."""
+
+    def __init__(self, index_name, pool_size = POOL_SIZE, refresh_interval = REFRESH_INTERVAL):
+        self.ix = open_mapped_index(index_name)
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.idle = LifoQueue()
+        self.lock = threading.Lock()
+        self.latest_generation = self.ix.latest_generation()
+        self.last_check = time()
+
+    def generation(self):
+        """Get the latest committed generation of the index, checking the disk at most every refresh_interval seconds"""
+
+        now = time()
+        if now - self.last_check >= self.refresh_interval:
+            with self.lock:
+                if now - self.last_check >= self.refresh_interval:
+                    self.latest_generation = self.ix.latest_generation()
+                    self.last_check = now
+        return self.latest_generation
+
+    @contextmanager
+    def searcher(self):
+        """Borrow an up to date searcher for the duration of a with block"""
+
+        generation = self.generation()
+        try:
+            current_searcher = self.idle.get_nowait()
+        except Empty:
+            current_searcher = self.ix.searcher()
+
+        if current_searcher.reader().generation() != generation:
+            current_searcher = current_searcher.refresh()
+
+        try:
+            yield current_searcher
+        finally:
+            if self.idle.qsize() < self.pool_size:
+                self.idle.put(current_searcher)
+            else:
+                current_searcher.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                break
+
+class ShardedSearcherPool:
+    """Keeps a SearcherPool for every date shard of the index
+
+    New shards created by the scraper are picked up automatically. The
+    version number goes up whenever a shard is added or commits a new
+    generation, so it can stand in for the index generation of a single
+    index."""
+
+    def __init__(self, root, pool_size = POOL_SIZE, refresh_interval = REFRESH_INTERVAL):
+        self.root = root
+        self.pool_size = pool_size
+        self.refresh_interval = refresh_interval
+        self.pools = {}
+        self.names = []
+        self.generations = {}
+        self.version = 0
+        self.lock = threading.Lock()
+        self.last_check = 0
+        self.generation()
+
+    def generation(self):
+        """Get the version of the shard set, checking the disk at most every refresh_interval seconds"""
+
+        now = time()
+        if now - self.last_check >= self.refresh_interval:
+            with self.lock:
+                if now - self.last_check >= self.refresh_interval:
+                    self._scan()
+                    self.last_check = now
+        return self.version
+
+    def _scan(self):
+        names = list_shards(self.root)
+        for name in names:
+            if name not in self.pools:
+                self.pools[name] = SearcherPool(shard_path(self.root, name), self.pool_size, self.refresh_interval)
+        generations = {name: self.pools[name].generation() for name in names}
+        if generations != self.generations:
+            self.version += 1
+            self.generations = generations
+        self.names = names
+
+    @property
+    def schema(self):
+        """Schema of the newest shard, or None if there are no shards yet"""
+
+        if len(self.names) == 0:
+            return None
+        return self.pools[self.names[0]].ix.schema
+
+    @contextmanager
+    def shard_searchers(self, start_date = None, end_date = None):
+        """Borrow a searcher for every shard that can hold articles between start_date and end_date, newest first
+
+        Yields a list of (shard name, searcher) tuples"""
+
+        self.generation()
+        with ExitStack() as stack:
+            yield [(name, stack.enter_context(self.pools[name].searcher())) for name in self.names if shard_overlaps(name, start_date, end_date)]
+
+    @contextmanager
+    def searchers(self, start_date = None, end_date = None):
+        """Same as shard_searchers, but only yields the searchers"""
+
+        with self.shard_searchers(start_date, end_date) as named_searchers:
+            yield [searcher for _, searcher in named_searchers]
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
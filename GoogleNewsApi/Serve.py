@@ -0,0 +1,104 @@
+import argparse
+import gc
+import os
+import signal
+import sys
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+
+SERVE_HOST = '127.0.0.1' # Address the API listens on
+SERVE_PORT = 8246 # Port the API listens on
+SERVE_WORKERS = os.cpu_count() or 1 # Worker processes, each answers requests on as many threads as it needs
+SERVE_ACCESS_LOG = False # Whether every request is logged to stderr
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, code = '-', size = '-'):
+        pass
+
+class _PreforkServer(ThreadedWSGIServer):
+    def get_request(self):
+        connection, address = super().get_request()
+        # On BSD and macOS accepted sockets inherit O_NONBLOCK from the listening socket
+        connection.setblocking(True)
+        return connection, address
+
+def serve(host = SERVE_HOST, port = SERVE_PORT, workers = SERVE_WORKERS, access_log = SERVE_ACCESS_LOG):
+    """Serve WebAPI.py from several pre-forked worker processes
+
+    The index is opened and the facet columns are loaded once before
+    forking, so workers start instantly and share those pages with the
+    parent until they write to them. Every worker accepts connections on
+    the same listening socket. A worker that dies is replaced, SIGTERM or
+    SIGINT stops all of them. Without fork (Windows) or with a single
+    worker requests are served from this process.
+
+    The result cache, /metrics and /newsapi/cachestats are per worker."""
+
+    import WebAPI
+
+    WebAPI.preload()
+    request_handler = WSGIRequestHandler if access_log else _QuietRequestHandler
+    server = _PreforkServer(host, port, WebAPI.app, request_handler)
+    print("Serving on http://{0}:{1} with {2} workers, encoding hits with {3}".format(host, server.server_port, workers, WebAPI.hit_encoder.name))
+    if workers <= 1 or not hasattr(os, 'fork'):
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+
+    # Workers woken for a connection another worker already took go back to waiting instead of blocking in accept
+    server.socket.setblocking(False)
+    # Keep the garbage collector from touching, and so copying, everything loaded before the fork
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def start_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    for _ in range(workers):
+        start_worker()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while len(children) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print("Worker {0} exited with status {1}, starting a new one".format(pid, status))
+            start_worker()
+    server.server_close()
+
+def __main(argv):
+    parser = argparse.ArgumentParser(description="Serve the article API from pre-forked worker processes")
+    parser.add_argument("--host", default=SERVE_HOST, help="Address to listen on")
+    parser.add_argument("--port", type=int, default=SERVE_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Worker processes")
+    parser.add_argument("--access-log", action="store_true", default=SERVE_ACCESS_LOG, help="Log every request")
+    args = parser.parse_args(argv[1:])
+    serve(args.host, args.port, args.workers, args.access_log)
+
+if __name__ == "__main__":
+    __main(sys.argv)
@@ -0,0 +1,197 @@
+import os, os.path
+import threading
+from datetime import datetime
+from whoosh import index
+from whoosh.index import LockError, TOC
+from whoosh.reading import SegmentReader
+
+SHARD_DATE_FORMAT = "%Y-%m" # One shard per month, also used as the shard's directory name
+LEGACY_SHARD = "legacy" # Name given to an unsharded index found directly in the index directory
+FROZEN_MARKER = "FROZEN" # File marking a shard as optimized and closed for writes
+MAX_SEGMENTS = 8 # Segments a shard that is being written to is merged back down to
+MERGE_LOCK_TIMEOUT = 5 # Seconds a merge waits for the index lock before trying again later
+
+def shard_name(date):
+    """Get the name of the shard an article from date belongs in"""
+
+    return date.strftime(SHARD_DATE_FORMAT)
+
+def shard_range(name):
+    """Get the (start, end) datetimes covered by a shard, end is exclusive
+
+    The legacy shard can hold any date, so (None, None) is returned for it"""
+
+    if name == LEGACY_SHARD:
+        return None, None
+    start = datetime.strptime(name, SHARD_DATE_FORMAT)
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+def shard_overlaps(name, start_date, end_date):
+    """Check whether a shard can hold articles between start_date and end_date (inclusive)"""
+
+    shard_start, shard_end = shard_range(name)
+    if shard_start is None:
+        return True
+    if start_date is not None and shard_end <= start_date:
+        return False
+    if end_date is not None and shard_start > end_date:
+        return False
+    return True
+
+def shard_path(root, name):
+    if name == LEGACY_SHARD:
+        return root
+    return os.path.join(root, name)
+
+def list_shards(root):
+    """Get the names of every shard under root, newest first"""
+
+    if not os.path.isdir(root):
+        return []
+    names = []
+    for name in os.listdir(root):
+        try:
+            datetime.strptime(name, SHARD_DATE_FORMAT)
+        except ValueError:
+            continue
+        if index.exists_in(os.path.join(root, name)):
+            names.append(name)
+    names.sort(reverse=True)
+    if index.exists_in(root):
+        names.append(LEGACY_SHARD)
+    return names
+
+def is_frozen(root, name):
+    return os.path.exists(os.path.join(shard_path(root, name), FROZEN_MARKER))
+
+class ShardRouter:
+    """Opens and creates the shard indexes documents are written to
+
+    Writing to a frozen shard (e.g. when backfilling an old month again)
+    thaws it, freeze_shards optimizes it again afterwards."""
+
+    def __init__(self, root, schema):
+        self.root = root
+        self.schema = schema
+        self.indexes = {}
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, name):
+        """Get the index for a shard, creating it if it doesn't exist yet"""
+
+        with self.lock:
+            if name not in self.indexes:
+                path = shard_path(self.root, name)
+                if index.exists_in(path):
+                    ix = index.open_dir(path)
+                    for field_name, field in self.schema.items():
+                        if field_name not in ix.schema:
+                            # Shards from before a schema change don't have every field yet
+                            writer = ix.writer()
+                            writer.add_field(field_name, field)
+                            writer.commit()
+                else:
+                    os.makedirs(path, exist_ok=True)
+                    ix = index.create_in(path, self.schema)
+                self.indexes[name] = ix
+            frozen_marker = os.path.join(shard_path(self.root, name), FROZEN_MARKER)
+            if os.path.exists(frozen_marker):
+                os.remove(frozen_marker)
+            return self.indexes[name]
+
+    def open_shards(self):
+        """Get the names and indexes of the shards opened for writing that aren't frozen"""
+
+        with self.lock:
+            shards = list(self.indexes.items())
+        return [(name, ix) for name, ix in shards if not is_frozen(self.root, name)]
+
+    def get_for_date(self, date):
+        return self.get(shard_name(date))
+
+    def open_all(self):
+        """Get the indexes of every existing shard"""
+
+        indexes = []
+        for name in list_shards(self.root):
+            path = shard_path(self.root, name)
+            with self.lock:
+                if name not in self.indexes:
+                    self.indexes[name] = index.open_dir(path)
+                indexes.append(self.indexes[name])
+        return indexes
+
+def freeze_shards(root, current_name, verbose = False):
+    """Optimize every shard older than current_name into one segment and mark it frozen
+
+    Frozen shards no longer take writes in normal operation, so they keep a
+    single segment and searching them never pays for merges again. A shard
+    whose index lock is taken is left for the next call."""
+
+    for name in list_shards(root):
+        if name == LEGACY_SHARD or name >= current_name or is_frozen(root, name):
+            continue
+        if verbose:
+            print("Freezing shard {}".format(name))
+        ix = index.open_dir(shard_path(root, name))
+        try:
+            ix.optimize(timeout=MERGE_LOCK_TIMEOUT)
+        except LockError:
+            if verbose:
+                print("Shard {} is locked, freezing it later".format(name))
+            continue
+        finally:
+            ix.close()
+        with open(os.path.join(shard_path(root, name), FROZEN_MARKER), 'w') as marker_file:
+            marker_file.write(datetime.now().isoformat())
+
+def bounded_merge(max_segments):
+    """Get a Whoosh merge policy that keeps at most max_segments segments
+
+    The smallest segments are merged into one, so every document is only
+    merged again once it sits in a segment among the smallest ones. Pass
+    the policy to writer.commit(mergetype=...)"""
+
+    def merge_policy(writer, segments):
+        if len(segments) <= max_segments:
+            return segments
+        by_size = sorted(segments, key=lambda segment: segment.doc_count_all())
+        merge_count = len(segments) - max_segments + 1
+        for segment in by_size[:merge_count]:
+            reader = SegmentReader(writer.storage, writer.schema, segment)
+            writer.add_reader(reader)
+            reader.close()
+        return by_size[merge_count:]
+
+    return merge_policy
+
+def merge_shards(router, max_segments = None, verbose = False):
+    """Merge the smallest segments of every shard open for writing down to max_segments
+
+    Writers committing with merge=False stay cheap, this catches up in the
+    background so searches never have to go through too many segments. A
+    shard whose index lock is taken is left for the next call.
+
+    Returns:
+        The amount of shards merged"""
+
+    if max_segments is None:
+        max_segments = MAX_SEGMENTS
+    merged = 0
+    for name, ix in router.open_shards():
+        # Reading the table of contents is cheap, opening a writer takes the lock
+        segment_count = len(TOC.read(ix.storage, ix.indexname).segments)
+        if segment_count <= max_segments:
+            continue
+        try:
+            writer = ix.writer(timeout=MERGE_LOCK_TIMEOUT)
+        except LockError:
+            continue
+        writer.commit(mergetype=bounded_merge(max_segments))
+        merged += 1
+        if verbose:
+            print("Merged shard {0} from {1} down to {2} segments".format(name, segment_count, max_segments))
+    return merged
@@ -1,18 +1,55 @@
+import os
 import flask
 import config
-from datetime import datetime
 from flask import request, jsonify
-from time import time
-from whoosh import index
-from whoosh.query import DateRange
-from whoosh.qparser import QueryParser
-from whoosh.searching import Results
+import heapq
+from contextlib import ExitStack
+from time import time, perf_counter
+import ClientPath
+from SearcherPool import ShardedSearcherPool
+from QueryPlanner import plan_query, encode_cursor, parse_bool
+from ResultCache import ResultCache, make_key
+from Metrics import stage_timer, observe_request, render_metrics
+from BodyStore import BodyStore
+from Shards import shard_overlaps
+from NearDup import column_lookup
+from Facets import FACET_INTERVALS, DEFAULT_INTERVAL, DEFAULT_SOURCE_LIMIT, ColumnCache, count_facets
+from HitEncoding import HIT_LAYOUTS, DEFAULT_LAYOUT, HitEncoder, hit_record
 
 app = flask.Flask(__name__)
-app.config["DEBUG"] = True
+app.config["DEBUG"] = getattr(config, 'DEBUG', False)
+
+BATCH_MAX_QUERIES = 100 # Maximum amount of queries in one /newsapi/batch request
 
-valid_request_json = {'status': 200, 'results': 0, 'time_taken': 0, 'articles': []}
 bad_arg_json = {'status': 400, 'code': 'badArguments', 'message': 'No arguments provided'}
+bad_batch_json = {'status': 400, 'code': 'badArguments', 'message': 'Expected a JSON object with a list of queries'}
+
+searcher_pool = ShardedSearcherPool(config.ARTICLE_INDEX_NAME)
+result_cache = ResultCache()
+body_store = BodyStore(getattr(config, 'BODY_STORE_PATH', None))
+column_cache = ColumnCache()
+hit_encoder = HitEncoder(getattr(config, 'JSON_ENCODER', None))
+
+def preload():
+    """Open every shard and load the facet columns ahead of the first request
+
+    Serve.py calls this before forking its workers, so they share the
+    columns instead of each loading their own. The searchers are closed
+    again, see _after_fork."""
+
+    with searcher_pool.shard_searchers() as named_searchers:
+        for name, searcher in named_searchers:
+            column_cache.get(name, searcher)
+    searcher_pool.close()
+
+def _after_fork():
+    # A forked worker must not share SQLite connections or index file positions with its parent
+    global body_store
+    body_store = BodyStore(getattr(config, 'BODY_STORE_PATH', None))
+    searcher_pool.close()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
 
 @app.route('/', methods=['GET'])
 def home():
@@ -22,104 +59,368 @@ def home():
 @app.route('/newsapi', methods=['GET'])
 def api_id():
     start_time = time()
-    arguments_used = 0
-    amount_needed = 50
-    results_list = []
-    combine_results = False
-
-    
-    # Handle individual arguments
-    if 'amount' in request.args:
-        amount_needed = int(request.args['amount'])
-    if 'combine' in request.args:
-        if bool(request.args['combine']) == True:
-            combine_results = True
-
-    if 'source' in request.args:
-        arguments_used += 1
-        source_arg = str(request.args['source'])
-
-        ix = index.open_dir(config.ARTICLE_INDEX_NAME, readonly=True)
-
-        query_parser = QueryParser("source", schema=ix.schema)
-        query = query_parser.parse(source_arg)
-        searcher = ix.searcher()
-        results = searcher.search(query, limit=amount_needed)
-        results_list.append(results)
-
-    if 'start_date' in request.args and "end_date" in request.args:
-        arguments_used += 1
-        start_date = datetime.strptime(str(request.args['start_date']), "%m-%d-%Y")
-        end_date = datetime.strptime(str(request.args['end_date']), "%m-%d-%Y")
-
-
-        ix = index.open_dir(config.ARTICLE_INDEX_NAME, readonly=True)
-
-        query = DateRange("date", start_date, end_date)
-        searcher = ix.searcher()
-        results = searcher.search(query, limit=amount_needed)
-        results_list.append(results)
-    if 'topic' in request.args:
-        arguments_used += 1
-        topic = str(request.args['topic'])
-
-        ix = index.open_dir(config.ARTICLE_INDEX_NAME, readonly=True)
-        searcher = ix.searcher()
-
-        title_query_parser = QueryParser("title", schema=ix.schema)
-        title_query = title_query_parser.parse(topic)
-        desc_query_parser = QueryParser("description", schema=ix.schema)
-        desc_query = desc_query_parser.parse(topic)
-        
-        title_results = searcher.search(title_query, limit=amount_needed)
-        desc_results = searcher.search(desc_query, limit=amount_needed)
-        title_results.upgrade_and_extend(desc_results)
-        results_list.append(title_results)
-
-        print("TYPE: {}".format(type(title_results)))
+    request_start = perf_counter()
+    timer = stage_timer(keep=parse_bool(request.args.get('timings', False)))
+
+    try:
+        plan = plan_query(request.args, searcher_pool.schema)
+        layout = parse_layout(request.args)
+    except ValueError as e:
+        response = jsonify({'status': 400, 'code': 'parameterInvalid', 'message': str(e)})
+        return response
 
     # Handle bad/empty requests
-    if arguments_used == 0:
+    if plan is None:
         response = jsonify(bad_arg_json)
-        # searcher.close()
         return response
 
+    if request.args.get('format') == 'ndjson':
+        return stream_articles(plan, start_time, timer, request_start)
 
-    # Loop through results and combine if necessary
-    return_json = valid_request_json
-    return_json['results'] = 0
-    return_json['articles'] = []
-    if (len(results_list) > 0):
-        main_result = results_list[0]
-        if len(results_list) > 1:
-            for result in results_list:
-                if main_result != result:
-                    main_result.upgrade(result)
-        
-        articles_saved = 0
-        print("Before adding results: {}".format(len(return_json['articles'])))
-        for article in main_result:
-            if articles_saved < amount_needed:
-                current_article = article.fields()
-                current_article.pop('ID', None)
-                return_json['articles'].append(current_article)
-                
-                articles_saved += 1
-                # print("Added article {}".format(article.fields()['title']))
-            else:
-                # print("Reached article limit ({0} out of {1})".format(articles_saved, amount_needed))
-                pass
-
-    return_json['time_taken'] = round((time() - start_time), 2)
-    return_json['results'] = len(return_json['articles'])
-    print("Results: {}".format(len(return_json['articles'])))
-    response = jsonify(return_json)
-    
-    return_json = valid_request_json
-    print("Cleared Results: {}".format(len(return_json['articles'])))
-    print("Request json Results: {}".format(len(valid_request_json['articles'])))
-    searcher.close()
+    with timer.stage('cache_lookup'):
+        cache_key = make_key(request.args, searcher_pool.generation()) + (layout,)
+        cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        results, articles_json, next_cursor = cached_result
+    else:
+        with ExitStack() as stack:
+            with timer.stage('index_open'):
+                searchers = stack.enter_context(searcher_pool.searchers(plan.start_date, plan.end_date))
+            results, articles_json, next_cursor = search_articles(searchers, plan, timer, request.args, layout)
+        result_cache.put(cache_key, (results, articles_json, next_cursor), len(articles_json))
+
+    time_taken = round((time() - start_time), 2)
+    extra_json = ""
+    if next_cursor is not None:
+        extra_json += ', "next_cursor": "{}"'.format(next_cursor)
+    if timer.enabled:
+        extra_json += ', "timings": {}'.format(flask.json.dumps(timer.as_dict()))
+    response_body = '{{"status": 200, "results": {0}, "time_taken": {1}{2}, "articles": {3}}}'.format(results, time_taken, extra_json, articles_json)
+    response = app.response_class(response_body, mimetype='application/json')
+    observe_request('newsapi', perf_counter() - request_start)
+    return response
+
+@app.route('/newsapi/batch', methods=['POST'])
+def api_batch():
+    """Run several /newsapi queries at once
+
+    Takes a JSON object with a list of queries, each holding the same
+    arguments as a /newsapi request, including layout. Every query is
+    answered from the result cache if possible, the rest run on one set of
+    borrowed searchers and hits shared by several queries are loaded and
+    encoded only once. The responses list holds the result or error of
+    each query in order."""
+
+    start_time = time()
+    request_start = perf_counter()
+    batch_json = request.get_json(silent=True)
+    if not isinstance(batch_json, dict) or not isinstance(batch_json.get('queries'), list) or len(batch_json['queries']) == 0:
+        return jsonify(bad_batch_json)
+    queries = batch_json['queries']
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'status': 400, 'code': 'parameterInvalid', 'message': 'At most {} queries can be sent at once'.format(BATCH_MAX_QUERIES)})
+    timer = stage_timer(keep=parse_bool(batch_json.get('timings', False)))
+
+    responses = [None] * len(queries)
+    pending = {}
+    generation = searcher_pool.generation()
+    for position, args in enumerate(queries):
+        if not isinstance(args, dict):
+            responses[position] = flask.json.dumps(bad_arg_json)
+            continue
+        try:
+            plan = plan_query(args, searcher_pool.schema)
+            layout = parse_layout(args)
+            cache_key = make_key(args, generation) + (layout,)
+        except ValueError as e:
+            responses[position] = flask.json.dumps({'status': 400, 'code': 'parameterInvalid', 'message': str(e)})
+            continue
+        if plan is None:
+            responses[position] = flask.json.dumps(bad_arg_json)
+            continue
+        with timer.stage('cache_lookup'):
+            cached_result = result_cache.get(cache_key)
+        if cached_result is not None:
+            responses[position] = result_json(*cached_result)
+        else:
+            pending[position] = (plan, cache_key, layout)
+
+    if len(pending) > 0:
+        plans = [plan for plan, _, _ in pending.values()]
+        start_date = None
+        end_date = None
+        if all(plan.start_date is not None for plan in plans):
+            start_date = min(plan.start_date for plan in plans)
+            end_date = max(plan.end_date for plan in plans)
+        with ExitStack() as stack:
+            with timer.stage('index_open'):
+                named_searchers = stack.enter_context(searcher_pool.shard_searchers(start_date, end_date))
+            pages = {}
+            for position, (plan, _, _) in pending.items():
+                searchers = [searcher for name, searcher in named_searchers if shard_overlaps(name, plan.start_date, plan.end_date)]
+                pages[position] = search_page(searchers, plan, timer, queries[position])
+            encoded_articles = encode_shared_articles([(page, pending[position][0].with_text, pending[position][2]) for position, (page, _) in pages.items()], timer)
+            for (position, (page, next_cursor)), articles_json in zip(pages.items(), encoded_articles):
+                result_cache.put(pending[position][1], (len(page), articles_json, next_cursor), len(articles_json))
+                responses[position] = result_json(len(page), articles_json, next_cursor)
+
+    extra_json = ""
+    if timer.enabled:
+        extra_json += ', "timings": {}'.format(flask.json.dumps(timer.as_dict()))
+    response_body = '{{"status": 200, "results": {0}, "time_taken": {1}{2}, "responses": [{3}]}}'.format(len(responses), round((time() - start_time), 2), extra_json, ", ".join(responses))
+    response = app.response_class(response_body, mimetype='application/json')
+    observe_request('newsapi_batch', perf_counter() - request_start)
+    return response
+
+@app.route('/newsapi/facets', methods=['GET'])
+def api_facets():
+    """Count the articles matching a /newsapi query per source and per date bucket
+
+    Takes the same search arguments as /newsapi, amount and pagination
+    are ignored since every match is counted. interval sets the date
+    bucket size (day, week or month) and source_limit how many of the most
+    common sources are returned. Only the source and date columns are
+    read, see Facets.py."""
+
+    start_time = time()
+    request_start = perf_counter()
+    timer = stage_timer(keep=parse_bool(request.args.get('timings', False)))
+
+    try:
+        plan = plan_query(request.args, searcher_pool.schema)
+        interval = request.args.get('interval', DEFAULT_INTERVAL)
+        if interval not in FACET_INTERVALS:
+            raise ValueError("interval must be one of " + ", ".join(FACET_INTERVALS))
+        source_limit = int(request.args.get('source_limit', DEFAULT_SOURCE_LIMIT))
+    except ValueError as e:
+        response = jsonify({'status': 400, 'code': 'parameterInvalid', 'message': str(e)})
+        return response
+
+    if plan is None:
+        response = jsonify(bad_arg_json)
+        return response
+
+    with timer.stage('cache_lookup'):
+        cache_key = make_key(request.args, searcher_pool.generation()) + ('facets', interval, source_limit)
+        cached_result = result_cache.get(cache_key)
+    if cached_result is not None:
+        results, facets_json = cached_result
+    else:
+        with ExitStack() as stack:
+            with timer.stage('index_open'):
+                named_searchers = stack.enter_context(searcher_pool.shard_searchers(plan.start_date, plan.end_date))
+            with timer.stage('facets'):
+                results, sources, dates = count_facets(named_searchers, plan, interval, column_cache, source_limit)
+        with timer.stage('encode'):
+            facets_json = flask.json.dumps({'sources': [{'source': source, 'count': count} for source, count in sources], 'dates': [{'date': date, 'count': count} for date, count in dates]})
+        result_cache.put(cache_key, (results, facets_json), len(facets_json))
+
+    extra_json = ""
+    if timer.enabled:
+        extra_json += ', "timings": {}'.format(flask.json.dumps(timer.as_dict()))
+    response_body = '{{"status": 200, "results": {0}, "time_taken": {1}, "interval": "{2}"{3}, "facets": {4}}}'.format(results, round((time() - start_time), 2), interval, extra_json, facets_json)
+    response = app.response_class(response_body, mimetype='application/json')
+    observe_request('newsapi_facets', perf_counter() - request_start)
     return response
 
+@app.route('/newsapi/cachestats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    cache = result_cache.stats()
+    cache_lines = ["# TYPE articleapi_result_cache_{0} gauge\narticleapi_result_cache_{0} {1}".format(name, value) for name, value in cache.items() if isinstance(value, (int, float))]
+    return app.response_class(render_metrics(cache_lines), mimetype='text/plain; version=0.0.4')
+
+def parse_layout(args):
+    """Get the article list layout a request asks for, raising ValueError for unknown ones
+
+    rows gives a list with one object per article, columns gives one
+    object with a list per field, which is smaller and faster to decode
+    for clients reading many hits. See HitEncoding.py"""
+
+    layout = args.get('layout', DEFAULT_LAYOUT)
+    if layout not in HIT_LAYOUTS:
+        raise ValueError("layout must be one of " + ", ".join(HIT_LAYOUTS))
+    return layout
+
+def result_json(results, articles_json, next_cursor):
+    """Build the JSON of one query's result from its serialized article list"""
+
+    cursor_json = ""
+    if next_cursor is not None:
+        cursor_json = ', "next_cursor": "{}"'.format(next_cursor)
+    return '{{"status": 200, "results": {0}{1}, "articles": {2}}}'.format(results, cursor_json, articles_json)
+
+def search_page(searchers, plan, timer, args):
+    """Run a planned query on every shard and merge the hits of the requested page
+
+    Each shard only collects as many hits as the page needs, the top hits
+    of all shards are then merged by score. Paginated requests collect one
+    hit more, which tells whether there is a next page without counting
+    every match. With collapse set every shard keeps only its best hit of
+    each near-duplicate cluster, and the merge drops hits whose cluster
+    already came up in a better hit from another shard. Articles without a
+    cluster are never collapsed.
+
+    Returns:
+        A tuple with a list of (searcher, docnum) pairs for the hits on the
+        page and the cursor for the next page (None if this is the last page)"""
+
+    first = plan.offset
+    last = plan.limit
+    if plan.page_size is not None:
+        last = min(plan.limit, plan.offset + plan.page_size)
+    if last <= first:
+        return [], None
+    paginated = plan.page_size is not None and last < plan.limit
+    fetch = last + 1 if paginated else last
+
+    hits = []
+    truncated = False
+    dropped = False
+    with timer.stage('search'):
+        for order, searcher in enumerate(searchers):
+            # Whoosh 2.7's block quality skipping can loop forever on a union once tied
+            # scores make its block qualities add up to the lowest score collected so far
+            if plan.collapse:
+                results = searcher.search(plan.query, filter=plan.filter, limit=fetch, optimize=False, collapse="cluster", collapse_limit=1)
+            else:
+                results = searcher.search(plan.query, filter=plan.filter, limit=fetch, optimize=False)
+            truncated = truncated or results.scored_length() >= fetch
+            for position in range(results.scored_length()):
+                hits.append((-results.score(position), order, results.docnum(position)))
+        if plan.collapse and len(searchers) > 1:
+            hits.sort()
+            clusters = [column_lookup(searcher.reader(), "cluster") for searcher in searchers]
+            seen_clusters = set()
+            unique_hits = []
+            for hit in hits:
+                if len(unique_hits) >= fetch:
+                    break
+                cluster = clusters[hit[1]](hit[2])
+                if cluster:
+                    if cluster in seen_clusters:
+                        dropped = True
+                        continue
+                    seen_clusters.add(cluster)
+                unique_hits.append(hit)
+            hits = unique_hits
+        elif len(searchers) > 1:
+            hits = heapq.nsmallest(fetch, hits)
+
+    page = [(searchers[order], docnum) for _, order, docnum in hits[first:last]]
+    next_cursor = None
+    # A shard that filled its limit may have more hits than the ones dropped as duplicates of other shards
+    if paginated and (len(hits) > last or (dropped and truncated)):
+        next_cursor = encode_cursor(args, last)
+    return page, next_cursor
+
+def load_record(searcher, docnum, with_text = False, stored_fields = None):
+    """Get the hit record of one hit, see HitEncoding.hit_record
+
+    With with_text set the article text from the body store is added as
+    articletext, an empty string if the article hasn't been enriched yet"""
+
+    if stored_fields is None:
+        stored_fields = searcher.stored_fields(docnum)
+    articletext = None
+    if with_text:
+        articletext = ""
+        if 'ID' in stored_fields:
+            articletext = body_store.get(stored_fields['ID']) or ""
+    return hit_record(stored_fields, articletext)
+
+def iter_articles(page, with_text = False):
+    """Yield the hit records of the hits on the page one at a time"""
+
+    for searcher, docnum in page:
+        yield load_record(searcher, docnum, with_text)
+
+def encode_shared_articles(pages, timer):
+    """Serialize the hits of several pages, loading and encoding each hit only once
+
+    Pages in the columns layout reuse the loaded hits but are encoded
+    as a whole.
+
+    Arguments:
+        pages (list) - (page, with_text, layout) tuples, see search_page, iter_articles and parse_layout
+
+    Returns:
+        A list with the JSON encoded article list of each page"""
+
+    stored = {}
+    records = {}
+    encoded = {}
+    encoded_pages = []
+    for page, with_text, layout in pages:
+        page_records = []
+        for searcher, docnum in page:
+            hit_key = (id(searcher), docnum, with_text)
+            if hit_key not in records:
+                with timer.stage('materialize'):
+                    if (id(searcher), docnum) not in stored:
+                        stored[(id(searcher), docnum)] = searcher.stored_fields(docnum)
+                    records[hit_key] = load_record(searcher, docnum, with_text, stored[(id(searcher), docnum)])
+            page_records.append(hit_key)
+        with timer.stage('encode'):
+            if layout == 'columns':
+                encoded_pages.append(hit_encoder.encode([records[hit_key] for hit_key in page_records], layout))
+                continue
+            for hit_key in page_records:
+                if hit_key not in encoded:
+                    encoded[hit_key] = hit_encoder.encode_row(records[hit_key])
+            encoded_pages.append("[" + ", ".join(encoded[hit_key] for hit_key in page_records) + "]")
+    return encoded_pages
+
+def search_articles(searchers, plan, timer, args, layout = DEFAULT_LAYOUT):
+    """Run a planned query and serialize the stored fields of every hit in the given layout
+
+    Returns:
+        A tuple with the amount of results, the JSON encoded article list
+        and the cursor for the next page"""
+
+    page, next_cursor = search_page(searchers, plan, timer, args)
+    with timer.stage('materialize'):
+        articles = list(iter_articles(page, plan.with_text))
+    with timer.stage('encode'):
+        articles_json = hit_encoder.encode(articles, layout)
+    return len(articles), articles_json, next_cursor
+
+def stream_articles(plan, start_time, timer, request_start):
+    """Stream hits as NDJSON while the searchers yield them
+
+    Each line holds one article, so the layout argument doesn't apply.
+    The last line holds the status, amount of results, time taken, the
+    next cursor if there are more pages and the stage timings if they were
+    requested"""
+
+    def generate():
+        with ExitStack() as stack:
+            with timer.stage('index_open'):
+                searchers = stack.enter_context(searcher_pool.searchers(plan.start_date, plan.end_date))
+            page, next_cursor = search_page(searchers, plan, timer, request.args)
+            articles = iter_articles(page, plan.with_text)
+            while True:
+                with timer.stage('materialize'):
+                    current_article = next(articles, None)
+                if current_article is None:
+                    break
+                with timer.stage('encode'):
+                    line = hit_encoder.encode_row(current_article) + "\n"
+                yield line
+
+        summary = {'status': 200, 'results': len(page), 'time_taken': round((time() - start_time), 2)}
+        if next_cursor is not None:
+            summary['next_cursor'] = next_cursor
+        if timer.enabled:
+            summary['timings'] = timer.as_dict()
+        observe_request('newsapi_ndjson', perf_counter() - request_start)
+        yield flask.json.dumps(summary) + "\n"
+
+    return app.response_class(flask.stream_with_context(generate()), mimetype='application/x-ndjson')
+
 if __name__ == '__main__':
+    # Development server, Serve.py runs the workers in production
     app.run(host='127.0.0.1', port='8246')
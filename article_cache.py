@@ -0,0 +1,156 @@
+import sqlite3
+import sys
+import threading
+from collections import namedtuple
+from time import time
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+CACHE_PATH = "ArticleCache.sqlite3" # File to keep extracted articles in
+CACHE_TTL = 6 * 60 * 60 # Seconds before a cached article is revalidated with the website
+CACHE_MAX_BYTES = 256 * 1024 * 1024 # Size limit for cached article text, least recently used articles are evicted first
+
+CacheEntry = namedtuple('CacheEntry', ['text', 'etag', 'last_modified', 'fresh'])
+
+def normalize_url(url):
+    """Normalize an article URL so different spellings of the same link share a cache entry
+
+    Lowercases the scheme and host, drops default ports, fragments and
+    utm_* tracking parameters, and sorts the remaining query parameters"""
+
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = parts.hostname or ''
+    if parts.port is not None and not ((scheme == 'http' and parts.port == 80) or (scheme == 'https' and parts.port == 443)):
+        host += ":{}".format(parts.port)
+    path = parts.path or '/'
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not key.lower().startswith('utm_'))
+    return urlunsplit((scheme, host, path, urlencode(query), ''))
+
+class ArticleCache:
+    """On-disk cache of extracted article text keyed by normalized URL
+
+    Entries older than ttl seconds are still returned, but marked as not
+    fresh so the caller can revalidate them with a conditional GET using
+    the stored ETag/Last-Modified values."""
+
+    def __init__(self, path = None, ttl = None, max_bytes = None):
+        if path is None:
+            path = CACHE_PATH
+        if ttl is None:
+            ttl = CACHE_TTL
+        if max_bytes is None:
+            max_bytes = CACHE_MAX_BYTES
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS articles (
+            url TEXT PRIMARY KEY,
+            text TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            fetched_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            size INTEGER NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS articles_accessed ON articles (accessed_at)")
+        # Running total of the size column, kept in the file so every process sharing the cache agrees on it
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+        self.connection.execute("INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM articles")
+        self.connection.commit()
+
+    def lookup(self, url):
+        """Get the cached entry for a URL, or None if it has never been cached"""
+
+        key = normalize_url(url)
+        now = time()
+        with self.lock:
+            row = self.connection.execute("SELECT text, etag, last_modified, fetched_at FROM articles WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE articles SET accessed_at = ? WHERE url = ?", (now, key))
+            self.connection.commit()
+            fresh = (now - row[3]) < self.ttl
+            if fresh:
+                self.hits += 1
+            return CacheEntry(row[0], row[1], row[2], fresh)
+
+    def revalidated(self, url):
+        """Mark an expired entry as fresh again after the website answered 304 Not Modified"""
+
+        now = time()
+        with self.lock:
+            self.connection.execute("UPDATE articles SET fetched_at = ?, accessed_at = ? WHERE url = ?", (now, now, normalize_url(url)))
+            self.connection.commit()
+            self.hits += 1
+            self.revalidations += 1
+
+    def expired(self, url):
+        """Count an expired entry that had to be downloaded again as a miss"""
+
+        with self.lock:
+            self.misses += 1
+
+    def store(self, url, text, etag = None, last_modified = None):
+        """Save extracted article text, evicting the least recently used articles if the cache is full"""
+
+        now = time()
+        size = len(text.encode('utf-8'))
+        key = normalize_url(url)
+        with self.lock:
+            replaced = self.connection.execute("SELECT size FROM articles WHERE url = ?", (key,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?, ?)", (key, text, etag, last_modified, now, now, size))
+            self.connection.execute("UPDATE cache_size SET bytes = bytes + ? WHERE id = 0", (size - (replaced[0] if replaced is not None else 0),))
+            total = self.connection.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()[0]
+            evicted = 0
+            while total - evicted > self.max_bytes:
+                oldest = self.connection.execute("SELECT url, size FROM articles ORDER BY accessed_at LIMIT 64").fetchall()
+                if len(oldest) == 0:
+                    break
+                for oldest_key, entry_size in oldest:
+                    if total - evicted <= self.max_bytes:
+                        break
+                    self.connection.execute("DELETE FROM articles WHERE url = ?", (oldest_key,))
+                    evicted += entry_size
+                    self.evictions += 1
+            if evicted > 0:
+                self.connection.execute("UPDATE cache_size SET bytes = bytes - ? WHERE id = 0", (evicted,))
+            self.connection.commit()
+
+    def stats(self):
+        """Get hit/miss counters and the current size of the cache"""
+
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+            size = self.connection.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations, 'evictions': self.evictions, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_shared_cache():
+    """Get the process-wide article cache stored at CACHE_PATH"""
+
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ArticleCache()
+        return _shared_cache
+
+def __main(argv):
+    cache = ArticleCache(argv[1] if len(argv) > 1 else CACHE_PATH)
+    stats = cache.stats()
+    print("Cached articles: {}".format(stats['entries']))
+    print("Cached text size: {} bytes (limit {} bytes)".format(stats['bytes'], cache.max_bytes))
+    cache.close()
+
+if __name__ == "__main__":
+    __main(sys.argv)
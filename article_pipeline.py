@@ -0,0 +1,535 @@
+import asyncio
+import threading
+from collections import deque
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from article_cache import get_shared_cache
+from http_client import get_session
+from host_health import get_host_health
+from timings import NULL_TIMER, NO_DEADLINE
+
+MAX_DOWNLOADS = 16 # Maximum amount of articles downloaded at once
+MAX_DOWNLOADS_PER_HOST = 4 # Maximum amount of articles downloaded at once from one website
+PARSE_PROCESSES = None # Amount of parsing processes, None = one per core, 0 = parse in the download threads
+USE_CACHE = True # Whether to keep extracted articles in the shared on-disk article cache
+TEXT_ONLY = True # Whether to only extract the body text instead of running newspaper's full Article.parse
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def _get_parse_pool(processes):
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            _parse_pool = ProcessPoolExecutor(max_workers=processes)
+        return _parse_pool
+
+# newspaper pulls in lxml, NLTK and Pillow, which takes longer to import than
+# everything else together. It is only imported once an article actually has
+# to be downloaded or parsed, so answers from the article cache and processes
+# that only import this module for its helpers start fast.
+_download_config = None
+_text_config = None
+
+def _get_download_config():
+    global _download_config
+    if _download_config is None:
+        from newspaper.configuration import Configuration
+        _download_config = Configuration()
+    return _download_config
+
+def _request_headers(cached_entry = None):
+    download_config = _get_download_config()
+    headers = dict(download_config.headers)
+    headers['User-Agent'] = download_config.browser_user_agent
+    if cached_entry is not None:
+        if cached_entry.etag is not None:
+            headers['If-None-Match'] = cached_entry.etag
+        if cached_entry.last_modified is not None:
+            headers['If-Modified-Since'] = cached_entry.last_modified
+    return headers
+
+def _download_article(url, cached_entry = None, timeout = None):
+    """Download an article's HTML over the shared keep-alive session,
+    revalidating cached_entry with a conditional GET if given
+
+    Returns a (html, etag, last_modified) tuple, html is None if the website
+    answered 304 Not Modified"""
+
+    from newspaper import network
+
+    download_config = _get_download_config()
+    if timeout is None:
+        timeout = download_config.request_timeout
+    response = get_session().get(url, headers=_request_headers(cached_entry), timeout=timeout, proxies=download_config.proxies, allow_redirects=True)
+    if response.status_code == 304 and cached_entry is not None:
+        return None, cached_entry.etag, cached_entry.last_modified
+    response.raise_for_status()
+    html = network.get_html_2XX_only(url, download_config, response=response)
+    return html, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+async def _download_article_async(session, url, cached_entry = None):
+    """Same as _download_article, over an aiohttp session"""
+
+    async with session.get(url, headers=_request_headers(cached_entry), allow_redirects=True) as response:
+        if response.status == 304 and cached_entry is not None:
+            return None, cached_entry.etag, cached_entry.last_modified
+        response.raise_for_status()
+        html = await response.text(errors='replace')
+        return html, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+def _start_download(health, deadline, url):
+    """Check the circuit breaker of url's website and get the timeout to download it with
+
+    Raises HostUnavailable if the website is being skipped and TimeoutError
+    if the deadline already passed, which also marks the deadline expired
+
+    Returns:
+        A tuple with the timeout, whether it is the website's own timeout
+        rather than the time left until the deadline and whether the
+        download tests the website's circuit breaker, see HostHealth.check"""
+
+    probe = health.check(url)
+    host_timeout = health.timeout(url)
+    timeout = deadline.limit(host_timeout)
+    if timeout <= 0:
+        if probe:
+            health.release(url)
+        deadline.expired = True
+        raise TimeoutError("Deadline passed before downloading " + url)
+    return timeout, timeout == host_timeout, probe
+
+def _download_failed(health, deadline, url, exception, full_timeout):
+    """Count a failed download against its website
+
+    Downloads cut short by the deadline aren't counted but mark the
+    deadline expired. Client errors like 404, which only say something
+    about the article, aren't counted either"""
+
+    if not full_timeout:
+        deadline.expired = True
+        return
+    status = getattr(getattr(exception, 'response', None), 'status_code', None) or getattr(exception, 'status', None)
+    if status is None or status >= 500 or status == 429:
+        health.failure(url)
+
+_text_extractors = threading.local()
+
+def _get_text_config():
+    """Get the configuration shared by every text-only extraction, images, memoization and article HTML are never used"""
+
+    global _text_config
+    if _text_config is None:
+        from newspaper.configuration import Configuration
+        text_config = Configuration()
+        text_config.fetch_images = False
+        text_config.memoize_articles = False
+        text_config.keep_article_html = False
+        _text_config = text_config
+    return _text_config
+
+def _get_text_extractors(language):
+    """Get this thread's document cleaner, content extractor and output formatter for language
+
+    They are created once per thread and language and reused for every
+    article after that"""
+
+    extractors = getattr(_text_extractors, 'by_language', None)
+    if extractors is None:
+        extractors = _text_extractors.by_language = {}
+    if language not in extractors:
+        from newspaper.cleaners import DocumentCleaner
+        from newspaper.extractors import ContentExtractor
+        from newspaper.outputformatters import OutputFormatter
+
+        text_config = _get_text_config()
+        extractor = ContentExtractor(text_config)
+        output_formatter = OutputFormatter(text_config)
+        if language != text_config.language:
+            extractor.update_language(language)
+            output_formatter.update_language(language)
+        extractors[language] = (DocumentCleaner(text_config), extractor, output_formatter)
+    return extractors[language]
+
+def _extract_text(html):
+    """Extract only the body text of an article
+
+    Does the same body text extraction as Article.parse, but on a single
+    lxml tree without the deep copies, and skips the title, author, date,
+    tag, video and image extraction we never use"""
+
+    text_config = _get_text_config()
+    doc = text_config.get_parser().fromstring(html)
+    if doc is None:
+        return ''
+
+    language = text_config.language
+    if text_config.use_meta_language:
+        language = _get_text_extractors(language)[1].get_meta_lang(doc) or language
+    document_cleaner, extractor, output_formatter = _get_text_extractors(language)
+
+    doc = document_cleaner.clean(doc)
+    top_node = extractor.calculate_best_node(doc)
+    if top_node is None:
+        return ''
+    top_node = extractor.post_cleanup(top_node)
+    text, _ = output_formatter.get_formatted(top_node)
+    return text
+
+def _parse_article(url, html, text_only = True):
+    """Parse downloaded HTML, returning the article text and the seconds parsing took"""
+
+    parse_start = perf_counter()
+    if text_only:
+        text = _extract_text(html)
+    else:
+        from newspaper import Article
+
+        parsed_article = Article(url)
+        parsed_article.download(input_html=html)
+        parsed_article.parse()
+        text = parsed_article.text
+    return text, perf_counter() - parse_start
+
+def _lookup_cached(urls, cache, timer, verbose):
+    """Look every URL up in the article cache
+
+    Returns:
+        A dict of URL positions to the text of fresh cached articles, and a
+        dict of URL positions to the cache entries that need revalidating"""
+
+    cached_hits = {}
+    cached_entries = {}
+    if cache:
+        for index, url in enumerate(urls):
+            with timer.stage('cache_lookup'):
+                cached_entry = cache.lookup(url)
+            if cached_entry is None:
+                continue
+            if cached_entry.fresh:
+                if verbose:
+                    print("Using cached article " + url)
+                cached_hits[index] = cached_entry.text
+            else:
+                cached_entries[index] = cached_entry
+    return cached_hits, cached_entries
+
+class _HostQueues:
+    """Queues URLs per website and hands them out round robin, only while
+    their website has fewer than max_per_host downloads running
+
+    URLs only reach the download pool once their website has a free slot,
+    so a result list led by one website never leaves pool threads waiting
+    on that website while others' URLs queue behind them. Used from a
+    single thread."""
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self.queues = {}
+        self.running = {}
+        self.hosts = deque()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def add(self, index, url):
+        host = urlsplit(url).netloc.lower()
+        if host not in self.queues:
+            self.queues[host] = deque()
+            self.running[host] = 0
+            self.hosts.append(host)
+        self.queues[host].append(index)
+
+    def pop(self):
+        """Get the index of the next URL whose website has a free slot, None if there is none"""
+
+        for _ in range(len(self.hosts)):
+            host = self.hosts[0]
+            self.hosts.rotate(-1)
+            if len(self.queues[host]) > 0 and self.running[host] < self.max_per_host:
+                self.running[host] += 1
+                return self.queues[host].popleft()
+        return None
+
+    def release(self, url):
+        """Free the slot of a finished download"""
+
+        self.running[urlsplit(url).netloc.lower()] -= 1
+
+def iter_extracted(urls, verbose = False, max_downloads = None, max_per_host = None, parse_processes = None, cache = None, timer = NULL_TIMER, text_only = None, deadline = NO_DEADLINE):
+    """Download and parse articles concurrently, yielding them as they finish
+
+    Downloads run in a thread pool, parsing runs in a shared process pool
+    so that lxml/NLTK work is spread over every core. Articles found in
+    the article cache are returned without being downloaded again, expired
+    ones are revalidated with a conditional GET first.
+
+    Every website gets its own download timeout from its recent latency,
+    websites that keep failing are skipped for a while, see
+    host_health.HostHealth. Once the deadline passes the articles still
+    being downloaded or parsed are given up on.
+
+    Arguments:
+        urls (list) - Article URLs to download and parse
+        verbose (bool) - Whether to show verbose output
+        max_downloads (int) - Global download limit, MAX_DOWNLOADS by default
+        max_per_host (int) - Per website download limit, MAX_DOWNLOADS_PER_HOST by default
+        parse_processes (int) - Amount of parsing processes, PARSE_PROCESSES by default
+        cache (ArticleCache) - Cache to use, the shared cache by default if USE_CACHE is set
+                Pass False to skip the cache
+        timer (StageTimer) - Records time spent in the cache_lookup, download and parse stages
+        text_only (bool) - Whether to only extract the body text, TEXT_ONLY by default
+        deadline (Deadline) - When to stop waiting for articles, deadline.expired
+                is set if any were given up on
+
+    Returns:
+        A generator of (index, text) tuples in completion order, where index
+        is the position of the URL in urls. Articles that failed to download
+        or parse, or didn't finish before the deadline, are skipped"""
+
+    if max_downloads is None:
+        max_downloads = MAX_DOWNLOADS
+    if max_per_host is None:
+        max_per_host = MAX_DOWNLOADS_PER_HOST
+    if parse_processes is None:
+        parse_processes = PARSE_PROCESSES
+    if cache is None and USE_CACHE:
+        cache = get_shared_cache()
+    if text_only is None:
+        text_only = TEXT_ONLY
+
+    if len(urls) == 0:
+        return
+
+    health = get_host_health()
+    parse_pool = None
+    if parse_processes != 0:
+        parse_pool = _get_parse_pool(parse_processes)
+
+    def download(url, cached_entry):
+        timeout, full_timeout, probe = _start_download(health, deadline, url)
+        download_start = perf_counter()
+        try:
+            with timer.stage('download'):
+                result = _download_article(url, cached_entry, timeout)
+        except Exception as e:
+            _download_failed(health, deadline, url, e, full_timeout)
+            raise
+        else:
+            health.success(url, perf_counter() - download_start)
+        finally:
+            if probe:
+                health.release(url)
+        return result
+
+    cached_hits, cached_entries = _lookup_cached(urls, cache, timer, verbose)
+    for index, text in cached_hits.items():
+        yield index, text
+
+    download_pool = ThreadPoolExecutor(max_workers=max_downloads)
+    try:
+        if parse_pool is None:
+            parse_pool = download_pool
+        host_queues = _HostQueues(max_per_host)
+        for index, url in enumerate(urls):
+            if index not in cached_hits:
+                host_queues.add(index, url)
+        downloads = {}
+        parses = {}
+        validators = {}
+        pending = set()
+
+        def submit_downloads():
+            while len(downloads) < max_downloads:
+                index = host_queues.pop()
+                if index is None:
+                    break
+                future = download_pool.submit(download, urls[index], cached_entries.get(index))
+                downloads[future] = index
+                pending.add(future)
+
+        submit_downloads()
+        while pending:
+            done, not_done = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            pending.clear()
+            pending.update(not_done)
+            if len(done) == 0:
+                deadline.expired = True
+                if verbose:
+                    print("Deadline passed, giving up on {} articles".format(len(downloads) + len(parses) + len(host_queues)))
+                for future in pending:
+                    future.cancel()
+                break
+            for future in done:
+                if future in downloads:
+                    index = downloads.pop(future)
+                    host_queues.release(urls[index])
+                    submit_downloads()
+                    try:
+                        html, etag, last_modified = future.result()
+                    except Exception as e:
+                        if verbose:
+                            print("Failed to download article {} with exception {}, skipping".format(urls[index], e))
+                        continue
+                    if html is None:
+                        cache.revalidated(urls[index])
+                        if verbose:
+                            print("Revalidated cached article " + urls[index])
+                        yield index, cached_entries[index].text
+                        continue
+                    if index in cached_entries:
+                        cache.expired(urls[index])
+                    validators[index] = (etag, last_modified)
+                    parse_future = parse_pool.submit(_parse_article, urls[index], html, text_only)
+                    parses[parse_future] = index
+                    pending.add(parse_future)
+                else:
+                    index = parses.pop(future)
+                    try:
+                        text, parse_time = future.result()
+                    except Exception as e:
+                        if verbose:
+                            print("Failed to parse article {} with exception {}, skipping".format(urls[index], e))
+                        continue
+                    timer.add('parse', parse_time)
+                    if verbose:
+                        print("Parsed article " + urls[index])
+                    if cache:
+                        cache.store(urls[index], text, *validators.pop(index))
+                    yield index, text
+    finally:
+        # Downloads still running after the deadline finish in the background
+        download_pool.shutdown(wait=not deadline.expired)
+
+    if verbose and cache:
+        print("Article cache: {hits} hits, {misses} misses, {revalidations} revalidated, {evictions} evicted".format(**cache.stats()))
+
+def extract_articles(urls, verbose = False, max_downloads = None, max_per_host = None, parse_processes = None, cache = None, timer = NULL_TIMER, text_only = None, deadline = NO_DEADLINE):
+    """Download and parse articles concurrently
+
+    Arguments:
+        Same as iter_extracted
+
+    Returns:
+        A list with the article text for each URL in urls, in the same order,
+        or None for articles that failed to download or parse"""
+
+    texts = [None] * len(urls)
+    for index, text in iter_extracted(urls, verbose, max_downloads, max_per_host, parse_processes, cache, timer, text_only, deadline):
+        texts[index] = text
+    return texts
+
+async def iter_extracted_async(urls, session, verbose = False, max_per_host = None, parse_processes = None, cache = None, timer = NULL_TIMER, text_only = None, deadline = NO_DEADLINE):
+    """asyncio counterpart of iter_extracted
+
+    Downloads run on the event loop over session, which also sets the
+    global connection limit, parsing runs in the shared process pool.
+
+    Arguments:
+        urls (list) - Article URLs to download and parse
+        session (aiohttp.ClientSession) - Session to download with, see http_client.make_async_session
+        Everything else is the same as iter_extracted
+
+    Returns:
+        An async generator of (index, text) tuples in completion order"""
+
+    if max_per_host is None:
+        max_per_host = MAX_DOWNLOADS_PER_HOST
+    if parse_processes is None:
+        parse_processes = PARSE_PROCESSES
+    if cache is None and USE_CACHE:
+        cache = get_shared_cache()
+    if text_only is None:
+        text_only = TEXT_ONLY
+
+    if len(urls) == 0:
+        return
+
+    loop = asyncio.get_running_loop()
+    health = get_host_health()
+    parse_pool = None
+    if parse_processes != 0:
+        parse_pool = _get_parse_pool(parse_processes)
+    host_semaphores = {}
+
+    # The article cache is SQLite, its calls run on the default executor to keep the event loop free
+    cached_hits, cached_entries = await loop.run_in_executor(None, _lookup_cached, urls, cache, timer, verbose)
+    for index, text in cached_hits.items():
+        yield index, text
+
+    async def extract(index):
+        url = urls[index]
+        host = urlsplit(url).netloc.lower()
+        if host not in host_semaphores:
+            host_semaphores[host] = asyncio.Semaphore(max_per_host)
+        try:
+            async with host_semaphores[host]:
+                timeout, full_timeout, probe = _start_download(health, deadline, url)
+                download_start = perf_counter()
+                try:
+                    with timer.stage('download'):
+                        html, etag, last_modified = await asyncio.wait_for(_download_article_async(session, url, cached_entries.get(index)), timeout)
+                except Exception as e:
+                    _download_failed(health, deadline, url, e, full_timeout)
+                    raise
+                else:
+                    health.success(url, perf_counter() - download_start)
+                finally:
+                    # Also runs when the task is cancelled, which except Exception doesn't catch
+                    if probe:
+                        health.release(url)
+        except Exception as e:
+            if verbose:
+                print("Failed to download article {} with exception {}, skipping".format(url, e))
+            return index, None
+        if html is None:
+            await loop.run_in_executor(None, cache.revalidated, url)
+            if verbose:
+                print("Revalidated cached article " + url)
+            return index, cached_entries[index].text
+        if index in cached_entries:
+            cache.expired(url)
+
+        try:
+            if parse_pool is None:
+                text, parse_time = _parse_article(url, html, text_only)
+            else:
+                text, parse_time = await loop.run_in_executor(parse_pool, _parse_article, url, html, text_only)
+        except Exception as e:
+            if verbose:
+                print("Failed to parse article {} with exception {}, skipping".format(url, e))
+            return index, None
+        timer.add('parse', parse_time)
+        if verbose:
+            print("Parsed article " + url)
+        if cache:
+            await loop.run_in_executor(None, cache.store, url, text, etag, last_modified)
+        return index, text
+
+    tasks = [asyncio.ensure_future(extract(index)) for index in range(len(urls)) if index not in cached_hits]
+    try:
+        for task in asyncio.as_completed(tasks, timeout=deadline.remaining()):
+            try:
+                index, text = await task
+            except asyncio.TimeoutError:
+                deadline.expired = True
+                if verbose:
+                    print("Deadline passed, giving up on {} articles".format(sum(1 for task in tasks if not task.done())))
+                break
+            if text is not None:
+                yield index, text
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if verbose and cache:
+        print("Article cache: {hits} hits, {misses} misses, {revalidations} revalidated, {evictions} evicted".format(**cache.stats()))
+
+async def extract_articles_async(urls, session, verbose = False, max_per_host = None, parse_processes = None, cache = None, timer = NULL_TIMER, text_only = None, deadline = NO_DEADLINE):
+    """asyncio counterpart of extract_articles"""
+
+    texts = [None] * len(urls)
+    async for index, text in iter_extracted_async(urls, session, verbose, max_per_host, parse_processes, cache, timer, text_only, deadline):
+        texts[index] = text
+    return texts
@@ -0,0 +1,419 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import types
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from time import perf_counter, process_time, sleep
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "GoogleNewsApi"))
+
+BENCHMARK_SEED = 1234 # Seed for the synthetic corpus and query mixes
+BENCHMARK_WORDS = ("virus vaccine economy market election court storm sports health technology climate energy "
+                   "border trade school police hospital film music weather bank housing oil war peace "
+                   "senate congress budget tax jobs inflation space science football tennis travel airline").split()
+BENCHMARK_SOURCES = ["CNN", "BBC", "Reuters", "Fox News", "The Guardian", "Associated Press", "Bloomberg", "NPR"]
+BENCHMARK_START_DATE = datetime(2020, 1, 1) # First date of the synthetic corpus
+QUERY_MIXES = ('topic', 'source', 'date', 'combined') # Query mixes used against /newsapi
+
+def percentiles(samples):
+    """Get p50/p95/p99, mean and max of latency samples in milliseconds"""
+
+    if len(samples) == 0:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000, 3)
+
+    return {'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3), 'max_ms': round(ordered[-1] * 1000, 3)}
+
+def generate_corpus(size, days, seed = BENCHMARK_SEED):
+    """Yield synthetic scrape records in the record log format"""
+
+    generator = random.Random(seed)
+    for number in range(size):
+        date = BENCHMARK_START_DATE + timedelta(days=generator.randrange(days))
+        yield {'title': " ".join(generator.sample(BENCHMARK_WORDS, 6)),
+               'description': " ".join(generator.sample(BENCHMARK_WORDS, 14)),
+               'source': generator.choice(BENCHMARK_SOURCES),
+               'URL': "https://bench{0}.example.com/article/{1}".format(number % 50, number),
+               'date': date.strftime('%m/%d/%Y')}
+
+def build_corpus_index(index_name, size, days, procs):
+    """Index a synthetic corpus with the real article_schema through the rebuild tool"""
+
+    from Rebuild import rebuild_index
+
+    documents, time_taken = rebuild_index(generate_corpus(size, days), index_name=index_name, procs=procs, verbose=False)
+    return {'documents': documents, 'days': days, 'seconds': round(time_taken, 3), 'docs_per_sec': round(documents / max(time_taken, 0.001), 1)}
+
+def make_query(mix, generator, days, amount):
+    args = {'amount': amount}
+    start_date = BENCHMARK_START_DATE + timedelta(days=generator.randrange(days))
+    end_date = start_date + timedelta(days=generator.choice([1, 7, 30]))
+    if mix in ('topic', 'combined'):
+        args['topic'] = generator.choice(BENCHMARK_WORDS)
+    if mix in ('source', 'combined'):
+        args['source'] = '"{}"'.format(generator.choice(BENCHMARK_SOURCES))
+    if mix in ('date', 'combined'):
+        args['start_date'] = start_date.strftime('%m-%d-%Y')
+        args['end_date'] = end_date.strftime('%m-%d-%Y')
+    if mix == 'combined':
+        args['combine'] = True
+    return args
+
+def start_server(app):
+    """Serve a WSGI app on a free local port in a background thread"""
+
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:{}".format(server.server_port)
+
+def load_test(base_url, days, requests_per_mix, concurrency, amount, seed = BENCHMARK_SEED):
+    """Send every query mix to /newsapi from concurrent clients and measure latency and QPS"""
+
+    results = {}
+    for mix in QUERY_MIXES:
+        generator = random.Random("{0}-{1}".format(seed, mix))
+        urls = [base_url + "/newsapi?" + urlencode(make_query(mix, generator, days, amount)) for _ in range(requests_per_mix)]
+
+        def timed_request(url):
+            request_start = perf_counter()
+            with urlopen(url) as response:
+                body = json.loads(response.read())
+            return perf_counter() - request_start, body.get('results', 0)
+
+        mix_start = perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(timed_request, urls))
+        mix_time = perf_counter() - mix_start
+
+        results[mix] = percentiles([sample[0] for sample in samples])
+        results[mix]['requests'] = len(samples)
+        results[mix]['qps'] = round(len(samples) / mix_time, 1)
+        results[mix]['mean_results'] = round(sum(sample[1] for sample in samples) / len(samples), 1)
+    return results
+
+def benchmark_api(index_name, days, requests_per_mix, concurrency, amount, result_cache):
+    config = types.ModuleType("config")
+    config.ARTICLE_INDEX_NAME = index_name
+    sys.modules["config"] = config
+    import WebAPI
+
+    if not result_cache:
+        WebAPI.result_cache.max_bytes = 0
+    server, base_url = start_server(WebAPI.app)
+    try:
+        results = load_test(base_url, days, requests_per_mix, concurrency, amount)
+    finally:
+        server.shutdown()
+    results['result_cache'] = WebAPI.result_cache.stats()
+    return results
+
+def make_article_html(generator, number):
+    paragraphs = ["<p>{}.</p>".format(" ".join(generator.choice(BENCHMARK_WORDS) for _ in range(60))) for _ in range(8)]
+    return ("<html lang=\"en\"><head><title>Benchmark article {0}</title>"
+            "<meta name=\"author\" content=\"Bench Reporter\"><meta name=\"description\" content=\"Benchmark article {0}\">"
+            "<meta name=\"keywords\" content=\"{2}\"><meta property=\"og:title\" content=\"Benchmark article {0}\">"
+            "<meta property=\"article:published_time\" content=\"2020-06-01T12:00:00Z\"><link rel=\"canonical\" href=\"/article/{0}\"></head>"
+            "<body><nav>Home News Sports</nav><article><h1>Benchmark article {0}</h1>{1}</article><footer>Copyright</footer></body></html>"
+            ).format(number, "".join(paragraphs), ",".join(generator.sample(BENCHMARK_WORDS, 4)))
+
+class _ArticleHostHandler(BaseHTTPRequestHandler):
+    """Serves canned article HTML after the host's injected latency, and a canned /newsapi response"""
+
+    def do_GET(self):
+        if self.path.startswith("/newsapi"):
+            body = json.dumps(self.server.newsapi_response).encode('utf-8')
+            content_type = "application/json"
+        else:
+            sleep(self.server.latency)
+            number = int(self.path.rsplit("/", 1)[-1])
+            body = self.server.pages[number % len(self.server.pages)].encode('utf-8')
+            content_type = "text/html; charset=utf-8"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def benchmark_downloads(articles, host_latencies, time_limit = None, seed = BENCHMARK_SEED):
+    """Run news_api.get_processed_articles against local article hosts with injected latency
+
+    Every latency in host_latencies gets its own local server, standing in
+    for one publisher. The first server also answers /newsapi with a
+    canned response listing the articles, like the cached NewsAPI request
+    replay in news.py, so nothing touches the network."""
+
+    import article_pipeline
+    import news_api
+
+    generator = random.Random(seed)
+    pages = [make_article_html(generator, number) for number in range(20)]
+    servers = []
+    for latency in host_latencies:
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _ArticleHostHandler)
+        server.latency = latency / 1000
+        server.pages = pages
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+    listed_articles = []
+    for number in range(articles):
+        server = servers[number % len(servers)]
+        listed_articles.append({'title': "Benchmark article {}".format(number), 'source': "Bench", 'URL': "http://127.0.0.1:{0}/article/{1}".format(server.server_port, number)})
+    servers[0].newsapi_response = {'status': 200, 'results': len(listed_articles), 'time_taken': 0, 'articles': listed_articles}
+
+    news_api.NEWS_API_URL = "http://127.0.0.1:{}/newsapi".format(servers[0].server_port)
+    use_cache = article_pipeline.USE_CACHE
+    article_pipeline.USE_CACHE = False
+    try:
+        run_start = perf_counter()
+        news_json = news_api.get_processed_articles(topic="benchmark", amount=articles, time_limit=time_limit)
+        run_time = perf_counter() - run_start
+    finally:
+        article_pipeline.USE_CACHE = use_cache
+        for server in servers:
+            server.shutdown()
+
+    serial_estimate = sum(host_latencies[number % len(host_latencies)] for number in range(articles)) / 1000
+    return {'articles': articles, 'extracted': news_json['results'], 'partial': news_json['partial'], 'time_limit': time_limit, 'host_latencies_ms': host_latencies,
+            'seconds': round(run_time, 3), 'articles_per_sec': round(news_json['results'] / max(run_time, 0.001), 1),
+            'serial_latency_seconds': round(serial_estimate, 3)}
+
+def _measure_extraction(pages, text_only):
+    """Extract every page in this process
+
+    Runs once for CPU time and once more under tracemalloc for the peak
+    Python memory of each article, so the tracing doesn't skew the CPU
+    times. Meant to run in a fresh process so max RSS belongs to one mode."""
+
+    import resource
+    import tracemalloc
+    from article_pipeline import _parse_article
+
+    _parse_article("http://bench.example.com/article/0", pages[0], text_only)
+    cpu_times = []
+    texts = []
+    for number, html in enumerate(pages):
+        cpu_start = process_time()
+        text, _ = _parse_article("http://bench.example.com/article/{}".format(number), html, text_only)
+        cpu_times.append(process_time() - cpu_start)
+        texts.append(text)
+
+    peaks = []
+    for number, html in enumerate(pages):
+        tracemalloc.start()
+        _parse_article("http://bench.example.com/article/{}".format(number), html, text_only)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return cpu_times, peaks, texts, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def benchmark_extraction(articles, seed = BENCHMARK_SEED):
+    """Compare per-article CPU time and memory of the full Article.parse and the text-only extraction"""
+
+    generator = random.Random(seed)
+    pages = [make_article_html(generator, number) for number in range(articles)]
+    results = {}
+    texts = {}
+    for mode, text_only in (('full', False), ('text_only', True)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+            cpu_times, peaks, texts[mode], max_rss = pool.submit(_measure_extraction, pages, text_only).result()
+        results[mode] = {'cpu': percentiles(cpu_times), 'articles_per_cpu_sec': round(len(pages) / max(sum(cpu_times), 0.000001), 1),
+                         'python_peak_kb_mean': round(sum(peaks) / len(peaks) / 1024, 1), 'python_peak_kb_max': round(max(peaks) / 1024, 1),
+                         'max_rss_mb': round(max_rss / 1024, 1)}
+    results['articles'] = len(pages)
+    results['identical_text'] = sum(1 for full_text, text in zip(texts['full'], texts['text_only']) if full_text == text)
+    results['cpu_speedup'] = round(results['text_only']['articles_per_cpu_sec'] / max(results['full']['articles_per_cpu_sec'], 0.000001), 2)
+    return results
+
+def benchmark_encoding(index_name, hits, repeats = 20):
+    """Compare the time to encode hits with the old per-hit dicts and flask.json.dumps against HitEncoding.py
+
+    Returns milliseconds per 1,000 hits and the encoded size for every
+    encoder and layout"""
+
+    import flask
+    from SearcherPool import ShardedSearcherPool
+    from HitEncoding import HitEncoder, hit_record
+
+    searcher_pool = ShardedSearcherPool(index_name)
+    with searcher_pool.searchers() as searchers:
+        stored = []
+        for searcher in searchers:
+            stored.extend(searcher.stored_fields(docnum) for docnum in range(min(searcher.doc_count_all(), hits - len(stored))))
+    searcher_pool.close()
+    app = flask.Flask(__name__)
+
+    def flask_dicts():
+        articles = []
+        for stored_fields in stored:
+            current_article = dict(stored_fields)
+            current_article.pop('ID', None)
+            articles.append(current_article)
+        with app.app_context():
+            return flask.json.dumps(articles)
+
+    encoders = {'flask': flask_dicts}
+    for name in ('json', 'auto'):
+        encoder = HitEncoder(name)
+        for layout in ('rows', 'columns'):
+            encoders["{0}_{1}".format(encoder.name, layout)] = lambda encoder=encoder, layout=layout: encoder.encode([hit_record(stored_fields) for stored_fields in stored], layout)
+
+    results = {'hits': len(stored)}
+    for name, encode in encoders.items():
+        encoded = encode()
+        samples = []
+        for _ in range(repeats):
+            encode_start = perf_counter()
+            encode()
+            samples.append(perf_counter() - encode_start)
+        results[name] = {'ms_per_1000_hits': round(min(samples) / len(stored) * 1000 * 1000, 3), 'bytes': len(encoded.encode('utf-8'))}
+    return results
+
+def _memory_kb(pid):
+    """Get the resident and proportional set size of a process in kB, None where /proc doesn't have them"""
+
+    sizes = {'rss_kb': None, 'pss_kb': None}
+    for path, field, key in (("/proc/{}/status", "VmRSS:", 'rss_kb'), ("/proc/{}/smaps_rollup", "Pss:", 'pss_kb')):
+        try:
+            with open(path.format(pid)) as status_file:
+                for line in status_file:
+                    if line.startswith(field):
+                        sizes[key] = int(line.split()[1])
+                        break
+        except OSError:
+            pass
+    return sizes
+
+def benchmark_serving(index_name, workers):
+    """Start Serve.py against the corpus index and measure cold start and memory per worker
+
+    Cold start is the time from launching the server until it first
+    answers /newsapi. Memory is read from /proc once every worker
+    answered, so it is only reported on Linux."""
+
+    work_dir = os.path.dirname(index_name)
+    with open(os.path.join(work_dir, "config.py"), 'w') as config_file:
+        config_file.write("ARTICLE_INDEX_NAME = {0!r}\nBODY_STORE_PATH = {1!r}\n".format(index_name, os.path.join(work_dir, "bodies.sqlite3")))
+    with socket.socket() as free_socket:
+        free_socket.bind(('127.0.0.1', 0))
+        port = free_socket.getsockname()[1]
+
+    api_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "GoogleNewsApi")
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join([work_dir, api_dir]))
+    start = perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(api_dir, "Serve.py"), "--port", str(port), "--workers", str(workers)], env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}/newsapi?topic=virus".format(port)
+    try:
+        while True:
+            try:
+                with urlopen(url) as response:
+                    response.read()
+                break
+            except OSError:
+                if server.poll() is not None or perf_counter() - start > 120:
+                    raise RuntimeError("Serve.py did not start")
+                sleep(0.01)
+        cold_start = perf_counter() - start
+
+        def fetch(_):
+            with urlopen(url) as response:
+                return response.read()
+
+        with ThreadPoolExecutor(max_workers=workers * 4) as pool:
+            list(pool.map(fetch, range(workers * 20)))
+
+        worker_pids = []
+        try:
+            with open("/proc/{0}/task/{0}/children".format(server.pid)) as children_file:
+                worker_pids = [int(pid) for pid in children_file.read().split()]
+        except OSError:
+            pass
+        results = {'workers': workers, 'cold_start_seconds': round(cold_start, 3), 'parent': _memory_kb(server.pid)}
+        results['worker_memory'] = [_memory_kb(pid) for pid in worker_pids]
+        if len(worker_pids) > 0 and all(memory['pss_kb'] is not None for memory in results['worker_memory']):
+            results['pss_mb_per_worker'] = round(sum(memory['pss_kb'] for memory in results['worker_memory']) / len(worker_pids) / 1024, 1)
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+def __main(argv):
+    parser = argparse.ArgumentParser(description="Reproducible benchmarks for the article index, /newsapi and the article download pipeline")
+    parser.add_argument("--corpus-size", type=int, default=20000, help="Synthetic articles to index")
+    parser.add_argument("--days", type=int, default=365, help="Days the synthetic corpus is spread over")
+    parser.add_argument("--procs", type=int, default=None, help="Indexing processes, one per core by default")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per query mix")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent /newsapi clients")
+    parser.add_argument("--amount", type=int, default=50, help="amount argument sent to /newsapi")
+    parser.add_argument("--result-cache", action="store_true", help="Keep the /newsapi result cache enabled")
+    parser.add_argument("--articles", type=int, default=50, help="Articles downloaded in the download benchmark")
+    parser.add_argument("--host-latency", default="0,50,200,800", help="Comma separated latency in ms of each local article host")
+    parser.add_argument("--time-limit", type=float, default=None, help="time_limit in seconds passed to get_processed_articles in the download benchmark")
+    parser.add_argument("--extract-articles", type=int, default=200, help="Articles parsed in the extraction benchmark")
+    parser.add_argument("--encode-hits", type=int, default=1000, help="Hits encoded in the encoding benchmark")
+    parser.add_argument("--workers", type=int, default=4, help="Worker processes started in the serving benchmark")
+    parser.add_argument("--skip", default="", help="Comma separated benchmarks to skip (index, api, encode, serve, download, extract)")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    args = parser.parse_args(argv[1:])
+    skip = [name for name in args.skip.split(",") if name != ""]
+
+    results = {'started': datetime.now().isoformat(), 'seed': BENCHMARK_SEED, 'python': sys.version.split()[0], 'cpus': os.cpu_count(), 'arguments': vars(args)}
+    work_dir = tempfile.mkdtemp(prefix="articleapi-bench-")
+    index_name = os.path.join(work_dir, "articleIndex")
+    try:
+        if "index" not in skip or "api" not in skip or "encode" not in skip or "serve" not in skip:
+            print("Indexing {} synthetic articles".format(args.corpus_size))
+            results['index'] = build_corpus_index(index_name, args.corpus_size, args.days, args.procs)
+            print(json.dumps(results['index']))
+        if "api" not in skip:
+            print("Load testing /newsapi")
+            results['api'] = benchmark_api(index_name, args.days, args.requests, args.concurrency, args.amount, args.result_cache)
+            print(json.dumps(results['api'], indent=2))
+        if "encode" not in skip:
+            print("Benchmarking hit encoding")
+            results['encode'] = benchmark_encoding(index_name, args.encode_hits)
+            print(json.dumps(results['encode'], indent=2))
+        if "serve" not in skip:
+            print("Benchmarking Serve.py startup and memory")
+            results['serve'] = benchmark_serving(index_name, args.workers)
+            print(json.dumps(results['serve'], indent=2))
+        if "download" not in skip:
+            print("Benchmarking article downloads")
+            host_latencies = [int(latency) for latency in args.host_latency.split(",")]
+            results['download'] = benchmark_downloads(args.articles, host_latencies, args.time_limit)
+            print(json.dumps(results['download'], indent=2))
+        if "extract" not in skip:
+            print("Benchmarking full and text-only extraction")
+            results['extract'] = benchmark_extraction(args.extract_articles)
+            print(json.dumps(results['extract'], indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    results['finished'] = datetime.now().isoformat()
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print("Saved benchmark results to {}".format(args.output))
+
+if __name__ == "__main__":
+    __main(sys.argv)
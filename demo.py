@@ -1,27 +1,32 @@
 import json
-from news import get_processed_articles
+from time import time
+from news import iter_processed_articles
+from news_api import NewsApiError
 
-topic = input("Enter a topic: ")
+if __name__ == "__main__":
+    topic = input("Enter a topic: ")
 
-article_response = get_processed_articles(topic, True)
-
-news_json = json.loads(article_response)
-
-if news_json['status'] == 200:
-    for article in news_json['articles']:
+    start_time = time()
+    news_json = {'status': 200, 'results': 0, 'time_taken': 0, 'articles': []}
+    try:
+        for article in iter_processed_articles(topic, True):
+            print("=======================================================================")
+            print("Article title: " + article['title'])
+            print("Article URL: " + article['url'])
+            print("Article source name: " + article['sourcename'])
+            print("Full article text: " + article['articletext'])
+            news_json['articles'].append(article)
+            news_json['results'] += 1
+        news_json['time_taken'] = round((time() - start_time), 2)
         print("=======================================================================")
-        print("Article title: " + article['title'])
-        print("Article URL: " + article['url'])
-        print("Article source name: " + article['sourcename'])
-        print("Full article text: " + article['articletext'])
-    print("=======================================================================")
-    print("Got {} articles in {} seconds".format(news_json['results'], news_json['time_taken']))
-else:
-    print("An error has occurred:")
-    print("Status code " + news_json['status'])
-    print("Error code " + news_json['code'])
-    print("Error description " + news_json['message'])
+        print("Got {} articles in {} seconds".format(news_json['results'], news_json['time_taken']))
+    except NewsApiError as e:
+        news_json = e.data
+        print("An error has occurred:")
+        print("Status code {}".format(news_json['status']))
+        print("Error code " + news_json['code'])
+        print("Error description " + news_json['message'])
 
-with open((topic + '.json'), 'w') as output_file:
-    json.dump(news_json, output_file, indent=2)
-    print("Saved article results to {}.json".format(topic))
+    with open((topic + '.json'), 'w') as output_file:
+        json.dump(news_json, output_file, indent=2)
+        print("Saved article results to {}.json".format(topic))
@@ -0,0 +1,130 @@
+import threading
+from time import monotonic
+from urllib.parse import urlsplit
+from http_client import REQUEST_TIMEOUT
+
+HOST_TIMEOUT_MIN = 2 # Shortest download timeout a website gets, in seconds
+HOST_TIMEOUT_MAX = REQUEST_TIMEOUT # Longest download timeout, also used for websites without measurements yet
+HOST_TIMEOUT_DEVIATIONS = 4 # Latency deviations added to the average latency of a website for its timeout
+HOST_LATENCY_WEIGHT = 0.2 # Weight of the newest latency in the moving averages
+BREAKER_FAILURES = 3 # Failed downloads in a row before a website is skipped
+BREAKER_COOLDOWN = 60 # Seconds a website is skipped before one download is let through to test it
+
+_shared_health = None
+_shared_health_lock = threading.Lock()
+
+class HostUnavailable(Exception):
+    """Raised instead of downloading from a website whose circuit breaker is open"""
+
+def host_of(url):
+    return urlsplit(url).netloc.lower()
+
+class _HostStats:
+    __slots__ = ('latency', 'deviation', 'failures', 'open_until', 'probing')
+
+    def __init__(self):
+        self.latency = None
+        self.deviation = 0.0
+        self.failures = 0
+        self.open_until = None
+        self.probing = False
+
+    def timeout(self):
+        if self.latency is None:
+            return HOST_TIMEOUT_MAX
+        return min(HOST_TIMEOUT_MAX, max(HOST_TIMEOUT_MIN, self.latency + HOST_TIMEOUT_DEVIATIONS * self.deviation))
+
+class HostHealth:
+    """Tracks the latency and failures of every website articles are downloaded from
+
+    Each website gets a download timeout of its exponentially weighted
+    average latency plus HOST_TIMEOUT_DEVIATIONS times the average
+    deviation, the same estimate TCP uses for retransmission timeouts,
+    kept between HOST_TIMEOUT_MIN and HOST_TIMEOUT_MAX.
+
+    After BREAKER_FAILURES failed downloads in a row the website's circuit
+    breaker opens and downloads from it are refused for BREAKER_COOLDOWN
+    seconds. After that a single download is let through, closing the
+    breaker if it succeeds and opening it again if it fails. A probe that
+    ends any other way, like a 404 or being cancelled, is released so the
+    next download can test the website instead."""
+
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def _stats(self, url):
+        host = host_of(url)
+        stats = self.hosts.get(host)
+        if stats is None:
+            stats = self.hosts[host] = _HostStats()
+        return stats
+
+    def timeout(self, url):
+        """Get the download timeout for the website of url, in seconds"""
+
+        with self.lock:
+            return self._stats(url).timeout()
+
+    def check(self, url):
+        """Raise HostUnavailable if downloads from the website of url are being refused
+
+        Returns:
+            True if the download is the one let through to test the website,
+            call release once it's done"""
+
+        with self.lock:
+            stats = self._stats(url)
+            if stats.open_until is None:
+                return False
+            if monotonic() < stats.open_until or stats.probing:
+                raise HostUnavailable("Skipping {}, too many failed downloads".format(host_of(url)))
+            stats.probing = True
+            return True
+
+    def success(self, url, seconds):
+        """Record a download from the website of url that took seconds"""
+
+        with self.lock:
+            stats = self._stats(url)
+            if stats.latency is None:
+                stats.latency = seconds
+                stats.deviation = seconds / 2
+            else:
+                stats.deviation += HOST_LATENCY_WEIGHT * (abs(seconds - stats.latency) - stats.deviation)
+                stats.latency += HOST_LATENCY_WEIGHT * (seconds - stats.latency)
+            stats.failures = 0
+            stats.open_until = None
+            stats.probing = False
+
+    def failure(self, url):
+        """Record a failed download from the website of url"""
+
+        with self.lock:
+            stats = self._stats(url)
+            stats.failures += 1
+            if stats.probing or stats.failures >= BREAKER_FAILURES:
+                stats.open_until = monotonic() + BREAKER_COOLDOWN
+            stats.probing = False
+
+    def release(self, url):
+        """End the test download of the website of url, letting the next download test it if neither success nor failure was recorded"""
+
+        with self.lock:
+            self._stats(url).probing = False
+
+    def stats(self):
+        """Get the latency, timeout and breaker state of every website"""
+
+        now = monotonic()
+        with self.lock:
+            return {host: {'latency': stats.latency, 'timeout': stats.timeout(), 'failures': stats.failures, 'open': stats.open_until is not None and now < stats.open_until} for host, stats in self.hosts.items()}
+
+def get_host_health():
+    """Get the host health shared by every download in this process"""
+
+    global _shared_health
+    with _shared_health_lock:
+        if _shared_health is None:
+            _shared_health = HostHealth()
+        return _shared_health
@@ -0,0 +1,60 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_HOSTS = 64 # Amount of websites to keep a connection pool open for
+POOL_CONNECTIONS_PER_HOST = 16 # Maximum amount of kept-alive connections to one website
+ASYNC_CONNECTIONS = 64 # Maximum amount of open connections of an async session
+ASYNC_CONNECTIONS_PER_HOST = 8 # Maximum amount of open connections of an async session to one website
+REQUEST_TIMEOUT = 7 # Seconds to wait for a website to answer, same as newspaper's default
+DNS_CACHE_TTL = 300 # Seconds an async session keeps resolved host names
+
+_session = None
+_session_lock = threading.Lock()
+
+def make_session(pool_hosts = None, pool_connections_per_host = None):
+    """Create a requests session that keeps connections alive and reuses them
+
+    Responses are requested gzip/deflate compressed and decompressed
+    transparently. Connections are pooled per website, so repeated
+    requests to the same host skip the TCP and TLS handshakes."""
+
+    if pool_hosts is None:
+        pool_hosts = POOL_HOSTS
+    if pool_connections_per_host is None:
+        pool_connections_per_host = POOL_CONNECTIONS_PER_HOST
+
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = "gzip, deflate"
+    session.headers['Connection'] = "keep-alive"
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_connections_per_host)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def get_session():
+    """Get the session shared by every API request and article download in this process"""
+
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+def make_async_session(connections = None, connections_per_host = None, timeout = None):
+    """Create an aiohttp session with a pooled keep-alive connector for asyncio code
+
+    The caller owns the session and has to close it, preferably with
+    "async with make_async_session() as session:"."""
+
+    import aiohttp
+
+    if connections is None:
+        connections = ASYNC_CONNECTIONS
+    if connections_per_host is None:
+        connections_per_host = ASYNC_CONNECTIONS_PER_HOST
+    if timeout is None:
+        timeout = REQUEST_TIMEOUT
+
+    connector = aiohttp.TCPConnector(limit=connections, limit_per_host=connections_per_host, ttl_dns_cache=DNS_CACHE_TTL)
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout), headers={'Accept-Encoding': "gzip, deflate"})
@@ -1,76 +1,102 @@
 import json
 import sys
 from time import time
-from newsapi import NewsApiClient
-from newspaper import Article
+from article_pipeline import iter_extracted
+from news_api import NewsApiError
+from timings import StageTimer, NULL_TIMER, Deadline, NO_DEADLINE
 import API_Keys
 
-newsApiInstance = NewsApiClient(api_key=API_Keys.NEWSAPI_KEY)
+newsApiInstance = None
 
-def get_processed_articles(topic, verbose = False):
+def _get_news_api_client():
+    """Create the NewsAPI client the first time a request goes out, so importing this module stays cheap"""
+
+    global newsApiInstance
+    if newsApiInstance is None:
+        from newsapi import NewsApiClient
+        newsApiInstance = NewsApiClient(api_key=API_Keys.NEWSAPI_KEY)
+    return newsApiInstance
+
+def _error_data(news_api_json):
+    if (news_api_json['code'] in ['apiKeyDisabled', 'apiKeyExhausted', 'apiKeyInvalid', 'apiKeyMissing', 'rateLimited']):
+        # Handle API key errors
+        return {'status': 401, 'code': news_api_json['code'], 'message': news_api_json['message']}
+    elif (news_api_json['code'] in ['parameterInvalid', 'parametersMissing', 'sourcesTooMany', 'sourceDoesNotExist']):
+        # Handle request errors
+        return {'status': 400, 'code': news_api_json['code'], 'message': news_api_json['message']}
+    else: # Handle anything else (likely not our fault)
+        return {'status': 500, 'code': news_api_json['code'], 'message': news_api_json['message']}
+
+def _iter_indexed_articles(topic, verbose, timer, deadline):
+    if USE_LOCAL_DATA:
+        if (VERBOSE or verbose):
+            print("Using cached NewsAPI request data")
+        news_api_json = TempJSONData
+    else:
+        if (VERBOSE or verbose):
+            print("Using 1 NewsAPI API request")
+        with timer.stage('newsapi_fetch'):
+            news_api_json = _get_news_api_client().get_everything(q=topic)
+
+    if news_api_json['status'] != 'ok':
+        raise NewsApiError(_error_data(news_api_json))
+
+    articles = news_api_json['articles']
+    for index, article_text in iter_extracted([article['url'] for article in articles], verbose=(VERBOSE or verbose), timer=timer, deadline=deadline):
+        article = articles[index]
+        yield index, {'title': article['title'], 'url': article['url'], 'sourcename': article['source']['name'], 'articletext': article_text}
+
+def iter_processed_articles(topic, verbose = False, timer = NULL_TIMER, deadline = NO_DEADLINE):
+    """Yield each article as soon as it has been downloaded and parsed
+
+    Arguments:
+        topic (string) - A keyword for searching articles
+        verbose (bool) - Whether to show verbose output
+        timer (StageTimer) - Records time spent in each stage
+        deadline (Deadline) - When to stop, deadline.expired is set if
+                articles were left out because of it
+
+    Returns:
+        A generator of article dicts with a title, URL, source name and the
+        article text, in the order they finish
+
+    Raises:
+        NewsApiError - If NewsAPI answered with an error"""
+
+    for _, article_object in _iter_indexed_articles(topic, verbose, timer, deadline):
+        yield article_object
+
+def get_processed_articles(topic, verbose = False, timings = False, time_limit = None):
     """Get a JSON object containing article data
 
-    
+    Collects iter_processed_articles, keeping the order NewsAPI returned
+    the articles in
 
     Arguments:
         topic (string) - A keyword for searching articles
                 Could in theory be multiple words (untested)
         verbose (bool) - Whether to show verbose output
+        timings (bool) - Whether to add a per-stage timing breakdown
+        time_limit (float) - Seconds to answer within, articles that aren't
+                extracted by then are left out. None = no limit
 
     Returns: 
         A string formatted JSON object with a status code, result quantity,
-        processing time (including article parsing), and a list of articles
+        processing time (including article parsing), whether articles were
+        left out because of the time limit, and a list of articles
         containing a title, URL, source name, and the article text"""
 
     start_time = time()
-    return_data = {'status': 200, 'results': 0, 'time_taken': 0, 'articles': []}
-
-    if USE_LOCAL_DATA:
-        if (VERBOSE or verbose):
-            print("Using cached NewsAPI request data")
-        news_api_json = TempJSONData
-    else:
-        if (VERBOSE or verbose):
-            print("Using 1 NewsAPI API request")
-        news_api_json = newsApiInstance.get_everything(q=topic)
-
-    if news_api_json['status'] == 'ok':
-        for article in news_api_json['articles']:
-            parsed_article = Article(article['url'])
-            try:
-                parsed_article.download()
-            except Exception as e:
-                if (VERBOSE or verbose):
-                    print("Failed to download article {} with exception {}, skipping".format(article['url'], e))
-                continue
-            try:
-                parsed_article.parse()
-            except Exception as e:
-                if (VERBOSE or verbose):
-                    print("Failed to parse article {} with exception {}, skipping".format(article['url'], e))
-                continue
-
-            title = article['title']
-            url = article['url']
-            sourcename = article['source']['name']
-
-            if (VERBOSE or verbose):
-                print("Parsed article " + url)
-
-            article_object = {'title': title, 'url': url, 'sourcename': sourcename, 'articletext': parsed_article.text}
-            return_data['articles'].append(article_object)
-            return_data['results'] = return_data['results'] + 1
-        return_data['time_taken'] = round((time() - start_time), 2)
-
-    elif (news_api_json['code'] in ['apiKeyDisabled', 'apiKeyExhausted', 'apiKeyInvalid', 'apiKeyMissing', 'rateLimited']):
-        # Handle API key errors
-        return_data = {'status': 401, 'code': news_api_json['code'], 'message': news_api_json['message']}
-    elif (news_api_json['code'] in ['parameterInvalid', 'parametersMissing', 'sourcesTooMany', 'sourceDoesNotExist']):
-        # Handle request errors
-        return_data = {'status': 400, 'code': news_api_json['code'], 'message': news_api_json['message']}
-    else: # Handle anything else (likely not our fault)
-        return_data = {'status': 500, 'code': news_api_json['code'], 'message': news_api_json['message']}
-
+    timer = StageTimer(enabled=timings)
+    deadline = Deadline(time_limit)
+    try:
+        indexed_articles = sorted(_iter_indexed_articles(topic, verbose, timer, deadline), key=lambda item: item[0])
+    except NewsApiError as e:
+        return json.dumps(e.data)
+
+    return_data = {'status': 200, 'results': len(indexed_articles), 'time_taken': round((time() - start_time), 2), 'partial': deadline.expired, 'articles': [article_object for _, article_object in indexed_articles]}
+    if timings:
+        return_data['timings'] = timer.as_dict()
     return json.dumps(return_data)
 
 def __main(argv):
@@ -78,22 +104,24 @@ def __main(argv):
         print("Usage: news.py [topic] [Use cached NewsAPI request (default true)] [Verbose (default false)]")
         exit()
 
-    news_json = json.loads(get_processed_articles(argv[1]))
-
-    if news_json['status'] == 200:
-        for article in news_json['articles']:
+    start_time = time()
+    results = 0
+    try:
+        for article in iter_processed_articles(argv[1]):
             print("=======================================================================")
             print("Article title: " + article['title'])
             print("Article URL: " + article['url'])
             print("Article source name: " + article['sourcename'])
             print("Full article text: " + article['articletext'])
-        print("=======================================================================")
-        print("Got {} articles in {} seconds".format(news_json['results'], news_json['time_taken']))
-    else:
+            results += 1
+    except NewsApiError as e:
         print("An error has occurred:")
-        print("Status code " + news_json['status'])
-        print("Error code " + news_json['code'])
-        print("Error description " + news_json['message'])
+        print("Status code {}".format(e.data['status']))
+        print("Error code " + e.data['code'])
+        print("Error description " + e.data['message'])
+        return
+    print("=======================================================================")
+    print("Got {} articles in {} seconds".format(results, round((time() - start_time), 2)))
 
 if __name__ == "__main__":
     if len(sys.argv) >= 3:
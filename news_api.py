@@ -1,132 +1,407 @@
+import asyncio
 import json
 import sys
-import requests
 from time import time
-from newspaper import Article
+from requests.exceptions import Timeout
+from article_cache import normalize_url
+from article_pipeline import iter_extracted, iter_extracted_async
+from http_client import get_session, make_async_session, REQUEST_TIMEOUT
+from timings import StageTimer, NULL_TIMER, Deadline, NO_DEADLINE
 
 NEWS_API_URL = "https://api.andreigerashchenko.com/newsapi"
 VERBOSE = False
 
-def get_processed_articles(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True, verbose = False):
+def build_api_params(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True):
+    """Get the query parameters of a /newsapi request, leaving out the ones that aren't set
+
+    The parameters are URL encoded by the HTTP client, so topics and
+    sources may contain spaces, quotes, ampersands and so on"""
+
+    params = {}
+    if topic is not None:
+        params['topic'] = topic
+    if source is not None:
+        params['source'] = source
+    if start_date is not None and end_date is not None:
+        params['start_date'] = start_date
+        params['end_date'] = end_date
+    if amount is not None:
+        params['amount'] = amount
+    if combine is not None:
+        params['combine'] = combine
+    return params
+
+class NewsApiError(Exception):
+    """Raised by the article iterators when the API answers with an error
+
+    data holds the error in the same format get_processed_articles returns it"""
+
+    def __init__(self, data):
+        super().__init__("{status} {code}: {message}".format(**data))
+        self.data = data
+
+def _error_data(news_api_json):
+    if (news_api_json['code'] in ['apiKeyDisabled', 'apiKeyExhausted', 'apiKeyInvalid', 'apiKeyMissing', 'rateLimited']):
+        # Handle API key errors
+        return {'status': 401, 'code': news_api_json['code'], 'message': news_api_json['message']}
+    elif (news_api_json['code'] in ['badArguments', 'parameterInvalid', 'parametersMissing', 'sourcesTooMany', 'sourceDoesNotExist']):
+        # Handle request errors
+        return {'status': 400, 'code': news_api_json['code'], 'message': news_api_json['message']}
+    else: # Handle anything else (likely not our fault)
+        return {'status': 500, 'code': news_api_json['code'], 'message': news_api_json['message']}
+
+def _article_object(article, article_text):
+    return {'title': article['title'], 'url': article['URL'], 'sourcename': article['source'], 'articletext': article_text}
+
+def _api_timeout(deadline):
+    """Get the timeout for an API request, None if the deadline already passed, which marks it expired"""
+
+    timeout = deadline.limit(REQUEST_TIMEOUT)
+    if timeout <= 0:
+        deadline.expired = True
+        return None
+    return timeout
+
+def _fetch_api_json(params, verbose, timer, deadline):
+    """Get the articles the API found, an empty list if the deadline passed first"""
+
+    timeout = _api_timeout(deadline)
+    if timeout is None:
+        return []
+    with timer.stage('newsapi_fetch'):
+        try:
+            response = get_session().get(NEWS_API_URL, params=params, timeout=timeout)
+        except Timeout:
+            if timeout == REQUEST_TIMEOUT:
+                raise
+            deadline.expired = True
+            return []
+        news_api_json = response.json()
+    if verbose:
+        print("API request URL: {}".format(response.url))
+        print("Response status: {}".format(news_api_json['status']))
+    if news_api_json['status'] != 200:
+        raise NewsApiError(_error_data(news_api_json))
+    return news_api_json['articles']
+
+async def _fetch_api_json_async(session, params, verbose, timer, deadline):
+    async def fetch():
+        async with session.get(NEWS_API_URL, params={name: str(value) for name, value in params.items()}) as response:
+            return response.url, await response.json(content_type=None)
+
+    if _api_timeout(deadline) is None:
+        return []
+    with timer.stage('newsapi_fetch'):
+        try:
+            request_url, news_api_json = await asyncio.wait_for(fetch(), deadline.remaining())
+        except asyncio.TimeoutError:
+            deadline.expired = True
+            return []
+    if verbose:
+        print("API request URL: {}".format(request_url))
+        print("Response status: {}".format(news_api_json['status']))
+    if news_api_json['status'] != 200:
+        raise NewsApiError(_error_data(news_api_json))
+    return news_api_json['articles']
+
+def _split_enriched(articles):
+    """Get the positions of articles the server sent the text of, and of the ones that still have to be downloaded"""
+
+    enriched = [index for index, article in enumerate(articles) if article.get('articletext')]
+    missing = [index for index, article in enumerate(articles) if not article.get('articletext')]
+    return enriched, missing
+
+def _cluster_key(article):
+    """Get the near-duplicate cluster of an article, its normalized URL if the server didn't cluster it"""
+
+    return article.get('cluster') or normalize_url(article['URL'])
+
+def _plan_downloads(articles, missing):
+    """Group the articles that still have to be downloaded by near-duplicate cluster
+
+    Returns:
+        A tuple with a list of (position, text) tuples for articles in a
+        cluster the server already sent the text of, and a dict of the
+        remaining cluster keys to the positions of their articles"""
+
+    known_texts = {}
+    for article in articles:
+        if article.get('articletext'):
+            known_texts.setdefault(_cluster_key(article), article['articletext'])
+    reused = []
+    clusters = {}
+    for index in missing:
+        key = _cluster_key(articles[index])
+        if key in known_texts:
+            reused.append((index, known_texts[key]))
+        else:
+            clusters.setdefault(key, []).append(index)
+    return reused, clusters
+
+def _iter_missing_texts(articles, missing, verbose, timer, deadline):
+    """Yield (position, text) tuples for the articles the server didn't send the text of
+
+    Only the first article of each near-duplicate cluster is downloaded and
+    its text is used for the whole cluster, the other articles of a cluster
+    are only downloaded if that one fails"""
+
+    reused, clusters = _plan_downloads(articles, missing)
+    for item in reused:
+        yield item
+    keys = list(clusters)
+    extracted = set()
+    for position, article_text in iter_extracted([articles[clusters[key][0]]['URL'] for key in keys], verbose=(VERBOSE or verbose), timer=timer, deadline=deadline):
+        extracted.add(keys[position])
+        for index in clusters[keys[position]]:
+            yield index, article_text
+    retry = [index for key in keys if key not in extracted for index in clusters[key][1:]]
+    for position, article_text in iter_extracted([articles[index]['URL'] for index in retry], verbose=(VERBOSE or verbose), timer=timer, deadline=deadline):
+        yield retry[position], article_text
+
+async def _aiter_missing_texts(articles, missing, verbose, timer, deadline, session):
+    """asyncio counterpart of _iter_missing_texts"""
+
+    reused, clusters = _plan_downloads(articles, missing)
+    for item in reused:
+        yield item
+    keys = list(clusters)
+    extracted = set()
+    async for position, article_text in iter_extracted_async([articles[clusters[key][0]]['URL'] for key in keys], session, verbose=(VERBOSE or verbose), timer=timer, deadline=deadline):
+        extracted.add(keys[position])
+        for index in clusters[keys[position]]:
+            yield index, article_text
+    retry = [index for key in keys if key not in extracted for index in clusters[key][1:]]
+    async for position, article_text in iter_extracted_async([articles[index]['URL'] for index in retry], session, verbose=(VERBOSE or verbose), timer=timer, deadline=deadline):
+        yield retry[position], article_text
+
+def _iter_indexed_articles(params, verbose, timer, deadline):
+    articles = _fetch_api_json(dict(params, articletext=True), verbose, timer, deadline)
+    enriched, missing = _split_enriched(articles)
+    for index in enriched:
+        yield index, _article_object(articles[index], articles[index]['articletext'])
+    for index, article_text in _iter_missing_texts(articles, missing, verbose, timer, deadline):
+        yield index, _article_object(articles[index], article_text)
+
+async def _aiter_indexed_articles(params, verbose, timer, deadline, session):
+    if session is None:
+        async with make_async_session() as session:
+            async for item in _aiter_indexed_articles(params, verbose, timer, deadline, session):
+                yield item
+        return
+
+    articles = await _fetch_api_json_async(session, dict(params, articletext=True), verbose, timer, deadline)
+    enriched, missing = _split_enriched(articles)
+    for index in enriched:
+        yield index, _article_object(articles[index], articles[index]['articletext'])
+    async for index, article_text in _aiter_missing_texts(articles, missing, verbose, timer, deadline, session):
+        yield index, _article_object(articles[index], article_text)
+
+def iter_processed_articles(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True, verbose = False, timer = NULL_TIMER, deadline = NO_DEADLINE):
+    """Yield each article as soon as it has been downloaded and parsed
+
+    Articles the server already has the text of are yielded straight
+    away, only the rest are downloaded. Articles the server put in the
+    same near-duplicate cluster share the text of the first one that
+    could be extracted. The API request and the article
+    downloads share one pooled keep-alive session, see
+    http_client.get_session
+
+    Arguments:
+        Same as get_processed_articles
+        timer (StageTimer) - Records time spent in each stage
+        deadline (Deadline) - When to stop, deadline.expired is set if
+                articles were left out because of it
+
+    Returns:
+        A generator of article dicts with a title, URL, source name and the
+        article text, in the order they finish. Articles that failed to
+        download or parse, or weren't done by the deadline, are skipped
+
+    Raises:
+        NewsApiError - If the API answered with an error"""
+
+    params = build_api_params(topic, source, start_date, end_date, amount, combine)
+    for _, article_object in _iter_indexed_articles(params, verbose, timer, deadline):
+        yield article_object
+
+async def aiter_processed_articles(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True, verbose = False, timer = NULL_TIMER, deadline = NO_DEADLINE, session = None):
+    """asyncio counterpart of iter_processed_articles
+
+    Arguments:
+        session (aiohttp.ClientSession) - Session to use for the API request and
+                article downloads, a new one is opened and closed if not given
+        Everything else is the same as iter_processed_articles
+
+    Returns:
+        An async generator of article dicts in the order they finish"""
+
+    params = build_api_params(topic, source, start_date, end_date, amount, combine)
+    async for _, article_object in _aiter_indexed_articles(params, verbose, timer, deadline, session):
+        yield article_object
+
+def _build_return_data(indexed_articles, start_time, timer, timings, deadline):
+    articles = [article_object for _, article_object in sorted(indexed_articles, key=lambda item: item[0])]
+    return_data = {'status': 200, 'results': len(articles), 'time_taken': round((time() - start_time), 2), 'partial': deadline.expired, 'articles': articles}
+    if timings:
+        return_data['timings'] = timer.as_dict()
+    return return_data
+
+def get_processed_articles(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True, verbose = False, timings = False, time_limit = None):
     """Get a JSON file containing article data
 
-    
+    Collects iter_processed_articles, keeping the order the API returned
+    the articles in
 
     Arguments:
         topic (string) - A keyword for searching articles
                 Could in theory be multiple words (untested)
         verbose (bool) - Whether to show verbose output
+        timings (bool) - Whether to add a per-stage timing breakdown
+        time_limit (float) - Seconds to answer within, articles that aren't
+                extracted by then are left out. None = no limit
 
     Returns: 
         A JSON file with a status code, result quantity,
-        processing time (including article parsing), and a list of articles
+        processing time (including article parsing), whether articles were
+        left out because of the time limit, and a list of articles
         containing a title, URL, source name, and the article text"""
 
     start_time = time()
+    timer = StageTimer(enabled=timings)
+    deadline = Deadline(time_limit)
     if verbose:
         print("Running in verbose mode")
-    added_first_argument = False
-    api_request = NEWS_API_URL
-    return_data = {'status': 200, 'results': 0, 'time_taken': 0, 'articles': []}
+    params = build_api_params(topic, source, start_date, end_date, amount, combine)
+    try:
+        indexed_articles = list(_iter_indexed_articles(params, verbose, timer, deadline))
+    except NewsApiError as e:
+        return e.data
+    return _build_return_data(indexed_articles, start_time, timer, timings, deadline)
 
-    if topic is not None:
-        if not added_first_argument:
-            api_request += "?topic={}".format(topic)
-            added_first_argument = True
-        else:
-            api_request += "&topic={}".format(topic)
-    if source is not None:
-        if not added_first_argument:
-            api_request += "?source={}".format(source)
-            added_first_argument = True
-        else:
-            api_request += "&source={}".format(source)
-    if start_date is not None and end_date is not None:
-        if not added_first_argument:
-            api_request += "?start_date={0}&end_date={1}".format(start_date, end_date)
-            added_first_argument = True
-        else:
-            api_request += "&start_date={0}&end_date={1}".format(start_date, end_date)
-    if amount is not None:
-        if not added_first_argument:
-            api_request += "?amount={}".format(amount)
-            added_first_argument = True
-        else:
-            api_request += "&amount={}".format(amount)
-    if combine is not None:
-        if not added_first_argument:
-            api_request += "?combine={}".format(combine)
-            added_first_argument = True
-        else:
-            api_request += "&combine={}".format(combine)
-    
-    if verbose:
-        print("API request URL: {}".format(api_request))
-    news_api_json = requests.get(api_request).json()
+async def get_processed_articles_async(topic = None, source = None, start_date = None, end_date = None, amount = 50, combine = True, verbose = False, timings = False, time_limit = None, session = None):
+    """asyncio counterpart of get_processed_articles
+
+    Arguments:
+        session (aiohttp.ClientSession) - Session to use for the API request and
+                article downloads, a new one is opened and closed if not given
+        Everything else is the same as get_processed_articles
+
+    Returns:
+        The same as get_processed_articles"""
+
+    start_time = time()
+    timer = StageTimer(enabled=timings)
+    deadline = Deadline(time_limit)
+    params = build_api_params(topic, source, start_date, end_date, amount, combine)
+    try:
+        indexed_articles = [item async for item in _aiter_indexed_articles(params, verbose, timer, deadline, session)]
+    except NewsApiError as e:
+        return e.data
+    return _build_return_data(indexed_articles, start_time, timer, timings, deadline)
+
+async def get_many_processed_articles_async(searches, verbose = False, timings = False, time_limit = None):
+    """Run several article searches at once over one async session
+
+    Arguments:
+        searches (list) - Keyword argument dicts for get_processed_articles_async,
+                e.g. [{'topic': "vaccine"}, {'topic': "election", 'amount': 20}]
+
+    Returns:
+        A list with the result of each search, in the same order"""
+
+    async with make_async_session() as session:
+        return await asyncio.gather(*[get_processed_articles_async(verbose=verbose, timings=timings, time_limit=time_limit, session=session, **search) for search in searches])
+
+def get_batch_processed_articles(searches, verbose = False, timings = False, time_limit = None):
+    """Get the articles of several searches with one /newsapi/batch request
+
+    Articles found by more than one search are downloaded and parsed only
+    once, and only if the server doesn't already have their text. Like
+    iter_processed_articles, near-duplicates share one download.
+
+    Arguments:
+        searches (list) - Keyword argument dicts for build_api_params,
+                e.g. [{'topic': "vaccine"}, {'topic': "election", 'amount': 20}]
+        verbose (bool) - Whether to show verbose output
+        timings (bool) - Whether to add a per-stage timing breakdown to each result
+        time_limit (float) - Seconds to answer every search within, see get_processed_articles
+
+    Returns:
+        A list with a result for each search in the same order, in the
+        format get_processed_articles returns"""
 
+    start_time = time()
+    timer = StageTimer(enabled=timings)
+    deadline = Deadline(time_limit)
+    queries = [dict(build_api_params(**search), articletext=True) for search in searches]
+
+    timeout = _api_timeout(deadline)
+    if timeout is None:
+        return [_build_return_data([], start_time, timer, timings, deadline) for _ in searches]
+    with timer.stage('newsapi_fetch'):
+        try:
+            batch_json = get_session().post(NEWS_API_URL + "/batch", json={'queries': queries}, timeout=timeout).json()
+        except Timeout:
+            if timeout == REQUEST_TIMEOUT:
+                raise
+            deadline.expired = True
+            return [_build_return_data([], start_time, timer, timings, deadline) for _ in searches]
     if verbose:
-        print("Response status: {}".format(news_api_json['status']))
+        print("Response status: {}".format(batch_json['status']))
+    if batch_json['status'] != 200:
+        return [_error_data(batch_json) for _ in searches]
 
-    if news_api_json['status'] == 200:
-        for article in news_api_json['articles']:
-            parsed_article = Article(article['URL'])
-            try:
-                parsed_article.download()
-            except Exception as e:
-                if (VERBOSE or verbose):
-                    print("Failed to download article {} with exception {}, skipping".format(article['URL'], e))
-                continue
-            try:
-                parsed_article.parse()
-            except Exception as e:
-                if (VERBOSE or verbose):
-                    print("Failed to parse article {} with exception {}, skipping".format(article['URL'], e))
-                continue
-
-            title = article['title']
-            url = article['URL']
-            sourcename = article['source']
-
-            if (VERBOSE or verbose):
-                print("Parsed article " + url)
-
-            article_object = {'title': title, 'url': url, 'sourcename': sourcename, 'articletext': parsed_article.text}
-            return_data['articles'].append(article_object)
-            return_data['results'] = return_data['results'] + 1
-        return_data['time_taken'] = round((time() - start_time), 2)
-
-    elif (news_api_json['code'] in ['apiKeyDisabled', 'apiKeyExhausted', 'apiKeyInvalid', 'apiKeyMissing', 'rateLimited']):
-        # Handle API key errors
-        return_data = {'status': 401, 'code': news_api_json['code'], 'message': news_api_json['message']}
-    elif (news_api_json['code'] in ['badArguments', 'parameterInvalid', 'parametersMissing', 'sourcesTooMany', 'sourceDoesNotExist']):
-        # Handle request errors
-        return_data = {'status': 400, 'code': news_api_json['code'], 'message': news_api_json['message']}
-    else: # Handle anything else (likely not our fault)
-        return_data = {'status': 500, 'code': news_api_json['code'], 'message': news_api_json['message']}
+    unique_articles = {}
+    for response in batch_json['responses']:
+        for article in response.get('articles', []):
+            url_key = normalize_url(article['URL'])
+            if url_key not in unique_articles or article.get('articletext'):
+                unique_articles[url_key] = article
+    url_keys = list(unique_articles)
+    articles = [unique_articles[url_key] for url_key in url_keys]
+    _, missing = _split_enriched(articles)
+    if verbose:
+        print("{} unique articles without text".format(len(missing)))
+    article_texts = {}
+    for index, article_text in _iter_missing_texts(articles, missing, verbose, timer, deadline):
+        article_texts[url_keys[index]] = article_text
 
-    return return_data
+    results = []
+    for response in batch_json['responses']:
+        if response['status'] != 200:
+            results.append(_error_data(response))
+            continue
+        indexed_articles = []
+        for index, article in enumerate(response['articles']):
+            article_text = article.get('articletext') or article_texts.get(normalize_url(article['URL']))
+            if article_text is not None:
+                indexed_articles.append((index, _article_object(article, article_text)))
+        results.append(_build_return_data(indexed_articles, start_time, timer, timings, deadline))
+    return results
 
 def __main(argv):
     if len(argv) == 1:
-        print("Usage: news.py [topic] [Verbose (default false)]")
+        print("Usage: news_api.py [topic] [Verbose (default false)]")
         exit()
 
-    news_json = get_processed_articles(topic=argv[1], verbose=VERBOSE)
-
-    if news_json['status'] == 200:
-        for article in news_json['articles']:
+    start_time = time()
+    results = 0
+    try:
+        for article in iter_processed_articles(topic=argv[1], verbose=VERBOSE):
             print("=======================================================================")
             print("Article title: " + article['title'])
-            print("Article URL: " + article['URL'])
+            print("Article URL: " + article['url'])
             print("Article source name: " + article['sourcename'])
             print("Full article text: " + article['articletext'])
-        print("=======================================================================")
-        print("Got {} articles in {} seconds".format(news_json['results'], news_json['time_taken']))
-    else:
+            results += 1
+    except NewsApiError as e:
         print("An error has occurred:")
-        print("Status code " + news_json['status'])
-        print("Error code " + news_json['code'])
-        print("Error description " + news_json['message'])
+        print("Status code {}".format(e.data['status']))
+        print("Error code " + e.data['code'])
+        print("Error description " + e.data['message'])
+        return
+    print("=======================================================================")
+    print("Got {} articles in {} seconds".format(results, round((time() - start_time), 2)))
 
 if __name__ == "__main__":
     if len(sys.argv) >= 3:
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Neither directory is installed, the client modules are imported from the
+# repository root and the scraper and API modules from GoogleNewsApi
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "GoogleNewsApi"))
@@ -0,0 +1,131 @@
+import unittest
+from unittest import mock
+import host_health
+from host_health import HostHealth, HostUnavailable, BREAKER_FAILURES, BREAKER_COOLDOWN, HOST_TIMEOUT_MAX, HOST_TIMEOUT_MIN
+from article_pipeline import _start_download, _download_failed
+from timings import Deadline
+
+URL = "https://example.com/article"
+OTHER_URL = "https://example.org/article"
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.status = status
+
+class BreakerTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(host_health, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.health = HostHealth()
+
+    def open_breaker(self):
+        for _ in range(BREAKER_FAILURES):
+            self.health.check(URL)
+            self.health.failure(URL)
+
+    def test_closed_breaker_lets_downloads_through(self):
+        self.assertFalse(self.health.check(URL))
+        self.assertFalse(self.health.check(URL))
+
+    def test_opens_after_failures_in_a_row(self):
+        for _ in range(BREAKER_FAILURES - 1):
+            self.health.failure(URL)
+        self.assertFalse(self.health.check(URL))
+        self.health.failure(URL)
+        self.assertRaises(HostUnavailable, self.health.check, URL)
+        self.assertTrue(self.health.stats()['example.com']['open'])
+
+    def test_success_resets_failures(self):
+        for _ in range(BREAKER_FAILURES - 1):
+            self.health.failure(URL)
+        self.health.success(URL, 1.0)
+        self.health.failure(URL)
+        self.assertFalse(self.health.check(URL))
+
+    def test_breaker_is_per_website(self):
+        self.open_breaker()
+        self.assertFalse(self.health.check(OTHER_URL))
+
+    def test_single_probe_after_cooldown(self):
+        self.open_breaker()
+        self.now += BREAKER_COOLDOWN
+        self.assertTrue(self.health.check(URL))
+        self.assertRaises(HostUnavailable, self.health.check, URL)
+
+    def test_successful_probe_closes_breaker(self):
+        self.open_breaker()
+        self.now += BREAKER_COOLDOWN
+        self.health.check(URL)
+        self.health.success(URL, 1.0)
+        self.health.release(URL)
+        self.assertFalse(self.health.check(URL))
+        self.assertFalse(self.health.stats()['example.com']['open'])
+
+    def test_failed_probe_reopens_breaker(self):
+        self.open_breaker()
+        self.now += BREAKER_COOLDOWN
+        self.health.check(URL)
+        self.health.failure(URL)
+        self.health.release(URL)
+        self.assertRaises(HostUnavailable, self.health.check, URL)
+        self.now += BREAKER_COOLDOWN
+        self.assertTrue(self.health.check(URL))
+
+    def test_released_probe_lets_next_download_probe(self):
+        self.open_breaker()
+        self.now += BREAKER_COOLDOWN
+        self.health.check(URL)
+        self.health.release(URL)
+        self.assertTrue(self.health.check(URL))
+
+    def test_timeout_follows_latency(self):
+        self.assertEqual(self.health.timeout(URL), HOST_TIMEOUT_MAX)
+        for _ in range(20):
+            self.health.success(URL, 0.01)
+        self.assertEqual(self.health.timeout(URL), HOST_TIMEOUT_MIN)
+
+class StartDownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(host_health, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.health = HostHealth()
+        for _ in range(BREAKER_FAILURES):
+            self.health.failure(URL)
+        self.now += BREAKER_COOLDOWN
+
+    def test_probe_refused_by_deadline_is_released(self):
+        deadline = Deadline(0)
+        self.assertRaises(TimeoutError, _start_download, self.health, deadline, URL)
+        self.assertTrue(deadline.expired)
+        self.assertTrue(self.health.check(URL))
+
+    def test_client_error_is_not_counted(self):
+        timeout, full_timeout, probe = _start_download(self.health, Deadline(), URL)
+        self.assertTrue(full_timeout)
+        self.assertTrue(probe)
+        _download_failed(self.health, Deadline(), URL, HTTPError(404), full_timeout)
+        self.health.release(URL)
+        self.assertTrue(self.health.check(URL))
+
+    def test_server_error_reopens_breaker(self):
+        timeout, full_timeout, probe = _start_download(self.health, Deadline(), URL)
+        _download_failed(self.health, Deadline(), URL, HTTPError(503), full_timeout)
+        self.health.release(URL)
+        self.assertRaises(HostUnavailable, self.health.check, URL)
+
+    def test_download_cut_short_marks_deadline_expired(self):
+        deadline = Deadline(1)
+        timeout, full_timeout, probe = _start_download(self.health, deadline, URL)
+        self.assertFalse(full_timeout)
+        _download_failed(self.health, deadline, URL, TimeoutError(), full_timeout)
+        self.health.release(URL)
+        self.assertTrue(deadline.expired)
+        self.assertTrue(self.health.check(URL))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from whoosh import index
+import Enrich
+import Scrape
+from BodyStore import BodyStore
+from Dedupe import SeenURLs, url_id
+from NearDup import NearDuplicateIndex, article_text
+from Shards import ShardRouter
+
+SHARD = "2021-03"
+
+STORY = ("Central bank raises interest rates by half a point",
+         "The central bank raised its benchmark interest rate by half a percentage point on Tuesday, the largest increase in two decades, as it tries to bring down inflation.")
+WIRE_COPY = ("Central bank raises interest rates by half a point",
+             "The central bank raised its benchmark interest rate by half a percentage point on Tuesday, the largest increase in two decades, as it tries to bring inflation down.")
+OTHER_STORY = ("Local team wins championship after extra time",
+               "Fans celebrated late into the night after the home side scored twice in extra time to win its first title in forty years.")
+THIRD_STORY = ("Storm closes schools across the region",
+               "Heavy snow and strong winds forced hundreds of schools to close on Monday while road crews worked to clear the highways.")
+
+def article(story, link):
+    return {'title': story[0], 'desc': story[1], 'media': "Example News", 'datetime': "03/15/2021", 'link': link}
+
+class ClusteringTest(unittest.TestCase):
+    def test_near_duplicates_share_a_cluster(self):
+        near_duplicates = NearDuplicateIndex()
+        self.assertEqual(near_duplicates.add("a", article_text(*STORY)), "a")
+        self.assertEqual(near_duplicates.add("b", article_text(*WIRE_COPY)), "a")
+        self.assertEqual(near_duplicates.add("c", article_text(*OTHER_STORY)), "c")
+        self.assertEqual(len(near_duplicates), 2)
+
+    def test_only_representatives_are_compared(self):
+        near_duplicates = NearDuplicateIndex()
+        near_duplicates.add("a", article_text(*STORY))
+        self.assertEqual(near_duplicates.add("b", article_text(*WIRE_COPY)), "a")
+        self.assertEqual(list(near_duplicates.signatures), ["a"])
+
+    def test_threshold(self):
+        near_duplicates = NearDuplicateIndex(threshold=1.01)
+        near_duplicates.add("a", article_text(*STORY))
+        self.assertEqual(near_duplicates.add("b", article_text(*WIRE_COPY)), "b")
+
+class SeedingTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.shards = ShardRouter(self.root, Scrape.article_schema())
+        self.near_duplicates = NearDuplicateIndex()
+        self.seen_urls = SeenURLs()
+
+    def record(self, *articles):
+        Scrape.record_articles(self.shards, {'articles': list(articles)}, self.seen_urls, self.near_duplicates)
+
+    def test_recorded_articles_are_tagged_with_cluster(self):
+        self.record(article(STORY, "https://a.example/story"), article(WIRE_COPY, "https://b.example/story"))
+        with self.shards.get(SHARD).searcher() as searcher:
+            clusters = {document['ID']: document['cluster'] for document in searcher.all_stored_fields()}
+            signatures = searcher.reader().column_reader('signature')
+            has_signature = {searcher.stored_fields(docnum)['ID']: bool(signatures[docnum]) for docnum in searcher.document_numbers()}
+        representative = url_id("https://a.example/story")
+        self.assertEqual(clusters, {representative: representative, url_id("https://b.example/story"): representative})
+        self.assertEqual(has_signature, {representative: True, url_id("https://b.example/story"): False})
+
+    def test_seeds_representatives_from_signature_column(self):
+        self.record(article(STORY, "https://a.example/story"), article(WIRE_COPY, "https://b.example/story"), article(OTHER_STORY, "https://c.example/other"))
+        seeded = NearDuplicateIndex(self.shards.open_all())
+        self.assertEqual(sorted(seeded.signatures), sorted([url_id("https://a.example/story"), url_id("https://c.example/other")]))
+        with mock.patch('NearDup.minhash', side_effect=AssertionError("seeding hashed a document")):
+            NearDuplicateIndex(self.shards.open_all())
+        self.assertEqual(seeded.add("wire", article_text(*WIRE_COPY)), url_id("https://a.example/story"))
+
+    def test_deleted_representatives_are_not_seeded(self):
+        self.record(article(STORY, "https://a.example/story"), article(OTHER_STORY, "https://c.example/other"))
+        writer = self.shards.get(SHARD).writer()
+        writer.delete_by_term('ID', url_id("https://c.example/other"))
+        writer.commit()
+        seeded = NearDuplicateIndex(self.shards.open_all())
+        self.assertEqual(list(seeded.signatures), [url_id("https://a.example/story")])
+
+    def test_documents_without_id_are_skipped(self):
+        legacy = index.create_in(self.root, Scrape.article_schema())
+        writer = legacy.writer()
+        writer.add_document(title=STORY[0], description=STORY[1], URL="https://a.example/story")
+        writer.commit()
+        self.assertEqual(len(NearDuplicateIndex([legacy])), 0)
+
+    def test_segments_without_signature_column_are_hashed(self):
+        schema = Scrape.article_schema()
+        schema.remove('cluster')
+        schema.remove('signature')
+        legacy = index.create_in(self.root, schema)
+        writer = legacy.writer()
+        writer.add_document(ID="old", title=STORY[0], description=STORY[1])
+        writer.commit()
+        seeded = NearDuplicateIndex([legacy])
+        self.assertEqual(list(seeded.signatures), ["old"])
+        self.assertEqual(seeded.add("wire", article_text(*WIRE_COPY)), "old")
+
+    def test_enriched_representatives_keep_signature_after_merge(self):
+        self.record(article(STORY, "https://a.example/story"), article(OTHER_STORY, "https://c.example/other"))
+        ix = self.shards.get(SHARD)
+        store = BodyStore(os.path.join(self.root, "bodies.sqlite3"))
+        self.addCleanup(store.close)
+        documents = Enrich.find_unenriched(ix, Enrich.ENRICH_BATCH, set())
+        with mock.patch.object(Enrich, 'extract_articles', lambda urls, **kwargs: ["Article text"] * len(urls)):
+            Enrich.enrich_batch(ix, documents, store)
+        self.record(article(THIRD_STORY, "https://d.example/storm"))
+        ix.optimize()
+
+        seeded = NearDuplicateIndex(self.shards.open_all())
+        self.assertEqual(len(seeded), 3)
+        self.assertEqual(seeded.add("wire", article_text(*WIRE_COPY)), url_id("https://a.example/story"))
+
+    def test_signatures_are_found_in_every_segment(self):
+        # The wire copy's segment has no signature column
+        self.record(article(STORY, "https://a.example/story"))
+        self.record(article(WIRE_COPY, "https://b.example/story"))
+        self.record(article(OTHER_STORY, "https://c.example/other"))
+        ix = self.shards.get(SHARD)
+        self.assertEqual(len(ix.reader().leaf_readers()), 3)
+        documents = Enrich.find_unenriched(ix, Enrich.ENRICH_BATCH, set())
+        signatures = {document['ID']: document.get('signature') is not None for document in documents}
+        self.assertEqual(signatures, {url_id("https://a.example/story"): True, url_id("https://b.example/story"): False, url_id("https://c.example/other"): True})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+from unittest import mock
+import requests
+import news_api
+
+class DeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.timeouts = []
+        session = mock.Mock(get=self.timed_out, post=self.timed_out)
+        patcher = mock.patch.object(news_api, 'get_session', lambda: session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def timed_out(self, *args, **kwargs):
+        self.timeouts.append(kwargs['timeout'])
+        raise requests.exceptions.ReadTimeout()
+
+    def test_passed_deadline_skips_request(self):
+        result = news_api.get_processed_articles(topic="vaccine", time_limit=0)
+        self.assertEqual(self.timeouts, [])
+        self.assertEqual((result['status'], result['partial'], result['articles']), (200, True, []))
+
+    def test_request_cut_short_by_deadline_is_partial(self):
+        result = news_api.get_processed_articles(topic="vaccine", time_limit=0.5)
+        self.assertLessEqual(self.timeouts[0], 0.5)
+        self.assertEqual((result['status'], result['partial'], result['articles']), (200, True, []))
+
+    def test_batch_with_passed_deadline_is_partial(self):
+        results = news_api.get_batch_processed_articles([{'topic': "vaccine"}, {'topic': "election"}], time_limit=0)
+        self.assertEqual(self.timeouts, [])
+        self.assertEqual([result['partial'] for result in results], [True, True])
+
+    def test_timeout_without_deadline_raises(self):
+        self.assertRaises(requests.exceptions.Timeout, news_api.get_processed_articles, topic="vaccine")
+
+if __name__ == "__main__":
+    unittest.main()
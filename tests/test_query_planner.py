@@ -0,0 +1,104 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from whoosh import index
+from whoosh.query import Or
+import Scrape
+from QueryPlanner import DEFAULT_AMOUNT, PAGE_SIZE, plan_query, normalize_args, encode_cursor, decode_cursor
+
+ARTICLES = [
+    ("1", "Vaccine trial results published", "CNN", datetime(2021, 3, 2)),
+    ("2", "Vaccine rollout speeds up", "BBC", datetime(2021, 3, 20)),
+    ("3", "Election results are in", "CNN", datetime(2021, 3, 25)),
+    ("4", "Vaccine makers expand production", "CNN", datetime(2021, 5, 1)),
+]
+
+class PlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.ix = index.create_in(cls.directory, Scrape.article_schema())
+        writer = cls.ix.writer()
+        for document_id, title, source, date in ARTICLES:
+            writer.add_document(ID=document_id, title=title, description=title, source=source, URL="https://example.com/" + document_id, date=date)
+        writer.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.ix.close()
+        shutil.rmtree(cls.directory)
+
+    def search(self, args):
+        plan = plan_query(args, self.ix.schema)
+        with self.ix.searcher() as searcher:
+            return sorted(hit['ID'] for hit in searcher.search(plan.query, filter=plan.filter, limit=plan.limit))
+
+    def test_no_search_arguments(self):
+        self.assertIsNone(plan_query({'amount': "5"}, self.ix.schema))
+
+    def test_defaults(self):
+        plan = plan_query({'topic': "vaccine"}, self.ix.schema)
+        self.assertEqual((plan.limit, plan.offset, plan.page_size, plan.with_text, plan.collapse), (DEFAULT_AMOUNT, 0, None, False, False))
+
+    def test_combine_intersects_arguments(self):
+        args = {'topic': "vaccine", 'source': "CNN", 'start_date': "03-01-2021", 'end_date': "03-31-2021", 'combine': "true"}
+        plan = plan_query(args, self.ix.schema)
+        self.assertIsNotNone(plan.filter)
+        self.assertEqual((plan.start_date, plan.end_date), (datetime(2021, 3, 1), datetime(2021, 3, 31)))
+        self.assertEqual(self.search(args), ["1"])
+
+    def test_combine_without_topic_matches_filters(self):
+        self.assertEqual(self.search({'source': "CNN", 'combine': "true"}), ["1", "3", "4"])
+
+    def test_any_argument_can_match_without_combine(self):
+        args = {'topic': "election", 'source': "BBC", 'start_date': "05-01-2021", 'end_date': "05-31-2021"}
+        plan = plan_query(args, self.ix.schema)
+        self.assertIsInstance(plan.query, Or)
+        self.assertIsNone(plan.filter)
+        # Hits outside the date range can match, so no shards may be skipped
+        self.assertEqual((plan.start_date, plan.end_date), (None, None))
+        self.assertEqual(self.search(args), ["2", "3", "4"])
+
+    def test_topic_ranks_above_unscored_arguments(self):
+        plan = plan_query({'topic': "election", 'source': "CNN"}, self.ix.schema)
+        with self.ix.searcher() as searcher:
+            self.assertEqual(searcher.search(plan.query, limit=1)[0]['ID'], "3")
+
+    def test_malformed_arguments(self):
+        self.assertRaises(ValueError, plan_query, {'topic': "vaccine", 'amount': "many"}, self.ix.schema)
+        self.assertRaises(ValueError, plan_query, {'topic': "vaccine", 'start_date': "2021-03-01", 'end_date': "2021-03-31"}, self.ix.schema)
+        self.assertRaises(ValueError, plan_query, {'topic': "vaccine", 'page_size': "0"}, self.ix.schema)
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        args = {'topic': "vaccine", 'amount': "100", 'page_size': "10"}
+        cursor = encode_cursor(args, 30)
+        self.assertEqual(decode_cursor(args, cursor), 30)
+        plan = plan_query(dict(args, cursor=cursor), None)
+        self.assertEqual((plan.offset, plan.page_size, plan.limit), (30, 10, 100))
+
+    def test_cursor_only_paginates_with_default_page_size(self):
+        args = {'topic': "vaccine"}
+        plan = plan_query(dict(args, cursor=encode_cursor(args, 50)), None)
+        self.assertEqual((plan.offset, plan.page_size), (50, PAGE_SIZE))
+
+    def test_cursor_ignores_argument_order_and_unrelated_arguments(self):
+        cursor = encode_cursor({'topic': "vaccine", 'source': "CNN"}, 10)
+        self.assertEqual(decode_cursor({'source': " CNN", 'topic': "vaccine", 'articletext': "true"}, cursor), 10)
+
+    def test_cursor_of_another_query(self):
+        cursor = encode_cursor({'topic': "vaccine"}, 10)
+        self.assertRaises(ValueError, decode_cursor, {'topic': "election"}, cursor)
+        self.assertRaises(ValueError, decode_cursor, {'topic': "vaccine", 'combine': "true"}, cursor)
+
+    def test_malformed_cursor(self):
+        self.assertRaises(ValueError, decode_cursor, {'topic': "vaccine"}, "not a cursor")
+        self.assertRaises(ValueError, decode_cursor, {'topic': "vaccine"}, encode_cursor({'topic': "vaccine"}, -1))
+
+    def test_normalized_arguments(self):
+        self.assertEqual(normalize_args({'topic': "vaccine", 'combine': "1"}), normalize_args({'combine': "yes", 'topic': " vaccine "}))
+        self.assertNotEqual(normalize_args({'topic': "vaccine", 'amount': "10"}), normalize_args({'topic': "vaccine", 'amount': "20"}))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+import ResultCache
+from ResultCache import make_key
+
+ARGS = {'topic': "vaccine", 'source': "CNN"}
+OTHER_ARGS = {'topic': "election"}
+
+class KeyTest(unittest.TestCase):
+    def test_generation_is_part_of_key(self):
+        self.assertNotEqual(make_key(ARGS, 1), make_key(ARGS, 2))
+
+    def test_argument_order_doesnt_matter(self):
+        self.assertEqual(make_key({'topic': "vaccine", 'source': "CNN"}, 1), make_key({'source': "CNN", 'topic': "vaccine"}, 1))
+
+    def test_pages_and_article_text_are_cached_apart(self):
+        key = make_key(ARGS, 1)
+        self.assertNotEqual(key, make_key(dict(ARGS, cursor="abc"), 1))
+        self.assertNotEqual(key, make_key(dict(ARGS, page_size="10"), 1))
+        self.assertNotEqual(key, make_key(dict(ARGS, articletext="true"), 1))
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = ResultCache.ResultCache(max_bytes=100)
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get(make_key(ARGS, 1)))
+        self.cache.put(make_key(ARGS, 1), "result", 10)
+        self.assertEqual(self.cache.get(make_key(ARGS, 1)), "result")
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries'], stats['bytes']), (1, 1, 1, 10))
+
+    def test_new_generation_drops_older_entries(self):
+        self.cache.put(make_key(ARGS, 1), "old", 10)
+        self.cache.put(make_key(OTHER_ARGS, 1), "old other", 10)
+        self.cache.put(make_key(ARGS, 2), "new", 10)
+        self.assertIsNone(self.cache.get(make_key(OTHER_ARGS, 1)))
+        self.assertEqual(self.cache.get(make_key(ARGS, 2)), "new")
+        stats = self.cache.stats()
+        self.assertEqual((stats['generation'], stats['entries'], stats['bytes'], stats['evictions']), (2, 1, 10, 2))
+
+    def test_result_from_older_generation_is_not_stored(self):
+        # A request that searched before a commit can finish after one that searched after it
+        self.cache.put(make_key(ARGS, 2), "new", 10)
+        self.cache.put(make_key(OTHER_ARGS, 1), "stale", 10)
+        self.assertIsNone(self.cache.get(make_key(OTHER_ARGS, 1)))
+        self.assertEqual(self.cache.stats()['generation'], 2)
+
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = (make_key({'topic': topic}, 1) for topic in ("first", "second", "third"))
+        self.cache.put(first, "first", 40)
+        self.cache.put(second, "second", 40)
+        self.cache.get(first)
+        self.cache.put(third, "third", 40)
+        self.assertIsNone(self.cache.get(second))
+        self.assertEqual(self.cache.get(first), "first")
+        self.assertEqual(self.cache.get(third), "third")
+        self.assertEqual(self.cache.stats()['bytes'], 80)
+
+    def test_replacing_an_entry_counts_its_size_once(self):
+        self.cache.put(make_key(ARGS, 1), "result", 60)
+        self.cache.put(make_key(ARGS, 1), "result", 60)
+        self.assertEqual(self.cache.stats()['bytes'], 60)
+        self.assertEqual(self.cache.get(make_key(ARGS, 1)), "result")
+
+    def test_value_larger_than_cache_is_not_stored(self):
+        self.cache.put(make_key(ARGS, 1), "small", 10)
+        self.cache.put(make_key(OTHER_ARGS, 1), "huge", 101)
+        self.assertIsNone(self.cache.get(make_key(OTHER_ARGS, 1)))
+        self.assertEqual(self.cache.get(make_key(ARGS, 1)), "small")
+
+    def test_entries_expire_after_ttl(self):
+        now = [1000.0]
+        with mock.patch.object(ResultCache, 'time', lambda: now[0]):
+            cache = ResultCache.ResultCache(max_bytes=100, ttl=60)
+            cache.put(make_key(ARGS, 1), "result", 10)
+            now[0] += 59
+            self.assertEqual(cache.get(make_key(ARGS, 1)), "result")
+            now[0] += 1
+            self.assertIsNone(cache.get(make_key(ARGS, 1)))
+            self.assertEqual(cache.stats()['bytes'], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from whoosh import index
+import Scrape
+from QueryPlanner import plan_query
+from SearcherPool import ShardedSearcherPool
+from Shards import ShardRouter
+from timings import StageTimer
+
+# WebAPI reads the index and body store locations from a config module at import
+CONFIG_DIR = tempfile.mkdtemp()
+with open(os.path.join(CONFIG_DIR, "config.py"), 'w') as config_file:
+    config_file.write("ARTICLE_INDEX_NAME = {0!r}\nBODY_STORE_PATH = {1!r}\n".format(os.path.join(CONFIG_DIR, "articleIndex"), os.path.join(CONFIG_DIR, "bodies.sqlite3")))
+sys.path.insert(0, CONFIG_DIR)
+import WebAPI
+
+WORDS = "virus vaccine economy market election court storm sports health technology climate energy border trade school police".split()
+
+def tearDownModule():
+    WebAPI.body_store.close()
+    shutil.rmtree(CONFIG_DIR)
+
+class TiedScoresTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.ix = index.create_in(directory, Scrape.article_schema())
+        # Titles of the same length give every match of a term the same score
+        generator = random.Random(2)
+        writer = self.ix.writer()
+        for number in range(1000):
+            writer.add_document(ID=str(number), title=" ".join(generator.sample(WORDS, 4)), description=" ".join(generator.sample(WORDS, 8)))
+        writer.commit()
+
+    def test_union_of_tied_scores_finishes(self):
+        args = {'topic': "title:virus OR title:vaccine", 'amount': "10"}
+        plan = plan_query(args, self.ix.schema)
+        pages = []
+        with self.ix.searcher() as searcher:
+            # The search runs on a daemon thread, a hanging one can't keep the test from failing
+            thread = threading.Thread(target=lambda: pages.append(WebAPI.search_page([searcher], plan, StageTimer(enabled=False), args)), daemon=True)
+            thread.start()
+            thread.join(10)
+            self.assertFalse(thread.is_alive(), "search_page didn't finish")
+        page, next_cursor = pages[0]
+        self.assertEqual(len(page), 10)
+        self.assertIsNone(next_cursor)
+
+class ShardedPagingTest(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        router = ShardRouter(root, Scrape.article_schema())
+        # Every title has a different length, so every hit has a different score
+        for month in range(1, 4):
+            writer = router.get_for_date(datetime(2021, month, 1)).writer()
+            for number in range(month, 30, 3):
+                writer.add_document(ID=str(number), title=" ".join(["vaccine"] + ["news"] * number), date=datetime(2021, month, 15))
+            writer.commit()
+        self.pool = ShardedSearcherPool(root, refresh_interval=0)
+        self.addCleanup(self.pool.close)
+
+    def search(self, args):
+        plan = plan_query(args, self.pool.schema)
+        with self.pool.searchers(plan.start_date, plan.end_date) as searchers:
+            page, next_cursor = WebAPI.search_page(searchers, plan, StageTimer(enabled=False), args)
+            return [searcher.stored_fields(docnum)['ID'] for searcher, docnum in page], next_cursor
+
+    def test_pages_walk_the_unpaged_hits(self):
+        args = {'topic': "vaccine", 'amount': "25"}
+        hits, next_cursor = self.search(args)
+        self.assertEqual(len(hits), 25)
+        self.assertIsNone(next_cursor)
+
+        paged_hits = []
+        cursor = None
+        for _ in range(10):
+            page_args = dict(args, page_size="7")
+            if cursor is not None:
+                page_args['cursor'] = cursor
+            page, cursor = self.search(page_args)
+            self.assertLessEqual(len(page), 7)
+            paged_hits += page
+            if cursor is None:
+                break
+        self.assertEqual(paged_hits, hits)
+
+    def test_last_page_has_no_cursor(self):
+        args = {'topic': "vaccine", 'amount': "100", 'page_size': "10"}
+        _, cursor = self.search(args)
+        page, cursor = self.search(dict(args, cursor=cursor))
+        self.assertEqual(len(page), 10)
+        page, cursor = self.search(dict(args, cursor=cursor))
+        self.assertEqual(len(page), 9)
+        self.assertIsNone(cursor)
+
+    def test_page_ending_on_last_hit_has_no_cursor(self):
+        args = {'topic': "vaccine", 'amount': "100", 'page_size': "29"}
+        page, cursor = self.search(args)
+        self.assertEqual(len(page), 29)
+        self.assertIsNone(cursor)
+
+class CollapseTest(unittest.TestCase):
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        router = ShardRouter(root, Scrape.article_schema())
+        # The same story was reported in March and April, with a third copy later in April
+        articles = [("march", "virus", "story", datetime(2021, 3, 30)), ("april", "virus virus", "story", datetime(2021, 4, 1)),
+                    ("april copy", "virus", "story", datetime(2021, 4, 2)), ("other", "virus news", "other", datetime(2021, 4, 3)),
+                    ("unclustered", "virus report", None, datetime(2021, 4, 4))]
+        for document_id, title, cluster, date in articles:
+            writer = router.get_for_date(date).writer()
+            document = {'ID': document_id, 'title': title, 'date': date}
+            if cluster is not None:
+                document['cluster'] = cluster
+            writer.add_document(**document)
+            writer.commit()
+        self.pool = ShardedSearcherPool(root, refresh_interval=0)
+        self.addCleanup(self.pool.close)
+
+    def search(self, args):
+        plan = plan_query(args, self.pool.schema)
+        with self.pool.searchers(plan.start_date, plan.end_date) as searchers:
+            page, next_cursor = WebAPI.search_page(searchers, plan, StageTimer(enabled=False), args)
+            return [searcher.stored_fields(docnum)['ID'] for searcher, docnum in page], next_cursor
+
+    def test_collapse_keeps_best_hit_of_each_cluster(self):
+        hits, _ = self.search({'topic': "virus", 'collapse': "true"})
+        self.assertEqual(sorted(hits), ["april", "other", "unclustered"])
+        self.assertEqual(hits[0], "april")
+
+    def test_without_collapse_every_hit_is_kept(self):
+        hits, _ = self.search({'topic': "virus"})
+        self.assertEqual(len(hits), 5)
+
+    def test_page_after_dropped_duplicates(self):
+        args = {'topic': "virus", 'collapse': "true", 'page_size': "2"}
+        first_page, cursor = self.search(args)
+        self.assertEqual(len(first_page), 2)
+        self.assertIsNotNone(cursor)
+        second_page, cursor = self.search(dict(args, cursor=cursor))
+        self.assertEqual(sorted(first_page + second_page), ["april", "other", "unclustered"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import shutil
+import tempfile
+import unittest
+from whoosh import index
+from whoosh.query import Every
+import Scrape
+from SearcherPool import SearcherPool
+
+def add_articles(ix, *document_ids):
+    writer = ix.writer()
+    for document_id in document_ids:
+        writer.add_document(ID=document_id, title="Article " + document_id)
+    writer.commit()
+
+class SearcherPoolTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.ix = index.create_in(directory, Scrape.article_schema())
+        add_articles(self.ix, "1")
+        self.pool = SearcherPool(directory, pool_size=1, refresh_interval=0)
+        self.addCleanup(self.pool.close)
+
+    def ids(self, searcher):
+        return sorted(hit['ID'] for hit in searcher.search(Every(), limit=None))
+
+    def test_searcher_is_reused(self):
+        with self.pool.searcher() as first:
+            pass
+        with self.pool.searcher() as second:
+            self.assertIs(second, first)
+
+    def test_concurrent_borrows_get_separate_searchers(self):
+        with self.pool.searcher() as first, self.pool.searcher() as second:
+            self.assertIsNot(first, second)
+        # Only pool_size searchers are kept, the other one is closed
+        self.assertEqual(self.pool.idle.qsize(), 1)
+
+    def test_new_commit_is_picked_up(self):
+        with self.pool.searcher() as searcher:
+            generation = self.pool.generation()
+            self.assertEqual(self.ids(searcher), ["1"])
+        add_articles(self.ix, "2")
+        self.assertNotEqual(self.pool.generation(), generation)
+        with self.pool.searcher() as searcher:
+            self.assertEqual(self.ids(searcher), ["1", "2"])
+            self.assertEqual(searcher.reader().generation(), self.pool.generation())
+
+    def test_generation_is_only_checked_every_refresh_interval(self):
+        self.pool.refresh_interval = 3600
+        generation = self.pool.generation()
+        with self.pool.searcher():
+            pass
+        add_articles(self.ix, "2")
+        self.assertEqual(self.pool.generation(), generation)
+        with self.pool.searcher() as searcher:
+            self.assertEqual(self.ids(searcher), ["1"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from whoosh import index
+import Scrape
+from QueryPlanner import plan_query
+from SearcherPool import ShardedSearcherPool
+from Shards import LEGACY_SHARD, ShardRouter, list_shards, shard_name, shard_overlaps, shard_range
+
+class ShardRangeTest(unittest.TestCase):
+    def test_shard_name(self):
+        self.assertEqual(shard_name(datetime(2021, 3, 31, 23, 59)), "2021-03")
+
+    def test_range_of_month(self):
+        self.assertEqual(shard_range("2021-03"), (datetime(2021, 3, 1), datetime(2021, 4, 1)))
+
+    def test_range_of_december(self):
+        self.assertEqual(shard_range("2021-12"), (datetime(2021, 12, 1), datetime(2022, 1, 1)))
+
+    def test_overlaps(self):
+        self.assertTrue(shard_overlaps("2021-03", None, None))
+        self.assertTrue(shard_overlaps("2021-03", datetime(2021, 3, 31), datetime(2021, 4, 15)))
+        self.assertTrue(shard_overlaps("2021-03", datetime(2021, 2, 1), datetime(2021, 3, 1)))
+        self.assertFalse(shard_overlaps("2021-03", datetime(2021, 4, 1), None))
+        self.assertFalse(shard_overlaps("2021-03", None, datetime(2021, 2, 28)))
+
+    def test_legacy_shard_always_overlaps(self):
+        self.assertTrue(shard_overlaps(LEGACY_SHARD, datetime(2030, 1, 1), datetime(2030, 1, 31)))
+
+class ShardPruningTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        router = ShardRouter(self.root, Scrape.article_schema())
+        for number, date in enumerate([datetime(2021, 1, 15), datetime(2021, 2, 15), datetime(2021, 3, 15)]):
+            writer = router.get_for_date(date).writer()
+            writer.add_document(ID=str(number), title="Vaccine news", source="CNN", date=date)
+            writer.commit()
+        self.pool = ShardedSearcherPool(self.root, refresh_interval=0)
+        self.addCleanup(self.pool.close)
+
+    def shard_names(self, start_date, end_date):
+        with self.pool.shard_searchers(start_date, end_date) as named_searchers:
+            return [name for name, _ in named_searchers]
+
+    def test_shards_are_listed_newest_first(self):
+        self.assertEqual(list_shards(self.root), ["2021-03", "2021-02", "2021-01"])
+
+    def test_only_overlapping_shards_are_searched(self):
+        self.assertEqual(self.shard_names(None, None), ["2021-03", "2021-02", "2021-01"])
+        self.assertEqual(self.shard_names(datetime(2021, 2, 10), datetime(2021, 2, 20)), ["2021-02"])
+        self.assertEqual(self.shard_names(datetime(2021, 1, 31), datetime(2021, 2, 1)), ["2021-02", "2021-01"])
+        self.assertEqual(self.shard_names(datetime(2021, 4, 1), None), [])
+
+    def test_plan_date_range_prunes_shards(self):
+        plan = plan_query({'topic': "vaccine", 'start_date': "02-01-2021", 'end_date': "02-28-2021", 'combine': "true"}, self.pool.schema)
+        with self.pool.shard_searchers(plan.start_date, plan.end_date) as named_searchers:
+            self.assertEqual([name for name, _ in named_searchers], ["2021-02"])
+            self.assertEqual([hit['ID'] for hit in named_searchers[0][1].search(plan.query, filter=plan.filter)], ["1"])
+
+    def test_legacy_index_is_always_searched(self):
+        legacy = index.create_in(self.root, Scrape.article_schema())
+        writer = legacy.writer()
+        writer.add_document(ID="legacy", title="Vaccine news", date=datetime(2019, 6, 1))
+        writer.commit()
+        self.assertEqual(list_shards(self.root)[-1], LEGACY_SHARD)
+        self.assertEqual(self.shard_names(datetime(2021, 2, 10), datetime(2021, 2, 20)), ["2021-02", LEGACY_SHARD])
+
+    def test_new_shard_is_picked_up(self):
+        version = self.pool.generation()
+        writer = ShardRouter(self.root, Scrape.article_schema()).get_for_date(datetime(2021, 4, 15)).writer()
+        writer.add_document(ID="3", title="Vaccine news", date=datetime(2021, 4, 15))
+        writer.commit()
+        self.assertGreater(self.pool.generation(), version)
+        self.assertEqual(self.shard_names(datetime(2021, 4, 1), None), ["2021-04"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import threading
+from time import perf_counter
+
+class _Stage:
+    __slots__ = ('timer', 'name', 'start')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timer.add(self.name, perf_counter() - self.start)
+        return False
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class StageTimer:
+    """Adds up the time spent in each stage of a request
+
+    Use "with timer.stage(name):" around a stage, or timer.add() for
+    durations measured elsewhere, e.g. in a worker process. The totals are
+    only kept when enabled is set, observe is called with every duration
+    either way, e.g. to feed a metrics histogram. A disabled timer without
+    observe hands out a shared no-op stage, so leaving the instrumentation
+    in the hot path costs next to nothing when timings aren't wanted."""
+
+    def __init__(self, enabled = True, observe = None):
+        self.enabled = enabled
+        self.observe = observe
+        self.stages = {}
+        self.lock = threading.Lock()
+
+    def stage(self, name):
+        if not self.enabled and self.observe is None:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def add(self, name, seconds, count = 1):
+        if self.observe is not None:
+            self.observe(name, seconds, count)
+        if not self.enabled:
+            return
+        with self.lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                self.stages[name] = [seconds, count]
+            else:
+                totals[0] += seconds
+                totals[1] += count
+
+    def as_dict(self):
+        """Get the total seconds and amount of times each stage ran"""
+
+        with self.lock:
+            return {name: {'seconds': round(totals[0], 4), 'count': totals[1]} for name, totals in self.stages.items()}
+
+NULL_TIMER = StageTimer(enabled=False)
+
+class Deadline:
+    """Point in time by which a request has to be answered
+
+    Pass the same deadline to every stage of a request. A stage that stops
+    waiting for work because the deadline passed sets expired, so the
+    caller knows its results are partial."""
+
+    def __init__(self, seconds = None):
+        self.end = None
+        if seconds is not None:
+            self.end = perf_counter() + seconds
+        self.expired = False
+
+    def remaining(self):
+        """Get the seconds left, None if there is no deadline"""
+
+        if self.end is None:
+            return None
+        return max(0.0, self.end - perf_counter())
+
+    def limit(self, seconds):
+        """Cap a timeout at the seconds left"""
+
+        if self.end is None:
+            return seconds
+        return min(seconds, self.remaining())
+
+NO_DEADLINE = Deadline()